@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 import argparse
+import asyncio
 import hashlib
 import json
 import os
@@ -7,16 +8,38 @@ import pathlib
 import shutil
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
 import urllib.request
 from subprocess import CalledProcessError
 
 import yaml
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
 from typing import Optional, Union
 
+# Modules of the manager package, available when run with the manager venv. They must only depend on the standard
+# library and yaml, this script falls back to plain docker compose commands without them.
+try:
+    # Dependency order of the compose services
+    from millegrilles_instance.apps.ComposeGraph import ComposeDependencyGraph
+except ImportError:
+    ComposeDependencyGraph = None
+
+try:
+    # Concurrent image pulls with progress
+    from millegrilles_instance.apps.ImagePrefetch import ImagePrefetch, ImagePrefetchProgress, compose_images, \
+        compose_pull_always, format_progress
+except ImportError:
+    ImagePrefetch = None
+
 DEFAULT_CATALOGUE_URL = "https://libs.millegrilles.com/archives/stable.json"
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+DEFAULT_PARALLEL_DOWNLOADS = 4
+DEFAULT_PARALLEL_PULLS = 3
 
 def run_command(command, env=None, no_exit=False, capture_output=True) -> Union[str, int]:
     try:
@@ -34,22 +57,177 @@ def run_command(command, env=None, no_exit=False, capture_output=True) -> Union[
             raise e
         sys.exit(1)
 
-def download_file(url: str, dest_path: pathlib.Path):
-    """Downloads a file from a URL to the specified destination."""
+class RateLimiter:
+    """Download bandwidth limit shared by the download threads."""
+
+    def __init__(self, rate: int):
+        """
+        :param rate: Bytes per second
+        """
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def consume(self, count: int):
+        """Waits for the turn of count bytes already read."""
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next_time, now)
+            self.next_time = start + count / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+class HashingReader:
+    """Read-only file object, computes the SHA256 of everything read from the wrapped stream."""
+
+    def __init__(self, raw, limiter: Optional[RateLimiter] = None):
+        self.raw = raw
+        self.limiter = limiter
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1) -> bytes:
+        data = self.raw.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        if self.limiter:
+            self.limiter.consume(len(data))
+        return data
+
+    def readinto(self, buffer) -> int:
+        count = self.raw.readinto(buffer)
+        if count:
+            self.sha256.update(memoryview(buffer)[:count])
+            self.size += count
+            if self.limiter:
+                self.limiter.consume(count)
+        return count
+
+    def drain(self) -> str:
+        """Reads the rest of the stream (e.g. padding after the end of the tar archive), returns the hex digest."""
+        view = memoryview(bytearray(DOWNLOAD_BUFFER_SIZE))
+        while self.readinto(view):
+            pass
+        return self.sha256.hexdigest()
+
+def strip_first_component(path: str) -> str:
+    parts = [p for p in path.split('/') if p not in ('', '.')]
+    return '/'.join(parts[1:])
+
+def strip_components_filter(member: tarfile.TarInfo, dest_path: str) -> Optional[tarfile.TarInfo]:
+    """
+    Extraction filter, same as tar --strip-components=1 followed by the tarfile 'data' filter: rejects paths and
+    links leaving the destination, device files and unsafe permissions.
+    """
+    name = strip_first_component(member.name)
+    if not name:
+        return None  # Top directory
+    changes = {'name': name}
+    if member.islnk():
+        changes['linkname'] = strip_first_component(member.linkname)  # Hard links are relative to the archive root
+    return tarfile.data_filter(member.replace(**changes, deep=False), dest_path)
+
+def download_and_extract(url: str, extract_dir: pathlib.Path, limiter: Optional[RateLimiter] = None) -> str:
+    """
+    Single pass over the package: the download is hashed while it is extracted as a stream into extract_dir.
+    Nothing is installed from extract_dir until the caller has checked the hash.
+    :return: SHA256 hex digest of the package
+    :raises OSError: On a download error
+    :raises tarfile.TarError: On an invalid package or an unsafe member
+    """
+    with urllib.request.urlopen(url) as response:
+        reader = HashingReader(response, limiter)
+        with tarfile.open(fileobj=reader, mode='r|*', bufsize=DOWNLOAD_BUFFER_SIZE) as tar:
+            tar.extractall(extract_dir, filter=strip_components_filter)
+        return reader.drain()
+
+class PackageError(Exception):
+    pass
+
+class StagedPackage:
+    """Package downloaded, verified and extracted in a staging directory, not installed yet."""
+
+    def __init__(self, url: str, extract_dir: pathlib.Path, sha256: str, metadata: dict):
+        self.url = url
+        self.extract_dir = extract_dir
+        self.sha256 = sha256
+        self.metadata = metadata
+        self.name: str = metadata['name']
+        self.version: str = metadata['version']
+        self.app_path: Optional[str] = metadata.get('path')
+
+    @property
+    def compose_file(self) -> Optional[pathlib.Path]:
+        docker_compose = self.extract_dir / "docker-compose.yml"
+        return docker_compose if docker_compose.exists() else None
+
+def stage_package(pkg_url: str, expected_hash: Optional[str], extract_dir: pathlib.Path,
+                  limiter: Optional[RateLimiter] = None) -> StagedPackage:
+    """
+    Downloads, verifies and extracts a package. Safe to run in parallel threads.
+    :raises PackageError: When the package cannot be downloaded or is invalid
+    """
+    os.makedirs(extract_dir, exist_ok=True)
+    print(f"Downloading and extracting {pkg_url}...")
     try:
-        with urllib.request.urlopen(url) as response, open(dest_path, 'wb') as out_file:
-            shutil.copyfileobj(response, out_file)
-    except Exception as e:
-        print(f"Error downloading {url}: {e}")
-        sys.exit(1)
-
-def calculate_sha256(file_path: pathlib.Path) -> str:
-    """Calculates the SHA256 hash of a file."""
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
+        actual_hash = download_and_extract(pkg_url, extract_dir, limiter)
+    except (OSError, tarfile.TarError) as e:
+        raise PackageError(f"Error installing {pkg_url}: {e}")
+
+    if expected_hash:
+        print(f"Verifying hash of {pkg_url}...")
+        if actual_hash != expected_hash:
+            raise PackageError(f"Error: Hash mismatch! Expected {expected_hash}, got {actual_hash}")
+
+    metadata_file = extract_dir / "metadata.json"
+    if not metadata_file.exists():
+        raise PackageError(f"Error: metadata.json not found in package {pkg_url}.")
+    with open(metadata_file, 'r') as f:
+        metadata = json.load(f)
+
+    return StagedPackage(pkg_url, extract_dir, actual_hash, metadata)
+
+class FileTransaction:
+    """
+    Keeps the original version of the files and directories changed while installing packages, restores them
+    on rollback.
+    """
+
+    def __init__(self, backup_dir: pathlib.Path):
+        self.backup_dir = backup_dir
+        self.originals: list[tuple[pathlib.Path, Optional[pathlib.Path]]] = list()  # (path, backup or None when new)
+        self.paths: set[pathlib.Path] = set()
+
+    def backup(self, path: pathlib.Path, move=False):
+        """
+        Call before changing, replacing or removing path. Only the first call for a path keeps a copy.
+        :param move: The caller replaces the whole directory, move it instead of copying it
+        """
+        if path in self.paths:
+            return
+        self.paths.add(path)
+        backup_path = None
+        if path.exists() or path.is_symlink():
+            backup_path = self.backup_dir / str(len(self.originals))
+            os.makedirs(self.backup_dir, exist_ok=True)
+            if move:
+                shutil.move(path, backup_path)
+            elif path.is_dir() and not path.is_symlink():
+                shutil.copytree(path, backup_path, symlinks=True)
+            else:
+                shutil.copy2(path, backup_path, follow_symlinks=False)
+        self.originals.append((path, backup_path))
+
+    def rollback(self):
+        for path, backup_path in reversed(self.originals):
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path, ignore_errors=True)
+            elif path.exists() or path.is_symlink():
+                path.unlink()
+            if backup_path is not None:
+                shutil.move(backup_path, path)
+        self.originals.clear()
+        self.paths.clear()
 
 def copy_file(src: pathlib.Path, dest: pathlib.Path):
     """Copies a file from src to dest, preserving metadata."""
@@ -92,6 +270,21 @@ def load_service_names(docker_compose_file: pathlib.Path) -> list[str]:
     service_names = yaml_app_file['services'].keys()
     return list(service_names)
 
+def load_service_waves(docker_compose_file: pathlib.Path, stop=False) -> list[list[str]]:
+    """
+    :param stop: Dependents first (stop/remove), otherwise dependencies first
+    :return: Services by wave, the services of a wave can be handled in parallel
+    """
+    service_names = load_service_names(docker_compose_file)
+    if ComposeDependencyGraph is None:
+        # No dependency graph, one service at a time in reverse declaration order
+        service_names.reverse()
+        return [[s] for s in service_names]
+    graph = ComposeDependencyGraph.build([docker_compose_file])
+    if stop:
+        return graph.stop_waves(service_names)
+    return graph.restart_waves(service_names)
+
 
 # def restart_compose_applications(instance_name: str):
 #     # Need to generate certificates first to avoid reload issue with applications service
@@ -114,6 +307,7 @@ class AppManager:
         self.compose_dir = self.etc_dir / "compose"
         self.compose_apps_yaml = self.compose_dir / "applications.yml"
         self.compose_apps_dir = self.compose_dir / "applications"
+        self.pending_reloads: dict[str, bool] = dict()  # service: cert_required
 
         # Ensure directories exist
         os.makedirs(self.nginx_apps_conf_dir, exist_ok=True)
@@ -173,122 +367,169 @@ class AppManager:
 
     def install_from_package(self, pkg_url: str, expected_hash: Optional[str], noreload = False):
         with tempfile.TemporaryDirectory() as tmp_dir:
-            pkg_path = pathlib.Path(tmp_dir) / "package.tar.gz"
-            print(f"Downloading {pkg_url}...")
-            download_file(pkg_url, pkg_path)
-            
-            if expected_hash:
-                print("Verifying hash...")
-                actual_hash = calculate_sha256(pkg_path)
-                if actual_hash != expected_hash:
-                    print(f"Error: Hash mismatch! Expected {expected_hash}, got {actual_hash}")
-                    sys.exit(1)
-            
-            extract_dir = pathlib.Path(tmp_dir) / "extracted"
-            os.makedirs(extract_dir, exist_ok=True)
-            print("Extracting package...")
-            run_command(f"tar -xf {pkg_path} -C {extract_dir} --strip-components=1")
-  
-            # 1. Read metadata.json
-            metadata_file = extract_dir / "metadata.json"
-            if not metadata_file.exists():
-                print("Error: metadata.json not found in package.")
+            # Staging directory, removed with the temporary directory when the package is rejected
+            try:
+                package = stage_package(pkg_url, expected_hash, pathlib.Path(tmp_dir) / "extracted")
+            except PackageError as e:
+                print(e)
                 sys.exit(1)
-            
-            with open(metadata_file, 'r') as f:
-                metadata = json.load(f)
-            
-            name = metadata['name']
-            version = metadata['version']
-            app_path = metadata.get('path')
+
+            # Download docker images before changing anything
+            if package.compose_file:
+                self.download_images(package.compose_file)
+
+            transaction = FileTransaction(pathlib.Path(tmp_dir) / "backup")
+            try:
+                self.apply_package(package, transaction)
+            except Exception:
+                print(f"Error installing {package.name}, restoring previous files")
+                transaction.rollback()
+                raise
+
+            if not noreload:
+                self.apply_reloads()
  
-            print(f"Installing {name} (version: {version}, path: {app_path})...")
+            print("Installation complete.")
+
+    def update_packages(self, updates: list[dict], parallel=DEFAULT_PARALLEL_DOWNLOADS, limit_rate: Optional[int] = None,
+                        noreload = False):
+        """
+        Downloads and verifies the packages and pulls their images in parallel, then installs all of them as one
+        transaction followed by a single reload. Nothing is installed when a package fails.
+        :param parallel: Maximum number of concurrent downloads and image pulls
+        :param limit_rate: Total download bandwidth in bytes per second, None for no limit
+        """
+        limiter = RateLimiter(limit_rate) if limit_rate else None
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = pathlib.Path(tmp_dir)
+
+            # 1. Download, verify and extract
+            with ThreadPoolExecutor(max_workers=parallel) as executor:
+                futures = [executor.submit(stage_package, u['url'], u['sha256'], tmp_path / "staging" / u['name'], limiter)
+                           for u in updates]
+            packages = list()
+            errors = list()
+            for future in futures:
+                try:
+                    packages.append(future.result())
+                except PackageError as e:
+                    errors.append(e)
+            if errors:
+                for e in errors:
+                    print(e)
+                print("No application updated.")
+                sys.exit(1)
+
+            # 2. Download docker images, images shared by several applications are pulled once
+            compose_files = [p.compose_file for p in packages if p.compose_file]
+            if compose_files:
+                self.download_images(*compose_files, parallel=parallel)  # Exits on a failed pull, nothing is installed yet
+
+            # 3. Install all packages
+            transaction = FileTransaction(tmp_path / "backup")
+            try:
+                for package in packages:
+                    self.apply_package(package, transaction)
+            except Exception:
+                print("Error installing updates, restoring previous files")
+                transaction.rollback()
+                raise
+
+            # 4. Reload once, this will restart all changed applications at the same time
+            if not noreload:
+                print("Reloading all applications...")
+                self.apply_reloads()
+
+    def apply_package(self, package: StagedPackage, transaction: FileTransaction):
+        """
+        Installs the files of a staged package. Files are backed up in the transaction before being changed.
+        """
+        extract_dir = package.extract_dir
+        name = package.name
+        app_path = package.app_path
+
+        print(f"Installing {name} (version: {package.version}, path: {app_path})...")
  
-            # 2. Handle Nginx Config
-            nginx_conf_dir = extract_dir / "nginx"
-            if nginx_conf_dir.exists():
-                for f in nginx_conf_dir.iterdir():
-                    if f.is_file():
-                        # Store with "[package name]__[config file name]", allows easy association to package for uninstallation.
-                        dest_nginx_conf = self.nginx_apps_conf_dir / f"{name}__{f.name}"
-                        print(f"Configuring Nginx, adding file: {dest_nginx_conf}")
-                        copy_file(f, dest_nginx_conf)
+        # 2. Handle Nginx Config
+        nginx_conf_dir = extract_dir / "nginx"
+        if nginx_conf_dir.exists():
+            for f in nginx_conf_dir.iterdir():
+                if f.is_file():
+                    # Store with "[package name]__[config file name]", allows easy association to package for uninstallation.
+                    dest_nginx_conf = self.nginx_apps_conf_dir / f"{name}__{f.name}"
+                    print(f"Configuring Nginx, adding file: {dest_nginx_conf}")
+                    transaction.backup(dest_nginx_conf)
+                    copy_file(f, dest_nginx_conf)
  
-            # 3. Handle Docker Compose
-            docker_compose = extract_dir / "docker-compose.yml"
-            compose_installed = False
-            if docker_compose.exists():
-                # Parse the file to ensure it is properly formatted
-                with open(docker_compose) as f:
-                    yaml_app_file = yaml.safe_load(f)
-
-                # Pre-initialize the bind mounts, this avoids permission issues
-                try:
-                    for service_name, service_info in yaml_app_file['services'].items():
-                        try:
-                            for volume in service_info['volumes']:
-                                mount_path = volume.split(":")[0]
-                                if "MILLEGRILLES_ROOT" in mount_path:
-                                    mount_path = mount_path.replace("${MILLEGRILLES_ROOT}", str(self.root))
-                                elif "$" in mount_path:
-                                    continue  # Skip, this could be mongo or filehost (already handled in install script)
-
-                                # Replace variables using env as format
-                                mount_path = mount_path.format(**os.environ)
-                                mount_path_resolved = pathlib.Path(mount_path).resolve()
-
-                                print(f"Creating mount {mount_path_resolved}")
-                                mount_path_resolved.mkdir(parents=True, exist_ok=True)
-                        except KeyError:
-                            pass
-                except KeyError:
-                    pass
-
-                dest_docker_compose = self.compose_apps_dir / f"{name}.yml"
-                print(f"Configuring Docker Compose: {dest_docker_compose}")
-                copy_file(docker_compose, dest_docker_compose)
-                compose_installed = True
-                # Add application file to applications.yml include list
-                app_yaml_filepath = str(dest_docker_compose.relative_to(self.compose_dir))
-                with open(self.compose_apps_yaml) as f:
-                    yaml_app_file = yaml.safe_load(f)
-                yaml_includes: list = yaml_app_file['include']
-                if app_yaml_filepath not in yaml_includes:
-                    # Append new app to list and overwrite app file
-                    yaml_includes.append(app_yaml_filepath)
-                    with open(self.compose_apps_yaml, 'w') as f:
-                        yaml.safe_dump(yaml_app_file, f)
-            else:
-                dest_docker_compose = None
+        # 3. Handle Docker Compose
+        docker_compose = package.compose_file
+        compose_installed = False
+        if docker_compose:
+            # Parse the file to ensure it is properly formatted
+            with open(docker_compose) as f:
+                yaml_app_file = yaml.safe_load(f)
+
+            # Pre-initialize the bind mounts, this avoids permission issues
+            try:
+                for service_name, service_info in yaml_app_file['services'].items():
+                    try:
+                        for volume in service_info['volumes']:
+                            mount_path = volume.split(":")[0]
+                            if "MILLEGRILLES_ROOT" in mount_path:
+                                mount_path = mount_path.replace("${MILLEGRILLES_ROOT}", str(self.root))
+                            elif "$" in mount_path:
+                                continue  # Skip, this could be mongo or filehost (already handled in install script)
+
+                            # Replace variables using env as format
+                            mount_path = mount_path.format(**os.environ)
+                            mount_path_resolved = pathlib.Path(mount_path).resolve()
+
+                            print(f"Creating mount {mount_path_resolved}")
+                            mount_path_resolved.mkdir(parents=True, exist_ok=True)
+                    except KeyError:
+                        pass
+            except KeyError:
+                pass
+
+            dest_docker_compose = self.compose_apps_dir / f"{name}.yml"
+            print(f"Configuring Docker Compose: {dest_docker_compose}")
+            transaction.backup(dest_docker_compose)
+            copy_file(docker_compose, dest_docker_compose)
+            compose_installed = True
+            # Add application file to applications.yml include list
+            app_yaml_filepath = str(dest_docker_compose.relative_to(self.compose_dir))
+            with open(self.compose_apps_yaml) as f:
+                yaml_app_file = yaml.safe_load(f)
+            yaml_includes: list = yaml_app_file['include']
+            if app_yaml_filepath not in yaml_includes:
+                # Append new app to list and overwrite app file
+                yaml_includes.append(app_yaml_filepath)
+                transaction.backup(self.compose_apps_yaml)
+                with open(self.compose_apps_yaml, 'w') as f:
+                    yaml.safe_dump(yaml_app_file, f)
  
-            # 4. Handle Application Files
-            app_files_dir = extract_dir / "files"
-            if app_path and app_files_dir.exists():
-                dest_html_dir = self.nginx_apps_html_dir / app_path
-                print(f"Deploying application files to {dest_html_dir}...")
-                remove_dir(dest_html_dir)
-                copy_dir(app_files_dir, dest_html_dir)
+        # 4. Handle Application Files
+        app_files_dir = extract_dir / "files"
+        if app_path and app_files_dir.exists():
+            dest_html_dir = self.nginx_apps_html_dir / app_path
+            print(f"Deploying application files to {dest_html_dir}...")
+            transaction.backup(dest_html_dir, move=True)
+            remove_dir(dest_html_dir)
+            copy_dir(app_files_dir, dest_html_dir)
  
-            # 5. Update local catalogue metadata for this app
-            installed_apps = self.get_installed_apps()
-            installed_apps[name] = metadata
-            self.save_installed_apps(installed_apps)
-
-            # Download docker image
-            if compose_installed and dest_docker_compose:
-                # Download all images required by applications.yml
-                self.download_images(dest_docker_compose)
+        # 5. Update local catalogue metadata for this app
+        installed_apps = self.get_installed_apps()
+        installed_apps[name] = package.metadata
+        transaction.backup(self.installed_apps_file)
+        self.save_installed_apps(installed_apps)
 
-            if not noreload:
-                # 6. Reload middleware
-                if app_path or nginx_conf_dir:
-                    reload_nginx(self.instance_name)
+        # 6. Reload middleware
+        if app_path or nginx_conf_dir:
+            self.request_reload('nginx')
 
-                if compose_installed:
-                    # Reload compose configuration
-                    reload_compose_applications(self.instance_name, True)
- 
-            print("Installation complete.")
+        if compose_installed:
+            # Reload compose configuration
+            self.request_reload('applications', True)
 
     def uninstall(self, name):
         installed_apps = self.get_installed_apps()
@@ -316,9 +557,9 @@ class AppManager:
         # 3. Remove Docker Compose configuration for application
         docker_compose_app_yaml = self.compose_apps_dir / f"{name}.yml"
         if docker_compose_app_yaml.exists():
-            for servic_name in load_service_names(docker_compose_app_yaml):
-                print(f"Stopping Docker Compose service: {servic_name}")
-                run_command(f"docker compose -f {self.compose_apps_yaml} rm -fs {servic_name}")
+            for wave in load_service_waves(docker_compose_app_yaml, stop=True):
+                print(f"Stopping Docker Compose services: {', '.join(wave)}")
+                run_command(f"docker compose -f {self.compose_apps_yaml} rm -fs {' '.join(wave)}")
 
             print(f"Removing Docker Compose file: {docker_compose_app_yaml}")
             os.remove(docker_compose_app_yaml)
@@ -358,11 +599,10 @@ class AppManager:
  
         # 6. Reload Nginx / Restart Appllications (later: remove app only, reload does not work)
         if nginx_reload:
-            print("Reloading nginx")
-            reload_nginx(self.instance_name)
+            self.request_reload('nginx')
         if compose_reload:
-            print("Reloading docker compose applications")
-            reload_compose_applications(self.instance_name, False)
+            self.request_reload('applications')
+        self.apply_reloads()
         print("Uninstallation complete.")
 
     def list_available(self, catalogue_url: str):
@@ -390,19 +630,64 @@ class AppManager:
         for name, info in sorted(installed_apps.items()):
             print(f"{name:<20} {info.get('version', 'N/A'):<10} {info.get('url', 'N/A')}")
 
-    def download_images(self, app_file: pathlib.Path):
+    def download_images(self, *app_files: pathlib.Path, parallel=DEFAULT_PARALLEL_PULLS):
+        """
+        Pulls the docker images of the compose files. An image used by several services or applications is pulled
+        once and images already present are skipped. Exits when an image can't be pulled.
+        :param parallel: Maximum number of concurrent pulls
+        """
         print(f"Downloading docker images for applications...")
-        service_names = load_service_names(app_file)
-        service_names.reverse()  # Reverse to stop applications by dependency
-        for service_name in service_names:
-            run_command(f"docker compose -f {self.root / "etc/compose/applications.yml"} pull {service_name}", capture_output=False)
+        if ImagePrefetch is None:
+            for app_file in app_files:
+                for wave in load_service_waves(app_file):
+                    run_command(f"docker compose -f {app_file} pull {' '.join(wave)}", capture_output=False)
+            return
+
+        images: list[str] = list()
+        always: set[str] = set()
+        for app_file in app_files:
+            with open(app_file) as f:
+                content = yaml.safe_load(f) or dict()
+            images.extend(compose_images(content, dict(os.environ)).keys())
+            always.update(compose_pull_always(content, dict(os.environ)))
+
+        interactive = sys.stdout.isatty()
+
+        def print_progress(progress: ImagePrefetchProgress):
+            line = format_progress(progress)
+            if interactive:
+                print(f"\r{line}\x1b[K", end="\n" if progress['done'] else "", flush=True)
+            else:
+                print(line, flush=True)
+
+        prefetch = ImagePrefetch(docker=os.environ.get('DOCKER') or 'docker', concurrency=parallel,
+                                 progress=print_progress, progress_interval=0.2 if interactive else 5.0)
+        result = asyncio.run(prefetch.prefetch(images, always))
+        if result['failed']:
+            for image, error in result['failed'].items():
+                print(f"Error pulling {image}: {error}")
+            sys.exit(1)
 
     # def remove_app(self, appname: str):
     #     print(f"Downloading docker images for applications...")
     #     run_command(f"docker compose -f {self.root / "etc/compose/applications.yml"} rm -sf {appname}", capture_output=False)
 
-    def reload_compose_applications(self):
-        reload_compose_applications(self.instance_name, True)
+    def request_reload(self, service: str, cert_required=False):
+        """
+        Reloads are merged and run once by apply_reloads(), e.g. after installing several packages.
+        :param service: nginx or applications
+        """
+        self.pending_reloads[service] = self.pending_reloads.get(service, False) or cert_required
+
+    def apply_reloads(self):
+        pending, self.pending_reloads = self.pending_reloads, dict()
+        # Dependency order, nginx proxies the applications
+        if 'applications' in pending:
+            print("Reloading docker compose applications")
+            reload_compose_applications(self.instance_name, pending['applications'])
+        if 'nginx' in pending:
+            print("Reloading nginx")
+            reload_nginx(self.instance_name)
 
 
 def main():
@@ -451,6 +736,8 @@ def main():
     update_parser.add_argument("--catalogue_url", help="Remote catalogue URL", default=DEFAULT_CATALOGUE_URL)
     update_parser.add_argument("--root", required=False, help="MILLEGRILLES_ROOT directory")
     update_parser.add_argument("--noreload", action="store_true", help="Do not reload the systemd services (nginx, applications)")
+    update_parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL_DOWNLOADS, help=f"Concurrent downloads and image pulls (default: {DEFAULT_PARALLEL_DOWNLOADS})")
+    update_parser.add_argument("--limit-rate", type=int, help="Total download bandwidth in KiB/s (default: no limit)")
 
     args = parser.parse_args()
     root = getattr(args, 'root', None)
@@ -513,15 +800,10 @@ def main():
                 print(f"{u['name']:<20} {u['current_version']:<10} {u['available_version']:<10}")
 
             if args.install:
-                # Install applications (noreload=True)
                 for u in updates:
                     print(f"\nUpdating {u['name']} from {u['current_version']} to {u['available_version']}...")
-                    manager.install_from_package(u['url'], u['sha256'], noreload=True)
-
-                if not args.noreload:
-                    # Reload, this will restart all changed applications at the same time
-                    print("Reloading all applications...")
-                    manager.reload_compose_applications()
+                limit_rate = args.limit_rate * 1024 if args.limit_rate else None
+                manager.update_packages(updates, parallel=args.parallel, limit_rate=limit_rate, noreload=args.noreload)
 
                 print("\nAll updates completed.")
 
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import struct
+
+from typing import Optional
+
+# Fields of the apcupsd status published in the system status, see apcaccess(8)
+APC_FIELDS = frozenset([
+    'UPSNAME', 'MODEL', 'SERIALNO', 'STATUS',
+    'LINEV', 'LINEFREQ', 'OUTPUTV', 'LOADPCT', 'NOMPOWER',
+    'BCHARGE', 'BATTV', 'TIMELEFT', 'ITEMP',
+    'XONBATT', 'XOFFBATT', 'NUMXFERS', 'TONBATT', 'CUMONBATT', 'LASTXFER',
+])
+
+# Units removed from the values (same as apcaccess strip_units), longest first
+APC_UNITS = (
+    'Percent Load Capacity', 'Minutes', 'Seconds', 'Percent', 'Volts', 'Watts', 'Amps', 'Hz', 'VA', 'C',
+)
+
+NIS_COMMAND_STATUS = b'status'
+NIS_LENGTH = struct.Struct('>H')  # Each NIS frame is prefixed by its length, a 0 length frame ends a response
+
+
+def parse_status_line(line: str) -> Optional[tuple[str, str]]:
+    """
+    :param line: Status line, e.g. 'LINEV    : 121.0 Volts'
+    :return: (key, value without unit), None when the key is not published
+    """
+    key, sep, value = line.partition(':')
+    if not sep:
+        return None
+    key = key.strip()
+    if key not in APC_FIELDS:
+        return None
+    value = value.strip()
+    for unit in APC_UNITS:
+        if value.endswith(' ' + unit):
+            value = value[:-len(unit) - 1]
+            break
+    return key, value
+
+
+class ApcUpsClient:
+    """
+    Client for the apcupsd network information server (NIS), on asyncio streams.
+
+    The connection is kept open between reads. When the daemon is not reachable, the client retries with an
+    exponential backoff: a daemon started after the instance is picked up without a restart.
+    """
+
+    def __init__(self, host: str, port: int, poll_interval: float, timeout: float = 3.0,
+                 min_backoff: float = 1.0, max_backoff: float = 300.0):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__host = host
+        self.__port = port
+        self.__poll_interval = poll_interval
+        self.__timeout = timeout
+        self.__min_backoff = min_backoff
+        self.__max_backoff = max_backoff
+
+        self.__reader: Optional[asyncio.StreamReader] = None
+        self.__writer: Optional[asyncio.StreamWriter] = None
+        self.__status: Optional[dict[str, str]] = None
+        self.__connected_once = False
+
+    @property
+    def status(self) -> Optional[dict[str, str]]:
+        """ Last status read, None when the daemon is not reachable. """
+        return self.__status
+
+    async def read_status(self) -> dict[str, str]:
+        """
+        Reads the status, opens the connection when needed.
+        """
+        try:
+            return await asyncio.wait_for(self.__read_status(), self.__timeout)
+        except BaseException:
+            await self.close()  # Response state unknown, start over on a new connection
+            raise
+
+    async def __read_status(self) -> dict[str, str]:
+        if self.__writer is None:
+            self.__reader, self.__writer = await asyncio.open_connection(self.__host, self.__port)
+
+        self.__writer.write(NIS_LENGTH.pack(len(NIS_COMMAND_STATUS)) + NIS_COMMAND_STATUS)
+        await self.__writer.drain()
+
+        status: dict[str, str] = dict()
+        while True:
+            length = NIS_LENGTH.unpack(await self.__reader.readexactly(NIS_LENGTH.size))[0]
+            if length == 0:
+                break  # End of response
+            line = (await self.__reader.readexactly(length)).decode('utf-8', errors='replace')
+            item = parse_status_line(line)
+            if item is not None:
+                status[item[0]] = item[1]
+
+        self.__status = status
+        return status
+
+    async def close(self):
+        writer = self.__writer
+        self.__reader = None
+        self.__writer = None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, asyncio.CancelledError):
+                pass
+
+    async def run(self, stopping: asyncio.Event):
+        """
+        Reads the status every poll_interval until stopping is set.
+        """
+        backoff = self.__min_backoff
+        try:
+            while stopping.is_set() is False:
+                try:
+                    await self.read_status()
+                    if backoff > self.__min_backoff or self.__connected_once is False:
+                        self.__logger.info("Connected to apcupsd on %s:%d" % (self.__host, self.__port))
+                    self.__connected_once = True
+                    backoff = self.__min_backoff
+                    delay = self.__poll_interval
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    if backoff == self.__min_backoff:
+                        self.__logger.info("apcupsd not reachable on %s:%d, retrying in %d seconds (%s)" %
+                                           (self.__host, self.__port, backoff, e))
+                    self.__status = None
+                    delay = backoff
+                    backoff = min(backoff * 2, self.__max_backoff)
+
+                try:
+                    await asyncio.wait_for(stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.close()
@@ -0,0 +1,102 @@
+"""
+Lightweight certificate check for the certs_updater timer.
+
+Reads the certificate index summary persisted by the last renewal pass and exits when nothing is due. When a compose
+file changed, a certificate or password is missing, or a certificate is expired, it escalates to the full setup
+(python3 -m millegrilles_instance --init) with the same arguments.
+
+Only standard library modules are imported on the fast path.
+
+Usage: python3 -m millegrilles_instance.CertificateCheck --config /path/to/millegrilles --init
+"""
+import logging
+import os
+import pathlib
+import sys
+import time
+
+from typing import Optional
+
+from millegrilles_instance import Constantes as ConstantesInstance
+from millegrilles_instance.apps.CertificateIndex import CertificateExpiryIndex, file_stamp
+
+LOGGER = logging.getLogger('millegrilles_instance.CertificateCheck')
+
+
+def check_certificates_due(path_millegrilles: pathlib.Path) -> Optional[str]:
+    """
+    :param path_millegrilles: MILLEGRILLES_ROOT of the instance
+    :return: None when nothing is due, otherwise the reason to run the full setup.
+    """
+    index = CertificateExpiryIndex.load(path_millegrilles / "var" / ConstantesInstance.FICHIER_CERTIFICATE_INDEX)
+    summary = index.summary
+    if summary is None:
+        return "no certificate index summary"
+
+    now = time.time()
+
+    for path, stamp in summary['sources'].items():
+        if file_stamp(pathlib.Path(path)) != stamp:
+            return f"compose file changed: {path}"
+
+    manager = summary['manager']
+    if manager is None:
+        return "manager certificate not indexed"
+    manager_stamp = file_stamp(pathlib.Path(manager['path']))
+    if manager_stamp is None or manager_stamp[0] != manager['mtime_ns'] or manager_stamp[2] != manager['size']:
+        return "manager certificate changed"
+    if manager['not_after'] <= now:
+        return "manager certificate expired"
+
+    entries = index.entries
+    for cert_path in summary['certificates']:
+        entry = entries.get(cert_path)
+        stamp = file_stamp(pathlib.Path(cert_path))
+        if entry is None or stamp is None:
+            return f"certificate missing: {cert_path}"
+        if stamp[0] != entry['mtime_ns'] or stamp[2] != entry['size']:
+            return f"certificate changed: {cert_path}"
+        if entry['not_after'] <= now:
+            return f"certificate expired: {cert_path}"
+
+    for password_path in summary['passwords']:
+        if not os.path.exists(password_path):
+            return f"password missing: {password_path}"
+
+    return None
+
+
+def get_config_argument(argv: list[str]) -> Optional[str]:
+    """
+    Extracts --config from the command line. Other arguments are passed through to the full setup.
+    Avoids argparse on the fast path.
+    """
+    for i, arg in enumerate(argv):
+        if arg == '--config' and i + 1 < len(argv):
+            return argv[i + 1]
+        elif arg.startswith('--config='):
+            return arg[len('--config='):]
+    return None
+
+
+def main():
+    logging.basicConfig(format='%(levelname)s:%(name)s:%(message)s', level=logging.INFO)
+
+    root = get_config_argument(sys.argv[1:]) or os.environ.get('MILLEGRILLES_ROOT')
+    if root:
+        reason = check_certificates_due(pathlib.Path(root))
+    else:
+        reason = "instance path not provided"
+
+    if reason is None:
+        LOGGER.info("Certificates and secrets are up to date, nothing to do")
+        return
+
+    LOGGER.info("Running full setup: %s" % reason)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable, '-m', 'millegrilles_instance'] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
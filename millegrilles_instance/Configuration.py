@@ -70,6 +70,11 @@ def _parse_command_line():
         help="Disables all docker related features"
     )
 
+    parser.add_argument(
+        '--profile-startup', type=str, required=False, dest='profile_startup',
+        help="Path of a json file where the import and wiring time of each service is written after startup"
+    )
+
     args = parser.parse_args()
     __adjust_logging(args)
     return args
@@ -93,6 +98,7 @@ class ConfigurationInstance(MilleGrillesBusConfiguration):
 
         self.__path_millegrilles = pathlib.Path(self.__millegrille_env['MILLEGRILLES_ROOT'])
         self.__path_nginx_html = pathlib.Path(self.__millegrille_env['MOUNT_NGINX_HTML'])
+        self.__profile_startup: Optional[pathlib.Path] = None
         self.__init_only = False  # When True, means that the system should run initial setup only (i.e. certs, nginx config, setup directories) then exit
         self.__instance_id = self.__millegrille_env['INSTANCE_ID']
         self.__instance_name = self.__millegrille_env['INSTANCE_NAME']
@@ -113,9 +119,18 @@ class ConfigurationInstance(MilleGrillesBusConfiguration):
         self.__apply_config_env()
 
     def reload_config_env(self):
-        self.__millegrille_env = load_dotenv(self.__path_millegrilles.joinpath('config.env'))
+        self.__millegrille_env = load_dotenv(self.config_env_path)
         self.__apply_config_env()
 
+    @property
+    def config_env_path(self) -> pathlib.Path:
+        return self.__path_millegrilles.joinpath('config.env')
+
+    @property
+    def config_env(self) -> dict[str, str]:
+        """ Copy of the values loaded from config.env """
+        return dict(self.__millegrille_env)
+
     def __apply_config_env(self):
         # Push configuration values to superclass
         try:
@@ -153,6 +168,8 @@ class ConfigurationInstance(MilleGrillesBusConfiguration):
 
     def parse_args(self, args: argparse.Namespace):
         self.__init_only = args.init
+        if args.profile_startup:
+            self.__profile_startup = pathlib.Path(args.profile_startup)
 
     @staticmethod
     def load():
@@ -196,6 +213,10 @@ class ConfigurationInstance(MilleGrillesBusConfiguration):
     def init_only(self) -> bool:
         return self.__init_only
 
+    @property
+    def profile_startup(self) -> Optional[pathlib.Path]:
+        return self.__profile_startup
+
     @property
     def instance_id(self) -> str:
         return self.__instance_id
@@ -224,6 +245,41 @@ class ConfigurationInstance(MilleGrillesBusConfiguration):
 
         return ports
 
+    @property
+    def systemctl(self) -> str:
+        """ systemctl executable used to control the instance units. """
+        return self.__millegrille_env.get('SYSTEMCTL') or 'systemctl'
+
+    @property
+    def docker(self) -> str:
+        """ docker executable used for the compose commands. """
+        return self.__millegrille_env.get('DOCKER') or 'docker'
+
+    @property
+    def docker_data_root(self) -> Optional[pathlib.Path]:
+        """ Docker data root (e.g. /var/lib/docker), the usual locations are searched when not set. """
+        value = self.__millegrille_env.get('DOCKER_DATA_ROOT')
+        return pathlib.Path(value) if value else None
+
+    @property
+    def status_delta_enabled(self) -> bool:
+        """ When True, system status events are sent as periodic keyframes with deltas in between. """
+        return (self.__millegrille_env.get('SYSTEM_STATUS_DELTA') or '').lower() in ('1', 'true', 'yes')
+
+    @property
+    def status_keyframe_interval(self) -> int:
+        return int(self.__millegrille_env.get('SYSTEM_STATUS_KEYFRAME_INTERVAL') or ContantesInstance.SYSTEM_STATUS_KEYFRAME_INTERVAL)
+
+    @property
+    def status_delta_thresholds(self) -> dict[str, float]:
+        """ Overrides of the delta thresholds, format: system_state.cpu_usage_percent=5,system_state.load_average=0.1 """
+        thresholds = dict()
+        for item in (self.__millegrille_env.get('SYSTEM_STATUS_DELTA_THRESHOLDS') or '').split(','):
+            if '=' in item:
+                path, value = item.split('=', 1)
+                thresholds[path.strip()] = float(value)
+        return thresholds
+
     @property
     def securite(self):
         return super().securite
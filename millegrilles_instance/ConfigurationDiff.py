@@ -0,0 +1,80 @@
+import hashlib
+import pathlib
+
+from typing import Optional, TypedDict
+
+from millegrilles_instance import Constantes as ConstantesInstance
+
+# What a configuration change requires from the manager
+RELOAD_NONE = 'none'  # Settings read when used
+RELOAD_BUS = 'bus'  # Reconnect to the MQ bus with the new certificate or connection settings
+RELOAD_RUNLEVEL = 'runlevel'  # Go through the runlevels again (certificates, services)
+
+
+class ConfigurationDiff(TypedDict):
+    """
+    What changed on a context reload, passed to the reload listeners.
+    """
+    full: bool  # Everything was reloaded (startup, reload_wait, delay_reload)
+    config_env: dict[str, tuple[Optional[str], Optional[str]]]  # Changed config.env keys: (old value, new value)
+    certificate: bool  # Instance certificate and key (secrets/manager.pem)
+    ca: bool  # Millegrille CA (etc/millegrille.pem)
+
+
+def reload_action(diff: ConfigurationDiff) -> Optional[str]:
+    """
+    :return: What the manager has to do for a file change, None for a full reload (startup or explicit reload, driven
+             by the runlevel code)
+    """
+    if diff['full']:
+        return None
+    changed_keys = set(diff['config_env'].keys())
+    if changed_keys - ConstantesInstance.CONFIG_ENV_SETTINGS_KEYS - ConstantesInstance.CONFIG_ENV_BUS_KEYS:
+        return RELOAD_RUNLEVEL
+    if diff['certificate'] or diff['ca'] or changed_keys & ConstantesInstance.CONFIG_ENV_BUS_KEYS:
+        return RELOAD_BUS
+    return RELOAD_NONE
+
+
+def diff_env(previous: dict[str, str], current: dict[str, str]) -> dict[str, tuple[Optional[str], Optional[str]]]:
+    """
+    :return: Keys added, removed or changed with their (old, new) values, None when absent
+    """
+    changed = dict()
+    for key in previous.keys() | current.keys():
+        old_value = previous.get(key)
+        new_value = current.get(key)
+        if old_value != new_value:
+            changed[key] = (old_value, new_value)
+    return changed
+
+
+def file_digest(path: pathlib.Path) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).digest()
+    except FileNotFoundError:
+        return None
+
+
+class FileDigests:
+    """
+    Content digest of the files loaded by the context. Touching or rewriting a file with the same content is not
+    a change.
+    """
+
+    def __init__(self):
+        self.__digests: dict[pathlib.Path, Optional[bytes]] = dict()
+
+    def update(self, paths: list[pathlib.Path]) -> set[pathlib.Path]:
+        """
+        Reads the files again.
+        :return: Files with a different content since the previous update
+        """
+        changed = set()
+        for path in paths:
+            digest = file_digest(path)
+            if path not in self.__digests or self.__digests[path] != digest:
+                changed.add(path)
+            self.__digests[path] = digest
+        return changed
@@ -34,6 +34,9 @@ CERTISSUER_PATH = 'CERTISSUER_PATH'
 REPO_ROOT_PATH = 'REPO_ROOT'
 
 REQUETE_GET_PASSWORDS = 'getPasswords'
+REQUETE_SYSTEM_STATE_KEYFRAME = 'getSystemStateKeyframe'
+REQUETE_SYSTEM_HISTORY = 'systemHistory'
+REQUETE_INSTALLED_APPLICATIONS = 'getInstalledApplications'
 COMMANDE_TRANSMETTRE_CATALOGUES = 'transmettreCatalogues'
 COMMANDE_CONFIGURER_DOMAINE = 'configurerDomaine'
 COMMANDE_SET_HOSTNAME = 'setHostname'
@@ -53,8 +56,66 @@ EVENEMENT_TOPOLOGIE_MODIFICATION_CONSIGNATION = 'modificationConsignation'
 EVENEMENT_PRESENCE_INSTANCE = 'presence'
 EVENEMENT_PRESENCE_INSTANCE_V2 = 'presenceInstanceV2'
 EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS = 'presenceInstanceApplications'
+EVENEMENT_PRESENCE_INSTANCE_DELTA = 'presenceInstanceDelta'
+EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_V2 = 'presenceInstanceApplicationsV2'
+EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_HASH = 'presenceInstanceApplicationsHash'
+EVENEMENT_IMAGE_PREFETCH_PROGRESS = 'imagePrefetchProgress'
 
 INTERVALLE_VERIFIER_CERTIFICATS = 180
 
 # FICHIER_ARCHIVES_APP = '/var/opt/millegrilles/configuration/archives.json'
 FICHIER_CONFIG_ARCHIVES_APP_JSON = 'archives.json'
+
+# Maximum number of certificate signing requests in flight during a renewal pass
+CERTIFICATE_SIGNING_CONCURRENCY = 4
+
+# Certificate expiry index (under var/), renewal threshold and scheduling bounds (seconds)
+FICHIER_CERTIFICATE_INDEX = 'certificate_index.json'
+CERTIFICATE_RENEW_RATIO = 2 / 3
+CERTIFICATE_RENEW_RETRY = 3600
+CERTIFICATE_CHECK_MIN_DELAY = 60
+CERTIFICATE_CHECK_MAX_DELAY = 6 * 3600
+
+# System status delta mode (opt-in with SYSTEM_STATUS_DELTA=1 in config.env), seconds between full keyframes
+SYSTEM_STATUS_KEYFRAME_INTERVAL = 120
+
+# In-memory system metrics history, (resolution, retention) in seconds from the finest tier to the coarsest
+SYSTEM_HISTORY_TIERS = [(10, 3 * 3600), (60, 24 * 3600), (600, 7 * 24 * 3600)]
+SYSTEM_HISTORY_MAX_POINTS = 2000
+# Persistent copy of the samples under var/, 7 days at 10 seconds
+FICHIER_SYSTEM_HISTORY = 'system_history.bin'
+SYSTEM_HISTORY_FILE_RECORDS = 7 * 24 * 360
+
+# Number of processes reported in the system status, highest cpu usage first
+SYSTEM_STATUS_TOP_PROCESSES = 10
+
+# Partition usage probes (seconds): timeout for all mountpoints, delay before probing a mountpoint that timed out again
+PARTITION_PROBE_TIMEOUT = 2.0
+PARTITION_QUARANTINE_DELAY = 300
+
+# Host identity cache (seconds): poll of the kernel hostname (and addresses without rtnetlink), full name resolution
+HOST_IDENTITY_POLL_INTERVAL = 30
+HOST_IDENTITY_REFRESH_INTERVAL = 3600
+
+# apcupsd network information server, status read every APC_POLL_INTERVAL seconds
+APC_NIS_HOST = 'localhost'
+APC_NIS_PORT = 3551
+APC_POLL_INTERVAL = 5
+
+# File watcher (seconds): wait for the end of a burst of writes, polling when inotify is not available
+FILE_WATCH_DEBOUNCE = 0.5
+FILE_WATCH_POLL_INTERVAL = 5
+
+# Service reload orchestrator (seconds): requests merged until none is received for the window, up to the max delay
+RELOAD_WINDOW = 2.0
+RELOAD_MAX_DELAY = 10.0
+
+# Docker image prefetch: concurrent pulls, seconds between progress events on the bus
+IMAGE_PREFETCH_CONCURRENCY = 3
+IMAGE_PREFETCH_PROGRESS_INTERVAL = 2.0
+
+# config.env keys that only tune the emitters and the tools used (no runlevel change when they change)
+CONFIG_ENV_SETTINGS_KEYS = frozenset(['SYSTEM_STATUS_DELTA', 'SYSTEM_STATUS_KEYFRAME_INTERVAL', 'SYSTEM_STATUS_DELTA_THRESHOLDS',
+                                      'SYSTEMCTL', 'DOCKER', 'DOCKER_DATA_ROOT'])
+# config.env keys of the MQ bus connection, a change reconnects to the bus
+CONFIG_ENV_BUS_KEYS = frozenset(['MQ_URL', 'MQ_PORT'])
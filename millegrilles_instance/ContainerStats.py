@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+import pathlib
+import re
+import time
+
+from typing import Optional, TypedDict
+
+CGROUP_ROOT = pathlib.Path('/sys/fs/cgroup')
+# Docker data roots, rootless first. DOCKER_DATA_ROOT in config.env overrides.
+DOCKER_DATA_ROOTS = [pathlib.Path.home() / '.local/share/docker', pathlib.Path('/var/lib/docker')]
+
+LABEL_COMPOSE_PROJECT = 'com.docker.compose.project'
+LABEL_COMPOSE_SERVICE = 'com.docker.compose.service'
+
+# Container cgroup directory: docker-<id>.scope (systemd driver) or <id> (cgroupfs driver)
+RE_CONTAINER_CGROUP = re.compile(r'^(?:docker-)?([0-9a-f]{64})(?:\.scope)?$')
+
+# Delay before looking again for the cgroup of a running container that was not found
+CGROUP_RESCAN_DELAY = 30
+
+
+# Rust mapping:
+# struct ContainerServiceStats {
+#     project: String,
+#     service: String,
+#     containers: u32,
+#     cpu_percent: f64,
+#     memory_bytes: u64,
+#     read_bytes_per_sec: f64,
+#     write_bytes_per_sec: f64,
+#     read_iops: f64,
+#     write_iops: f64,
+# }
+class ContainerServiceStats(TypedDict):
+    project: str  # Compose project, e.g. <instance name>-middleware
+    service: str  # Compose service, e.g. mongo
+    containers: int
+    cpu_percent: float  # Percent of one cpu, can go over 100
+    memory_bytes: int
+    read_bytes_per_sec: float
+    write_bytes_per_sec: float
+    read_iops: float
+    write_iops: float
+
+
+class ContainerInfo:
+
+    def __init__(self, mtime_ns: int, project: Optional[str], service: Optional[str], running: bool):
+        self.mtime_ns = mtime_ns
+        self.project = project
+        self.service = service
+        self.running = running
+
+
+def read_cgroup_counters(cgroup_path: pathlib.Path) -> tuple[int, int, int, int, int, int]:
+    """
+    :return: (cpu usage usec, memory bytes, read bytes, write bytes, read ios, write ios)
+    """
+    usage_usec = 0
+    with open(cgroup_path / 'cpu.stat', 'rt') as f:
+        for line in f:
+            if line.startswith('usage_usec '):
+                usage_usec = int(line[11:])
+                break
+
+    with open(cgroup_path / 'memory.current', 'rt') as f:
+        memory = int(f.read())
+
+    rbytes = wbytes = rios = wios = 0
+    try:
+        with open(cgroup_path / 'io.stat', 'rt') as f:
+            for line in f:
+                # 8:0 rbytes=1459200 wbytes=314773504 rios=192 wios=353 dbytes=0 dios=0
+                for field in line.split()[1:]:
+                    key, _, value = field.partition('=')
+                    if key == 'rbytes':
+                        rbytes += int(value)
+                    elif key == 'wbytes':
+                        wbytes += int(value)
+                    elif key == 'rios':
+                        rios += int(value)
+                    elif key == 'wios':
+                        wios += int(value)
+    except FileNotFoundError:
+        pass  # io controller not enabled for this cgroup
+
+    return usage_usec, memory, rbytes, wbytes, rios, wios
+
+
+class ContainerStatsCollector:
+    """
+    Per compose service resource usage of the instance containers, read from the cgroup v2 files.
+
+    Containers are mapped to their compose project and service with the labels in config.v2.json, read from the docker
+    data root once per container state change. No docker API call is made.
+    """
+
+    def __init__(self, project_prefix: str, docker_data_root: Optional[pathlib.Path] = None,
+                 cgroup_root: pathlib.Path = CGROUP_ROOT):
+        """
+        :param project_prefix: Only containers of compose projects starting with this prefix are reported
+        :param docker_data_root: Docker data root, the usual locations are searched when None
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__project_prefix = project_prefix
+        self.__cgroup_root = cgroup_root
+        self.__containers_path: Optional[pathlib.Path] = None
+        self.__disabled_reason: Optional[str] = None
+
+        roots = [docker_data_root] if docker_data_root else DOCKER_DATA_ROOTS
+        for root in roots:
+            if os.access(root / 'containers', os.R_OK | os.X_OK):
+                self.__containers_path = root / 'containers'
+                break
+        else:
+            self.__disabled_reason = "docker containers folder not readable in %s" % ', '.join([str(r) for r in roots])
+
+        if not (cgroup_root / 'cgroup.controllers').exists():
+            self.__disabled_reason = "cgroup v2 not mounted on %s" % cgroup_root
+
+        self.__containers: dict[str, ContainerInfo] = dict()
+        self.__cgroups: dict[str, pathlib.Path] = dict()
+        self.__cgroup_scan_time: Optional[float] = None
+        self.__previous: dict[str, tuple[int, int, int, int, int, int]] = dict()
+        self.__previous_time: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.__disabled_reason is None
+
+    @property
+    def disabled_reason(self) -> Optional[str]:
+        return self.__disabled_reason
+
+    def read(self) -> list[ContainerServiceStats]:
+        """
+        :return: Stats by compose service, sorted by project and service. Rates are 0 on the first sample of a container.
+        """
+        if self.__disabled_reason is not None:
+            return list()
+
+        now = time.monotonic()
+        elapsed = now - self.__previous_time if self.__previous_time is not None else 0.0
+        self.__previous_time = now
+
+        services: dict[tuple[str, str], ContainerServiceStats] = dict()
+        counters: dict[str, tuple[int, int, int, int, int, int]] = dict()
+        for container_id, info in self.__running_containers():
+            cgroup_path = self.__find_cgroup(container_id)
+            if cgroup_path is None:
+                continue
+            try:
+                current = read_cgroup_counters(cgroup_path)
+            except (FileNotFoundError, ProcessLookupError, ValueError):
+                self.__cgroups.pop(container_id, None)  # Container stopped since the scan
+                continue
+            counters[container_id] = current
+
+            key = (info.project, info.service)
+            stats = services.get(key)
+            if stats is None:
+                stats = {
+                    'project': info.project, 'service': info.service, 'containers': 0, 'cpu_percent': 0.0,
+                    'memory_bytes': 0, 'read_bytes_per_sec': 0.0, 'write_bytes_per_sec': 0.0,
+                    'read_iops': 0.0, 'write_iops': 0.0,
+                }
+                services[key] = stats
+            stats['containers'] += 1
+            stats['memory_bytes'] += current[1]
+
+            previous = self.__previous.get(container_id)
+            if previous is not None and elapsed > 0:
+                deltas = [max(c - p, 0) for c, p in zip(current, previous)]
+                stats['cpu_percent'] += deltas[0] / elapsed / 10_000  # usec per second to percent
+                stats['read_bytes_per_sec'] += deltas[2] / elapsed
+                stats['write_bytes_per_sec'] += deltas[3] / elapsed
+                stats['read_iops'] += deltas[4] / elapsed
+                stats['write_iops'] += deltas[5] / elapsed
+
+        self.__previous = counters
+
+        result = list()
+        for key in sorted(services.keys()):
+            stats = services[key]
+            for field in ('cpu_percent', 'read_bytes_per_sec', 'write_bytes_per_sec', 'read_iops', 'write_iops'):
+                stats[field] = round(stats[field], 2)
+            result.append(stats)
+        return result
+
+    def __running_containers(self) -> list[tuple[str, ContainerInfo]]:
+        running = list()
+        seen = set()
+        for entry in os.scandir(self.__containers_path):
+            container_id = entry.name
+            seen.add(container_id)
+            try:
+                mtime_ns = os.stat(os.path.join(entry.path, 'config.v2.json')).st_mtime_ns
+            except FileNotFoundError:
+                continue  # Container being created or removed
+            info = self.__containers.get(container_id)
+            if info is None or info.mtime_ns != mtime_ns:
+                info = self.__load_container(entry.path, mtime_ns)
+                self.__containers[container_id] = info
+                if info.running:
+                    self.__cgroup_scan_time = None  # Container (re)started, its cgroup can be looked up right away
+            if info.running and info.service is not None and info.project is not None and \
+                    info.project.startswith(self.__project_prefix):
+                running.append((container_id, info))
+
+        for container_id in list(self.__containers.keys()):
+            if container_id not in seen:
+                del self.__containers[container_id]
+                self.__cgroups.pop(container_id, None)
+
+        return running
+
+    def __load_container(self, container_path: str, mtime_ns: int) -> ContainerInfo:
+        try:
+            with open(os.path.join(container_path, 'config.v2.json'), 'rt') as f:
+                config = json.load(f)
+            labels = (config.get('Config') or dict()).get('Labels') or dict()
+            running = (config.get('State') or dict()).get('Running') is True
+            return ContainerInfo(mtime_ns, labels.get(LABEL_COMPOSE_PROJECT), labels.get(LABEL_COMPOSE_SERVICE), running)
+        except (OSError, ValueError) as e:
+            self.__logger.debug("Unable to read container configuration %s: %s" % (container_path, e))
+            return ContainerInfo(mtime_ns, None, None, False)
+
+    def __find_cgroup(self, container_id: str) -> Optional[pathlib.Path]:
+        cgroup_path = self.__cgroups.get(container_id)
+        if cgroup_path is not None:
+            return cgroup_path
+
+        now = time.monotonic()
+        if self.__cgroup_scan_time is not None and now - self.__cgroup_scan_time < CGROUP_RESCAN_DELAY:
+            return None
+        self.__cgroup_scan_time = now
+
+        # Scan the cgroup tree once for all containers
+        for dirpath, dirnames, _ in os.walk(self.__cgroup_root):
+            for name in dirnames:
+                match = RE_CONTAINER_CGROUP.match(name)
+                if match is not None:
+                    self.__cgroups[match.group(1)] = pathlib.Path(dirpath, name)
+            # Container cgroups are leaves for this purpose, do not descend
+            dirnames[:] = [d for d in dirnames if RE_CONTAINER_CGROUP.match(d) is None]
+
+        return self.__cgroups.get(container_id)
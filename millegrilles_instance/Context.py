@@ -1,20 +1,30 @@
 import aiohttp
 import asyncio
 import logging
+import pathlib
+import threading
 
 from asyncio import TaskGroup
 
-from typing import Optional, Callable
+from typing import Optional, Callable, TYPE_CHECKING
 
 from millegrilles_messages.messages import Constantes
 from millegrilles_instance.Configuration import ConfigurationInstance
 from millegrilles_instance import Constantes as ConstantesInstance
-from millegrilles_messages.IpUtils import get_ip, get_hostnames
+from millegrilles_instance.ConfigurationDiff import ConfigurationDiff, FileDigests, diff_env
+from millegrilles_instance.FileWatcher import FileWatcher
+from millegrilles_instance.HostIdentity import HostIdentityCache
+from millegrilles_instance.PeriodicScheduler import PeriodicScheduler
+from millegrilles_instance.ReloadOrchestrator import ReloadOrchestrator
+from millegrilles_instance.SystemdUtil import SystemdController
 from millegrilles_messages.bus.BusContext import MilleGrillesBusContext, ForceTerminateExecution
 from millegrilles_messages.bus.PikaConnector import MilleGrillesPikaConnector
 from millegrilles_messages.bus.PikaMessageProducer import MilleGrillesPikaMessageProducer
 from millegrilles_messages.messages.EnveloppeCertificat import CertificatExpire,EnveloppeCertificat
 
+if TYPE_CHECKING:
+    from millegrilles_instance.apps.CsrPool import CsrPool
+
 LOGGER = logging.getLogger(__name__)
 
 
@@ -30,15 +40,33 @@ class InstanceContext(MilleGrillesBusContext):
         super().__init__(configuration, False)
         self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.__bus_connector: Optional[MilleGrillesPikaConnector] = None
+        self.__csr_pool: Optional['CsrPool'] = None
+
+        self.__host_identity = HostIdentityCache(ConstantesInstance.HOST_IDENTITY_POLL_INTERVAL,
+                                                 ConstantesInstance.HOST_IDENTITY_REFRESH_INTERVAL)
+
+        self.__file_watcher = FileWatcher(ConstantesInstance.FILE_WATCH_DEBOUNCE,
+                                          ConstantesInstance.FILE_WATCH_POLL_INTERVAL)
+
+        self.__systemd = SystemdController(configuration.systemctl)
+        self.__reload_orchestrator = ReloadOrchestrator(self.__systemd, lambda: self.configuration.instance_name,
+                                                        ConstantesInstance.RELOAD_WINDOW,
+                                                        ConstantesInstance.RELOAD_MAX_DELAY)
 
-        self.__ip_address: Optional[str] = None
-        self.__hostname: Optional[str] = None
-        self.__hostnames: Optional[list[str]] = None
+        # Periodic emitters (presence, system status, application list)
+        self.__scheduler = PeriodicScheduler(self.get_producer)
+        self.__scheduler.add_job('presence', 20, self.__emit_presence)
 
-        self.__reload_q: asyncio.Queue[Optional[float]] = asyncio.Queue(maxsize=2)
-        self.__reload_listeners: list[Callable[[], None]] = list()
+        self.__reload_requested = asyncio.Event()
+        self.__reload_paths: Optional[set[pathlib.Path]] = set()  # Files changed since the last reload, None for all
+        self.__reload_waiters: list[asyncio.Future] = list()
+        self.__reload_listeners: list[Callable[[ConfigurationDiff], None]] = list()
+        self.__reload_lock = threading.Lock()
+        self.__file_digests = FileDigests()
         # self.__application_status = ApplicationInstallationStatus()
-        self.__reload_done = asyncio.Event()
+
+        # Reload the configuration and certificates when their files change
+        self.__file_watcher.watch(self.__configuration_files(), self.__request_reload)
 
         self.__current_system_state: Optional[dict] = None  # Property set externally by the SystemStatus thread
         self.__runlevel = InstanceContext.CONST_RUNLEVEL_INIT
@@ -59,7 +87,10 @@ class InstanceContext(MilleGrillesBusContext):
             async with TaskGroup() as group:
                 group.create_task(super().run())
                 group.create_task(self.__reload_thread())
-                group.create_task(self.__presence_thread())
+                group.create_task(self.__scheduler.run(lambda: self.stopping))
+                group.create_task(self.__host_identity.run(lambda: self.stopping))
+                group.create_task(self.__file_watcher.run(lambda: self.stopping))
+                group.create_task(self.__reload_orchestrator.run(lambda: self.stopping))
                 group.create_task(self.__stop_thread())
         except *Exception:  # Stop on any thread exception
             self.__logger.exception("InstanceContext Error")
@@ -72,57 +103,75 @@ class InstanceContext(MilleGrillesBusContext):
 
     async def __reload_thread(self):
         while self.stopping is False:
-            reload_value = await self.__reload_q.get()
-            if reload_value is None:
-                return  # Done
-            if reload_value > 0:
-                await asyncio.sleep(reload_value)
+            await self.__reload_requested.wait()
+            self.__reload_requested.clear()
+            if self.stopping:
+                break
+            paths, self.__reload_paths = self.__reload_paths, set()
+            waiters, self.__reload_waiters = self.__reload_waiters, list()
             try:
-                await asyncio.to_thread(self.reload)
+                await asyncio.to_thread(self.reload, paths)
             except CertificatExpire:
                 self.__logger.exception("Certificate expired - context only partially reloaded")
-
-    async def __presence_thread(self):
-        while self.stopping is False:
-            try:
-                producer = await self.get_producer()
-            except asyncio.TimeoutError:
-                # Producer not ready yet
-                await self.wait(5)
-                continue
-
-            event_security_level = self.__securite
-            if event_security_level == Constantes.SECURITE_SECURE:
-                # Downgrade 4.secure a niveau 3.protege
-                event_security_level = Constantes.SECURITE_PROTEGE
-
-            status_content = {
-                'hostname': self.hostname,
-                'hostnames': self.hostnames,
-                'ip': self.ip_address,
-                'security': self.securite,
-            }
-            # status_content.update(self.__current_system_state)
-            event_content = {'status': status_content}
-            try:
-                await producer.event(event_content, Constantes.DOMAINE_INSTANCE,
-                                     ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_V2, exchange=event_security_level)
-            except asyncio.TimeoutError:
-                self.__logger.debug("Timeout sending presence event")
-            except asyncio.CancelledError as e:
-                raise e
-            except:
-                self.__logger.exception("Unhandled error sending presence event")
-            await self.wait(20)
+            except Exception as e:
+                if paths is None:
+                    raise e
+                # Files changed on disk, keep running with the previous values until the next change
+                self.__logger.exception("Error reloading changed files %s" % ', '.join([str(p) for p in paths]))
+            finally:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+
+        for waiter in self.__reload_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def __request_reload(self, paths: Optional[set[pathlib.Path]] = None):
+        """
+        :param paths: Files that changed, None to reload everything
+        """
+        if paths is None:
+            self.__reload_paths = None
+        elif self.__reload_paths is not None:
+            self.__reload_paths.update(paths)
+        self.__reload_requested.set()
+
+    def __configuration_files(self) -> list[pathlib.Path]:
+        configuration = self.configuration
+        return [configuration.config_env_path, pathlib.Path(configuration.key_path), pathlib.Path(configuration.ca_path)]
+
+    async def __emit_presence(self, producer: MilleGrillesPikaMessageProducer):
+        event_security_level = self.__securite
+        if event_security_level == Constantes.SECURITE_SECURE:
+            # Downgrade 4.secure a niveau 3.protege
+            event_security_level = Constantes.SECURITE_PROTEGE
+
+        status_content = {
+            'hostname': self.hostname,
+            'hostnames': self.hostnames,
+            'ip': self.ip_address,
+            'security': self.securite,
+        }
+        # status_content.update(self.__current_system_state)
+        event_content = {'status': status_content}
+        try:
+            await producer.event(event_content, Constantes.DOMAINE_INSTANCE,
+                                 ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_V2, exchange=event_security_level)
+        except asyncio.TimeoutError:
+            self.__logger.debug("Timeout sending presence event")
 
     async def __stop_thread(self):
         await self.wait()
-        await self.__reload_q.put(None)
+        self.__reload_requested.set()
         self.__initial_application_configuration_update.set()
         self.__certificates_generated.set()
-        raise ForceTerminateExecution()  # Kick out the __presence_thread thread if stuck on get_producer
+        raise ForceTerminateExecution()  # Kick out the scheduler if stuck on get_producer
 
-    def add_reload_listener(self, listener: Callable[[], None]):
+    def add_reload_listener(self, listener: Callable[[ConfigurationDiff], None]):
+        """
+        :param listener: Called from the reload thread with what changed
+        """
         self.__reload_listeners.append(listener)
 
     # def update_application_status(self, app_name: str, status: dict):
@@ -146,6 +195,15 @@ class InstanceContext(MilleGrillesBusContext):
     def bus_connector(self, value: MilleGrillesPikaConnector):
         self.__bus_connector = value
 
+    @property
+    def csr_pool(self) -> Optional['CsrPool']:
+        """ Pool of pre-generated keys for certificate renewal. Not set when running with --init. """
+        return self.__csr_pool
+
+    @csr_pool.setter
+    def csr_pool(self, value: 'CsrPool'):
+        self.__csr_pool = value
+
     async def get_producer(self) -> MilleGrillesPikaMessageProducer:
         return await self.__bus_connector.get_producer()
 
@@ -161,17 +219,40 @@ class InstanceContext(MilleGrillesBusContext):
     def idmg(self):
         return self.configuration.idmg
 
+    @property
+    def host_identity(self) -> HostIdentityCache:
+        return self.__host_identity
+
+    @property
+    def systemd(self) -> SystemdController:
+        return self.__systemd
+
+    @property
+    def reload_orchestrator(self) -> ReloadOrchestrator:
+        return self.__reload_orchestrator
+
+    @property
+    def file_watcher(self) -> FileWatcher:
+        return self.__file_watcher
+
+    @property
+    def scheduler(self) -> PeriodicScheduler:
+        return self.__scheduler
+
     @property
     def hostname(self):
-        return self.__hostname
+        identity = self.__host_identity.current
+        return identity['hostname'] if identity is not None else None
 
     @property
     def hostnames(self):
-        return self.__hostnames
+        identity = self.__host_identity.current
+        return identity['hostnames'] if identity is not None else None
 
     @property
     def ip_address(self):
-        return self.__ip_address
+        identity = self.__host_identity.current
+        return identity['ip_address'] if identity is not None else None
 
     @property
     # def application_status(self) -> ApplicationInstallationStatus:
@@ -194,57 +275,91 @@ class InstanceContext(MilleGrillesBusContext):
         return self.__certificates_generated
 
     async def delay_reload(self, delay: float):
-        self.__reload_done.clear()
-        await self.__reload_q.put(delay)
+        self.__loop.call_later(delay, self.__request_reload, None)
 
     async def reload_wait(self):
-        self.__reload_done.clear()
-        await self.__reload_q.put(0)
-        await self.__reload_done.wait()
-
-    def reload(self):
-        configuration: ConfigurationInstance = self.configuration
-        configuration.reload()
-
-        try:
-            # try:
-            super().reload()  # Throws FileNotFoundError/CertificatExpire when applicable
-            # except FileNotFoundError:
-            #     self.__logger.warning("Certificate not available yet, MQ Bus unavailable")
-            # except CertificatExpire:
-            #     # The system certificate is expired
-            #     self.__logger.warning("Certificate is expired, MQ Bus unavailable")
-
-            # Extract manager parameters from its certificate
-            signing_cert = self.signing_key.enveloppe
-            securite = signing_cert.get_exchanges[0]
-            instance_id = signing_cert.subject_common_name
-            idmg = signing_cert.idmg
-
-            signing_ca_cert: EnveloppeCertificat = signing_cert.chaine_enveloppes()[1]
-            instance_name = signing_ca_cert.subject_organizational_unit_name
-
-            self.__instance_id = instance_id
-            if securite and idmg:
-                self.__securite = securite
-                self.__idmg = idmg
-                self.__instance_name = instance_name
+        waiter = self.__loop.create_future()
+        self.__reload_waiters.append(waiter)
+        self.__request_reload(None)
+        await waiter
+
+    def reload(self, changed_paths: Optional[set[pathlib.Path]] = None):
+        """
+        Reloads the configuration and certificates. Blocking.
+        :param changed_paths: Files that changed on disk, only the matching parts are reloaded. None reloads everything.
+        """
+        with self.__reload_lock:
+            configuration: ConfigurationInstance = self.configuration
+            config_env_path, key_path, ca_path = self.__configuration_files()
+            previous_env = configuration.config_env
+
+            if changed_paths is None:
+                configuration.reload()
+                self.__file_digests.update([config_env_path, key_path, ca_path])
+                diff: ConfigurationDiff = {
+                    'full': True,
+                    'config_env': diff_env(previous_env, configuration.config_env),
+                    'certificate': True,
+                    'ca': True,
+                }
             else:
-                # System not configured yet
-                self.__securite = None
-                self.__idmg = None
-                self.__instance_name = None
-
-            self.__ip_address = get_ip()
-            self.__logger.debug("Local IP: %s" % self.__ip_address)
-            self.__hostname, self.__hostnames = get_hostnames(fqdn=True)
-            self.__logger.debug("Local domain: %s, domaines : %s" % (self.__hostname, self.__hostnames))
+                # Files rewritten with the same content are not reloaded
+                changed = self.__file_digests.update([p for p in (config_env_path, key_path, ca_path) if p in changed_paths])
+                diff: ConfigurationDiff = {
+                    'full': False,
+                    'config_env': dict(),
+                    'certificate': key_path in changed,
+                    'ca': ca_path in changed,
+                }
+                if config_env_path in changed:
+                    configuration.reload_config_env()
+                    diff['config_env'] = diff_env(previous_env, configuration.config_env)
+                if not (diff['config_env'] or diff['certificate'] or diff['ca']):
+                    return  # Nothing changed
+                self.__logger.info("Configuration files changed: config.env keys %s, certificate %s, CA %s" % (
+                    list(diff['config_env'].keys()), diff['certificate'], diff['ca']))
+
+            if diff['certificate'] or diff['ca']:
+                # The bus context loads the key, its certificate and the CA chain together
+                self.__reload_certificates()
 
             # Call reload listeners
             for listener in self.__reload_listeners:
-                listener()
-        finally:
-            self.__loop.call_soon_threadsafe(self.__reload_done.set)
+                listener(diff)
+
+    def __reload_certificates(self):
+        # try:
+        super().reload()  # Throws FileNotFoundError/CertificatExpire when applicable
+        # except FileNotFoundError:
+        #     self.__logger.warning("Certificate not available yet, MQ Bus unavailable")
+        # except CertificatExpire:
+        #     # The system certificate is expired
+        #     self.__logger.warning("Certificate is expired, MQ Bus unavailable")
+
+        # Extract manager parameters from its certificate
+        signing_cert = self.signing_key.enveloppe
+        securite = signing_cert.get_exchanges[0]
+        instance_id = signing_cert.subject_common_name
+        idmg = signing_cert.idmg
+
+        signing_ca_cert: EnveloppeCertificat = signing_cert.chaine_enveloppes()[1]
+        instance_name = signing_ca_cert.subject_organizational_unit_name
+
+        self.__instance_id = instance_id
+        if securite and idmg:
+            self.__securite = securite
+            self.__idmg = idmg
+            self.__instance_name = instance_name
+        else:
+            # System not configured yet
+            self.__securite = None
+            self.__idmg = None
+            self.__instance_name = None
+
+        # Resolved once, then kept current by the host identity thread
+        identity = self.__host_identity.get()
+        self.__logger.debug("Local IP: %s" % identity['ip_address'])
+        self.__logger.debug("Local domain: %s, domaines : %s" % (identity['hostname'], identity['hostnames']))
 
     def ssl_session(self, timeout: Optional[aiohttp.ClientTimeout] = None):
         ssl_context = self.ssl_context
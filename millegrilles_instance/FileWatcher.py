@@ -0,0 +1,208 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+import struct
+
+from typing import Callable, Optional
+
+# inotify(7) flags and events
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_IGNORED = 0x8000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len, followed by the file name
+
+FileSignature = Optional[tuple[int, int, int]]  # (inode, size, mtime ns), None when the file does not exist
+
+
+class Inotify:
+    """
+    Minimal inotify binding with ctypes.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.__add_watch = libc.inotify_add_watch
+        self.__add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: pathlib.Path, mask: int) -> int:
+        wd = self.__add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def read_events(self) -> list[tuple[int, int, str]]:
+        """
+        :return: Pending events (wd, mask, name)
+        """
+        events = list()
+        while True:
+            try:
+                buffer = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT.size
+                name = buffer[offset:offset + length].rstrip(b'\x00')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def file_signature(path: pathlib.Path) -> FileSignature:
+    try:
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def poll_signatures(signatures: dict[pathlib.Path, FileSignature]) -> dict[pathlib.Path, FileSignature]:
+    """
+    :return: New signature of the files that changed
+    """
+    changed = dict()
+    for path, previous in signatures.items():
+        current = file_signature(path)
+        if current != previous:
+            changed[path] = current
+    return changed
+
+
+class FileWatcher:
+    """
+    Watches files and calls back once per burst of changes.
+
+    The parent directory of each file is watched with inotify, so files replaced by a rename or created later are
+    seen. When inotify is not available (or the directory does not exist), the file signature (inode, size, mtime)
+    is polled instead.
+    """
+
+    def __init__(self, debounce: float, poll_interval: float):
+        """
+        :param debounce: Seconds to wait after a change for more changes before calling back
+        :param poll_interval: Seconds between checks of the files that are polled
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__debounce = debounce
+        self.__poll_interval = poll_interval
+        self.__watches: list[tuple[frozenset[pathlib.Path], Callable[[set[pathlib.Path]], None]]] = list()
+        self.__inotify: Optional[Inotify] = None
+        self.__directories: dict[int, pathlib.Path] = dict()  # wd: directory
+        self.__polled: dict[pathlib.Path, FileSignature] = dict()
+        self.__pending: set[pathlib.Path] = set()
+        self.__changed = asyncio.Event()
+        self.__started = False
+
+    def watch(self, paths: list[pathlib.Path], callback: Callable[[set[pathlib.Path]], None]):
+        """
+        :param callback: Called on the event loop with the paths that changed, at least one
+        """
+        paths = frozenset([pathlib.Path(p) for p in paths])
+        self.__watches.append((paths, callback))
+        if self.__started:
+            for path in paths:
+                self.__add(path)
+
+    def notify(self, paths: list[pathlib.Path]):
+        """
+        Reports a change made by this process, e.g. when the watcher could miss it.
+        """
+        self.__pending.update([pathlib.Path(p) for p in paths])
+        self.__changed.set()
+
+    async def run(self, stopping: Callable[[], bool]):
+        loop = asyncio.get_running_loop()
+        try:
+            self.__inotify = Inotify()
+            loop.add_reader(self.__inotify.fd, self.__on_inotify)
+        except (OSError, AttributeError) as e:
+            self.__logger.info("inotify not available, polling the files every %d seconds (%s)" % (self.__poll_interval, e))
+            self.__inotify = None
+
+        self.__started = True
+        for paths, _ in self.__watches:
+            for path in paths:
+                self.__add(path)
+
+        try:
+            while stopping() is False:
+                timeout = self.__poll_interval if self.__polled else None
+                try:
+                    await asyncio.wait_for(self.__changed.wait(), timeout)
+                    await asyncio.sleep(self.__debounce)  # Wait for the end of the burst
+                except asyncio.TimeoutError:
+                    pass
+                self.__changed.clear()
+                if self.__polled:
+                    changed = await asyncio.to_thread(poll_signatures, dict(self.__polled))
+                    self.__polled.update(changed)
+                    self.__pending.update(changed.keys())
+                self.__dispatch()
+        finally:
+            if self.__inotify is not None:
+                loop.remove_reader(self.__inotify.fd)
+                self.__inotify.close()
+                self.__inotify = None
+            self.__started = False
+
+    def __add(self, path: pathlib.Path):
+        directory = path.parent
+        if self.__inotify is not None and directory not in self.__directories.values():
+            try:
+                wd = self.__inotify.add_watch(directory, WATCH_MASK)
+                self.__directories[wd] = directory
+            except OSError as e:
+                self.__logger.info("Unable to watch %s, polling it (%s)" % (directory, e))
+        if directory not in self.__directories.values():
+            self.__polled[path] = file_signature(path)
+
+    def __on_inotify(self):
+        for wd, mask, name in self.__inotify.read_events():
+            directory = self.__directories.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                # Directory removed, poll its files from now on
+                del self.__directories[wd]
+                for paths, _ in self.__watches:
+                    for path in paths:
+                        if path.parent == directory:
+                            self.__polled[path] = None
+                            self.__pending.add(path)
+            elif name:
+                self.__pending.add(directory / name)
+        if self.__pending:
+            self.__changed.set()
+
+    def __dispatch(self):
+        pending = self.__pending
+        if not pending:
+            return
+        self.__pending = set()
+        for paths, callback in self.__watches:
+            changed = paths & pending
+            if changed:
+                try:
+                    callback(set(changed))
+                except Exception:
+                    self.__logger.exception("Error in file watcher callback")
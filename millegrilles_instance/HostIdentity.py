@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import socket
+import threading
+import time
+
+from typing import Callable, Optional, TypedDict
+
+import psutil
+
+# Interfaces excluded from the host ip addresses
+VIRTUAL_INTERFACE_PREFIXES = ['docker', 'veth', 'br-', 'docker0', 'cali', 'flannel']
+
+# rtnetlink multicast groups, see rtnetlink(7)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+# Seconds to wait for more address notifications before refreshing
+CHANGE_DEBOUNCE = 2.0
+
+
+class HostIdentityInfo(TypedDict):
+    hostname: str  # Fully qualified
+    hostnames: list[str]
+    ip_address: Optional[str]  # Address used for outgoing connections
+    ip_addresses: list[str]  # Addresses of the physical interfaces
+
+
+def resolve_millegrilles() -> tuple[Optional[str], str, list[str]]:
+    """
+    :return: (ip_address, hostname, hostnames) as resolved by the millegrilles library
+    """
+    from millegrilles_messages.IpUtils import get_ip, get_hostnames
+    ip_address = get_ip()
+    hostname, hostnames = get_hostnames(fqdn=True)
+    return ip_address, hostname, hostnames
+
+
+def interface_addresses() -> list[str]:
+    """
+    :return: Non-loopback addresses of the physical interfaces. No name resolution.
+    """
+    ip_addresses: list[str] = list()
+    for interface, addrs in psutil.net_if_addrs().items():
+        # Skip common container/virtual network interfaces
+        if any(prefix in interface for prefix in VIRTUAL_INTERFACE_PREFIXES):
+            continue
+        for addr in addrs:
+            if addr.family in (socket.AF_INET, socket.AF_INET6):
+                # Skip loopback
+                if addr.address.startswith('127.') or addr.address == '::1':
+                    continue
+                ip_addresses.append(addr.address)
+    return ip_addresses
+
+
+class HostIdentityCache:
+    """
+    Hostname and ip addresses of the host, shared by the context and the system status.
+
+    Reading the identity is free. The name resolution (getfqdn, gethostbyname, ...) only runs when rtnetlink reports an
+    address or link change, when the kernel hostname changes, and once per refresh_interval to pick up DNS changes.
+    Without netlink, the interface addresses are polled instead (getifaddrs, no resolution).
+    """
+
+    def __init__(self, poll_interval: float, refresh_interval: float,
+                 resolver: Callable[[], tuple[Optional[str], str, list[str]]] = resolve_millegrilles):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__poll_interval = poll_interval
+        self.__refresh_interval = refresh_interval
+        self.__resolver = resolver
+        self.__lock = threading.Lock()
+        self.__identity: Optional[HostIdentityInfo] = None
+        self.__signature: Optional[tuple] = None  # Kernel hostname and interface addresses of the last refresh
+        self.__refresh_time = 0.0
+
+        self.__refreshes = 0
+        self.__changes = 0
+        self.__last_change: Optional[float] = None
+
+    @property
+    def refreshes(self) -> int:
+        return self.__refreshes
+
+    @property
+    def changes(self) -> int:
+        """ Number of times the identity changed since the first refresh. """
+        return self.__changes
+
+    @property
+    def last_change(self) -> Optional[float]:
+        """ Epoch of the last identity change. """
+        return self.__last_change
+
+    @property
+    def current(self) -> Optional[HostIdentityInfo]:
+        """ Cached identity, None until the first refresh. Never blocks. """
+        return self.__identity
+
+    def get(self) -> HostIdentityInfo:
+        """
+        :return: Cached identity. Loads it on the first call (blocking).
+        """
+        identity = self.__identity
+        if identity is None:
+            identity = self.refresh()
+        return identity
+
+    def refresh(self) -> HostIdentityInfo:
+        """
+        Resolves the identity again. Blocking, run from a thread.
+        """
+        with self.__lock:
+            signature = self.__current_signature()
+            ip_addresses = list(signature[1])
+            try:
+                ip_address, hostname, hostnames = self.__resolver()
+            except Exception as e:
+                self.__logger.warning("Error resolving the host names, using the kernel hostname: %s" % e)
+                ip_address, hostname, hostnames = None, socket.gethostname(), [socket.gethostname()]
+
+            # Fallback if no suitable IP was found
+            if not ip_addresses:
+                try:
+                    ip_addresses.append(socket.gethostbyname(hostname))
+                except Exception:
+                    pass
+
+            identity: HostIdentityInfo = {
+                'hostname': hostname,
+                'hostnames': hostnames,
+                'ip_address': ip_address,
+                'ip_addresses': ip_addresses,
+            }
+
+            self.__refreshes += 1
+            previous = self.__identity
+            if previous is not None and previous != identity:
+                self.__changes += 1
+                self.__last_change = time.time()
+                self.__logger.info("Host identity changed (%d changes in %d refreshes): %s -> %s" %
+                                   (self.__changes, self.__refreshes, previous, identity))
+
+            self.__identity = identity
+            self.__signature = signature
+            self.__refresh_time = time.monotonic()
+            return identity
+
+    async def run(self, stopping: Callable[[], bool]):
+        """
+        Watches for changes until stopping() returns True.
+        """
+        sock = open_netlink_socket()
+        if sock is None:
+            self.__logger.info("rtnetlink not available, polling the interface addresses every %d seconds" % self.__poll_interval)
+        loop = asyncio.get_running_loop()
+        try:
+            while stopping() is False:
+                changed = False
+                if sock is not None:
+                    try:
+                        await asyncio.wait_for(loop.sock_recv(sock, 65536), self.__poll_interval)
+                        changed = True
+                        # Address changes come in bursts (e.g. dhcp renew), wait for the end before refreshing
+                        await asyncio.sleep(CHANGE_DEBOUNCE)
+                        drain_socket(sock)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(self.__poll_interval)
+
+                if changed is False:
+                    changed = await asyncio.to_thread(self.__signature_changed, sock is None)
+                if changed is False and time.monotonic() - self.__refresh_time >= self.__refresh_interval:
+                    changed = True
+
+                if changed:
+                    await asyncio.to_thread(self.refresh)
+        finally:
+            if sock is not None:
+                sock.close()
+
+    def __signature_changed(self, check_addresses: bool) -> bool:
+        if self.__signature is None:
+            return True
+        if check_addresses:
+            return self.__current_signature() != self.__signature
+        return socket.gethostname() != self.__signature[0]
+
+    @staticmethod
+    def __current_signature() -> tuple:
+        return socket.gethostname(), tuple(interface_addresses())
+
+
+def open_netlink_socket() -> Optional[socket.socket]:
+    """
+    :return: Non-blocking rtnetlink socket subscribed to link and address changes, None when not supported.
+    """
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    except (AttributeError, OSError):
+        return None
+    try:
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def drain_socket(sock: socket.socket):
+    try:
+        while True:
+            sock.recv(65536)
+    except (BlockingIOError, InterruptedError):
+        pass
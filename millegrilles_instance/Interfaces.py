@@ -9,3 +9,6 @@ class MgbusHandlerInterface:
     async def unregister(self):
         raise NotImplementedError('must implement')
 
+
+    async def reconnect(self):
+        raise NotImplementedError('must implement')
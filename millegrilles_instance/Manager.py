@@ -7,10 +7,10 @@ from typing import Optional
 
 from cryptography.x509 import ExtensionNotFound
 
+from millegrilles_instance.ConfigurationDiff import ConfigurationDiff, RELOAD_BUS, RELOAD_RUNLEVEL, reload_action
 from millegrilles_instance.Interfaces import MgbusHandlerInterface
 from millegrilles_instance.NginxUtil import publish_to_nginx
-from millegrilles_instance.SystemdUtil import reload_nginx, reload_compose_applications, reload_middleware, \
-    restart_nginx, restart_compose_applications
+from millegrilles_instance.ReloadOrchestrator import SERVICE_APPLICATIONS, SERVICE_MIDDLEWARE, SERVICE_NGINX
 from millegrilles_instance.apps.AppManager import AppManager
 from millegrilles_instance.apps.Certificates import check_certissuer_available, renew_certificates
 from millegrilles_messages.bus.BusContext import ForceTerminateExecution
@@ -38,6 +38,7 @@ class InstanceManager:
 
         self.__loop = asyncio.get_event_loop()
         self.__reload_configuration = asyncio.Event()
+        self.__reconnect_bus = asyncio.Event()
 
     @property
     def context(self) -> InstanceContext:
@@ -49,6 +50,7 @@ class InstanceManager:
         """
         self.__mgbus_handler = mgbus_handler
         await self.__prepare_configuration()
+        self.__reload_configuration.set()  # Initial load, starts the runlevels
 
     async def run(self):
         self.__logger.debug("InstanceManager thread started")
@@ -56,6 +58,7 @@ class InstanceManager:
             async with TaskGroup() as group:
                 group.create_task(self.__stop_thread())
                 group.create_task(self.__reload_configuration_thread())
+                group.create_task(self.__reconnect_bus_thread())
                 group.create_task(self.__runlevel_thread())
         except *Exception:  # Stop on any thread exception
             self.__logger.exception("InstanceManager Unhandled error, closing")
@@ -100,8 +103,31 @@ class InstanceManager:
 
             await self.__runlevel_changed.wait()
 
-    def callback_changement_configuration(self):
-        self.__loop.call_soon_threadsafe(self.__reload_configuration.set)
+    def callback_changement_configuration(self, diff: ConfigurationDiff):
+        """
+        Context reload listener, called from the reload thread.
+        """
+        action = reload_action(diff)
+        if action == RELOAD_RUNLEVEL:
+            self.__logger.info("Configuration changed (%s), restarting the runlevels" % ', '.join(diff['config_env'].keys()))
+            self.__loop.call_soon_threadsafe(self.__reload_configuration.set)
+        elif action == RELOAD_BUS:
+            self.__loop.call_soon_threadsafe(self.__reconnect_bus.set)
+        # Full reloads are handled by the runlevel code, settings are read when used
+
+    async def __reconnect_bus_thread(self):
+        while self.context.stopping is False:
+            await self.__reconnect_bus.wait()
+            if self.context.stopping:
+                return  # Exit condition
+            self.__reconnect_bus.clear()
+
+            if self.context.runlevel != InstanceContext.CONST_RUNLEVEL_NORMAL:
+                continue  # Not registered yet, the registration uses the current configuration
+            try:
+                await self.__mgbus_handler.reconnect()
+            except Exception:
+                self.__logger.exception("Error reconnecting to the MQ Bus")
 
     async def __reload_configuration_thread(self):
         while self.context.stopping is False:
@@ -121,6 +147,7 @@ class InstanceManager:
         await self.context.wait()
         # Release threads
         self.__reload_configuration.set()
+        self.__reconnect_bus.set()
         self.__runlevel_changed.set()
 
     async def __prepare_configuration(self):
@@ -215,28 +242,32 @@ class InstanceManager:
         # Always release this flag to let Certificate thread proceed
         self.context.certificates_generated.set()
 
-        # Reload all systemd services (force restart if reload fails)
-        instance_name = self.context.configuration.instance_name
-        if not self.context.configuration.is_secure_manager:
-            try:
-                await asyncio.to_thread(reload_nginx, instance_name)
-            except CalledProcessError:
-                # Try restart
-                self.__logger.warning("Error during nginx reload, trying nginx restart")
-                await asyncio.to_thread(restart_nginx, instance_name)
-
+        # Pull the missing docker images first, the services start without waiting on the registry
         if not self.context.configuration.is_docker_disabled:
-            reload_middleware(instance_name)
             try:
-                reload_compose_applications(instance_name, update_certs=False)
-            except CalledProcessError:
-                try:
-                    restart_compose_applications(instance_name)
-                except CalledProcessError:
-                    self.__logger.exception("Error during applications restart - applications will not be available until fixed")
+                await self.__app_manager.prefetch_images()
+            except (asyncio.CancelledError, ForceTerminateExecution) as e:
+                raise e
+            except Exception:
+                self.__logger.exception("Error pulling docker images, images missing are pulled by the services")
+
+        # Reload all systemd services (force restart if reload fails), merged with other pending reloads
+        orchestrator = self.context.reload_orchestrator
+        async with TaskGroup() as group:
+            if not self.context.configuration.is_secure_manager:
+                group.create_task(orchestrator.reload(SERVICE_NGINX, restart_on_failure=True))
+            if not self.context.configuration.is_docker_disabled:
+                group.create_task(orchestrator.reload(SERVICE_MIDDLEWARE))
+                group.create_task(self.__reload_applications())
 
         self.__logger.info("Runlevel normal READY")
 
+    async def __reload_applications(self):
+        try:
+            await self.context.reload_orchestrator.reload(SERVICE_APPLICATIONS, restart_on_failure=True)
+        except CalledProcessError:
+            self.__logger.exception("Error during applications restart - applications will not be available until fixed")
+
     async def __stop_normal_operation(self):
         # Disconnect from mgbus
         await self.__mgbus_handler.unregister()
@@ -249,6 +280,9 @@ class InstanceManager:
         with open(path_etc_fiche, 'wb') as f:
             f.write(contenu)
 
+    async def get_installed_applications(self, message: MessageWrapper):
+        return await self.__app_manager.get_installed_applications()
+
     async def get_instance_passwords(self, message: MessageWrapper):
         enveloppe = message.certificat
         if enveloppe is None:
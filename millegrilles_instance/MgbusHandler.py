@@ -1,7 +1,8 @@
+import asyncio
 import logging
 
 from asyncio import TaskGroup
-from typing import Optional, Callable, Coroutine, Any
+from typing import Optional, Callable, Coroutine, Any, TYPE_CHECKING
 
 from cryptography.x509 import ExtensionNotFound
 
@@ -15,17 +16,22 @@ from millegrilles_messages.bus.PikaChannel import MilleGrillesPikaChannel
 from millegrilles_messages.bus.PikaQueue import MilleGrillesPikaQueueConsumer, RoutingKey
 from millegrilles_messages.messages.MessagesModule import MessageWrapper
 
+if TYPE_CHECKING:
+    from millegrilles_instance.SystemStatus import SystemStatusManager
+
 
 class MgbusHandler(MgbusHandlerInterface):
     """
     MQ access module
     """
 
-    def __init__(self, manager: InstanceManager):
+    def __init__(self, manager: InstanceManager, system_status_manager: Optional['SystemStatusManager'] = None):
         super().__init__()
         self.__logger = logging.getLogger(__name__+'.'+self.__class__.__name__)
         self.__manager = manager
+        self.__system_status_manager = system_status_manager
         self.__task_group: Optional[TaskGroup] = None
+        self.__connector_task: Optional[asyncio.Task] = None
 
     async def run(self):
         self.__logger.debug("MgbusHandler thread started")
@@ -69,7 +75,18 @@ class MgbusHandler(MgbusHandlerInterface):
             raise TypeError("Task Group not initialized")
 
         # Start mgbus connector thread
-        self.__task_group.create_task(self.__manager.context.bus_connector.run())
+        self.__connector_task = self.__task_group.create_task(self.__manager.context.bus_connector.run())
+
+    async def reconnect(self):
+        """
+        Restarts the connection to the MQ Bus with the current certificate and configuration. The channels are kept.
+        """
+        if self.__connector_task is None:
+            return  # Not registered, the registration uses the current configuration
+        self.__logger.info("Reconnecting to the MQ Bus")
+        self.__connector_task.cancel()
+        await asyncio.wait([self.__connector_task])
+        self.__connector_task = self.__task_group.create_task(self.__manager.context.bus_connector.run())
 
     async def unregister(self):
         self.__logger.info("Unregister from the MQ Bus")
@@ -115,11 +132,27 @@ class MgbusHandler(MgbusHandlerInterface):
         except ExtensionNotFound:
             delegation_globale = None
 
+        try:
+            domaines = enveloppe.get_domaines
+        except ExtensionNotFound:
+            domaines = list()
+
         action = message.routage['action']
         if delegation_globale == Constantes.DELEGATION_GLOBALE_PROPRIETAIRE:
             if action == ConstantesInstance.REQUETE_GET_PASSWORDS:
                 return await self.__manager.get_instance_passwords(message)
 
+        core_topologie = Constantes.DOMAINE_CORE_TOPOLOGIE in domaines
+        if core_topologie and action == ConstantesInstance.REQUETE_INSTALLED_APPLICATIONS:
+            return await self.__manager.get_installed_applications(message)
+
+        if self.__system_status_manager is not None:
+            if core_topologie and action == ConstantesInstance.REQUETE_SYSTEM_STATE_KEYFRAME:
+                return await self.__system_status_manager.get_keyframe()
+            elif action == ConstantesInstance.REQUETE_SYSTEM_HISTORY and \
+                    (core_topologie or delegation_globale == Constantes.DELEGATION_GLOBALE_PROPRIETAIRE):
+                return await self.__system_status_manager.get_history(message)
+
         self.__logger.info("on_request_message Ignoring unknown action %s" % action)
 
         return None
@@ -151,6 +184,9 @@ def create_requests_channel(instance_id: str, niveau_securite: str, context: Ins
     q = MilleGrillesPikaQueueConsumer(context, on_message, f'instance/{instance_id}/requests', arguments={'x-message-ttl': 30_000})
 
     q.add_routing_key(RoutingKey(niveau_securite_ajuste, f'requete.instance.{instance_id}.{ConstantesInstance.REQUETE_GET_PASSWORDS}'))
+    q.add_routing_key(RoutingKey(niveau_securite_ajuste, f'requete.instance.{instance_id}.{ConstantesInstance.REQUETE_SYSTEM_STATE_KEYFRAME}'))
+    q.add_routing_key(RoutingKey(niveau_securite_ajuste, f'requete.instance.{instance_id}.{ConstantesInstance.REQUETE_SYSTEM_HISTORY}'))
+    q.add_routing_key(RoutingKey(niveau_securite_ajuste, f'requete.instance.{instance_id}.{ConstantesInstance.REQUETE_INSTALLED_APPLICATIONS}'))
 
     # if niveau_securite == Constantes.SECURITE_PROTEGE:
     #     q.add_routing_key(RoutingKey(Constantes.SECURITE_PROTEGE, f'commande.instance.{ConstantesInstance.COMMANDE_TRANSMETTRE_CATALOGUES}'))
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+
+from typing import Optional
+
+import psutil
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+
+
+class MountProbe:
+    """
+    Probe state of a mountpoint. Each probe runs in its own thread: a hung mount only blocks its own thread.
+    """
+
+    def __init__(self, mountpoint: str):
+        self.mountpoint = mountpoint
+        self.usage = None  # Last psutil.disk_usage result
+        self.error: Optional[Exception] = None
+        self.thread: Optional[threading.Thread] = None
+        self.done = threading.Event()
+        self.quarantined_until = 0.0
+
+    def start(self):
+        self.done.clear()
+        self.thread = threading.Thread(target=self.__run, name=f'probe {self.mountpoint}', daemon=True)
+        self.thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def __run(self):
+        try:
+            self.usage = psutil.disk_usage(self.mountpoint)
+            self.error = None
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+class PartitionProber:
+    """
+    Partition usage with a timeout on each mountpoint.
+
+    The mount list is cached and only reloaded when /proc/self/mountinfo changes. A mountpoint that does not answer
+    within the timeout (e.g. hung NFS or CIFS server) is quarantined: it is not probed again while its probe thread is
+    blocked and for quarantine_delay seconds after that, and its last known usage is reported as stale.
+    """
+
+    def __init__(self, timeout: float, quarantine_delay: float, mountinfo_path: str = MOUNTINFO_PATH):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__timeout = timeout
+        self.__quarantine_delay = quarantine_delay
+        self.__mountinfo_path = mountinfo_path
+        self.__mountinfo: Optional[bytes] = None
+        self.__partitions: Optional[list] = None
+        self.__probes: dict[str, MountProbe] = dict()
+
+    def partitions(self) -> list:
+        """
+        :return: psutil.disk_partitions(), reloaded when the mounts change.
+        """
+        try:
+            with open(self.__mountinfo_path, 'rb') as f:
+                mountinfo = f.read()
+        except OSError:
+            mountinfo = None  # Not available, reload each time
+
+        if mountinfo is None or mountinfo != self.__mountinfo or self.__partitions is None:
+            self.__partitions = psutil.disk_partitions()
+            self.__mountinfo = mountinfo
+            # Forget unmounted partitions
+            mountpoints = set([p.mountpoint for p in self.__partitions])
+            for mountpoint in list(self.__probes.keys()):
+                if mountpoint not in mountpoints and not self.__probes[mountpoint].running:
+                    del self.__probes[mountpoint]
+
+        return self.__partitions
+
+    def probe(self, mountpoints: list[str]) -> list[tuple[str, object, bool]]:
+        """
+        Probes the mountpoints in parallel, waits at most the timeout overall.
+        :return: (mountpoint, psutil usage, stale) for each mountpoint with a known usage, in the same order.
+        """
+        now = time.monotonic()
+        started = list()
+        for mountpoint in mountpoints:
+            probe = self.__probes.get(mountpoint)
+            if probe is None:
+                probe = MountProbe(mountpoint)
+                self.__probes[mountpoint] = probe
+            if probe.running or now < probe.quarantined_until:
+                continue  # Quarantined
+            probe.start()
+            started.append(probe)
+
+        deadline = now + self.__timeout
+        for probe in started:
+            if not probe.done.wait(max(deadline - time.monotonic(), 0)):
+                probe.quarantined_until = time.monotonic() + self.__quarantine_delay
+                self.__logger.warning("Mountpoint %s did not answer within %.1f seconds, quarantined" %
+                                      (probe.mountpoint, self.__timeout))
+
+        now = time.monotonic()
+        result = list()
+        for mountpoint in mountpoints:
+            probe = self.__probes[mountpoint]
+            stale = probe.running or now < probe.quarantined_until
+            if probe.error is not None and not stale:
+                self.__logger.debug("Error reading usage of %s: %s" % (mountpoint, probe.error))
+                continue
+            if probe.usage is None and not stale:
+                continue
+            result.append((mountpoint, probe.usage, stale))
+        return result
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import math
+import random
+import time
+
+from typing import Awaitable, Callable, Optional, TypedDict, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from millegrilles_messages.bus.PikaMessageProducer import MilleGrillesPikaMessageProducer
+
+JobCallback = Callable[[Optional['MilleGrillesPikaMessageProducer']], Awaitable[None]]
+
+# Seconds to wait for the producer before a batch of jobs, same as the previous emit threads
+PRODUCER_TIMEOUT = 1.0
+
+
+# Rust mapping:
+# struct PeriodicJobStats {
+#     name: String,
+#     interval: f64,
+#     runs: u64,
+#     errors: u64,
+#     missed: u64,
+#     producer_unavailable: u64,
+#     last_latency_ms: f64,
+#     max_latency_ms: f64,
+#     last_duration_ms: f64,
+# }
+class PeriodicJobStats(TypedDict):
+    name: str
+    interval: float  # Seconds
+    runs: int
+    errors: int  # Runs that raised an exception
+    missed: int  # Ticks skipped because the previous run ended too late (coalesced)
+    producer_unavailable: int  # Runs postponed because the producer was not available
+    last_latency_ms: float  # Delay between the due time and the start of the last run
+    max_latency_ms: float
+    last_duration_ms: float
+
+
+class PeriodicJob:
+
+    def __init__(self, name: str, interval_ticks: int, callback: JobCallback, requires_producer: bool):
+        self.name = name
+        self.interval_ticks = interval_ticks
+        self.callback = callback
+        self.requires_producer = requires_producer
+        self.due_tick = 0
+        self.failures = 0  # Consecutive runs without producer
+
+        self.runs = 0
+        self.errors = 0
+        self.missed = 0
+        self.producer_unavailable = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.last_duration = 0.0
+
+
+class PeriodicScheduler:
+    """
+    Timer wheel for the periodic jobs of the instance (presence, system status, application list).
+
+    Jobs are placed in the wheel slot of their due tick. The scheduler sleeps until the next occupied tick, fetches the
+    producer once and runs all the jobs due at that tick together. A job that could not keep up is not run again for
+    each missed tick, the missed ticks are coalesced into a single run. A job that requires the producer is retried
+    with an exponential backoff (capped at its interval) while the producer is not available.
+    """
+
+    def __init__(self, get_producer: Callable[[], Awaitable['MilleGrillesPikaMessageProducer']],
+                 tick: float = 1.0, wheel_size: int = 64):
+        """
+        :param get_producer: Coroutine function returning the producer, waits until it is available
+        :param tick: Resolution of the wheel in seconds, jobs due within the same tick are batched
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__get_producer = get_producer
+        self.__tick = tick
+        self.__wheel: list[list[PeriodicJob]] = [list() for _ in range(wheel_size)]
+        self.__jobs: dict[str, PeriodicJob] = dict()
+        self.__start = time.monotonic()
+        self.__last_tick = -1  # Last tick processed
+        self.__wakeup = asyncio.Event()
+
+    def add_job(self, name: str, interval: float, callback: JobCallback, initial_delay: float = 0.0,
+                jitter: float = 0.1, requires_producer: bool = True):
+        """
+        :param interval: Seconds between runs, rounded to the tick
+        :param callback: Coroutine function receiving the producer (None when not available and not required)
+        :param initial_delay: Seconds before the first run
+        :param jitter: Fraction of the interval added at random to the initial delay, spreads the instances of a system
+        :param requires_producer: When False, the job also runs when the producer is not available
+        """
+        if name in self.__jobs:
+            raise ValueError('Job %s already scheduled' % name)
+        job = PeriodicJob(name, max(round(interval / self.__tick), 1), callback, requires_producer)
+        delay = initial_delay + random.uniform(0, jitter * interval)
+        self.__jobs[name] = job
+        self.__insert(job, self.__current_tick() + max(math.ceil(delay / self.__tick), 1))
+        self.__wakeup.set()
+
+    def remove_job(self, name: str):
+        """
+        Unschedules a job. A run in progress completes but the job is not scheduled again.
+        """
+        job = self.__jobs.pop(name, None)
+        if job is None:
+            return
+        for slot, jobs in enumerate(self.__wheel):
+            if job in jobs:
+                self.__wheel[slot] = [j for j in jobs if j is not job]
+
+    def stats(self) -> list[PeriodicJobStats]:
+        return [
+            {
+                'name': job.name,
+                'interval': job.interval_ticks * self.__tick,
+                'runs': job.runs,
+                'errors': job.errors,
+                'missed': job.missed,
+                'producer_unavailable': job.producer_unavailable,
+                'last_latency_ms': round(job.last_latency * 1000, 1),
+                'max_latency_ms': round(job.max_latency * 1000, 1),
+                'last_duration_ms': round(job.last_duration * 1000, 1),
+            }
+            for job in self.__jobs.values()
+        ]
+
+    async def run(self, stopping: Callable[[], bool]):
+        """
+        Runs the jobs until stopping() returns True.
+        """
+        while stopping() is False:
+            delay = self.__next_due_time() - time.monotonic()
+            if delay > 0:
+                self.__wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.__wakeup.wait(), delay)
+                    continue  # Job added, compute the delay again
+                except asyncio.TimeoutError:
+                    pass
+            if stopping():
+                break
+            due = self.__pop_due_jobs()
+            if due:
+                await self.run_batch(due)
+        self.__logger.debug("Periodic job stats: %s" % self.stats())
+
+    async def run_batch(self, jobs: list[PeriodicJob]):
+        """
+        Runs the jobs due at the same tick with a single producer wait.
+        """
+        producer = None
+        try:
+            producer = await asyncio.wait_for(self.__get_producer(), PRODUCER_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.__logger.debug("Producer not available for jobs %s" % ', '.join([j.name for j in jobs]))
+
+        runnable = list()
+        for job in jobs:
+            if producer is None and job.requires_producer:
+                job.producer_unavailable += 1
+                job.failures += 1
+                backoff = min(2 ** job.failures, job.interval_ticks)
+                if job.failures == 1:
+                    self.__logger.warning("Producer not available, job %s postponed" % job.name)
+                self.__insert(job, self.__current_tick() + backoff)
+            else:
+                job.failures = 0
+                runnable.append(job)
+
+        if runnable:
+            await asyncio.gather(*[self.__run_job(job, producer) for job in runnable])
+
+    async def __run_job(self, job: PeriodicJob, producer):
+        start = time.monotonic()
+        job.last_latency = max(start - self.__tick_time(job.due_tick), 0.0)
+        job.max_latency = max(job.max_latency, job.last_latency)
+        try:
+            await job.callback(producer)
+        except asyncio.CancelledError as e:
+            raise e
+        except Exception:
+            job.errors += 1
+            self.__logger.exception("Error in periodic job %s" % job.name)
+        finally:
+            job.runs += 1
+            job.last_duration = time.monotonic() - start
+            self.__reschedule(job)
+
+    def __reschedule(self, job: PeriodicJob):
+        if self.__jobs.get(job.name) is not job:
+            return  # Removed while running
+        next_tick = job.due_tick + job.interval_ticks
+        current = self.__current_tick()
+        if next_tick <= current:
+            # Late, coalesce the missed ticks into the next one
+            missed = (current - next_tick) // job.interval_ticks + 1
+            job.missed += missed
+            next_tick += missed * job.interval_ticks
+        self.__insert(job, next_tick)
+
+    def __insert(self, job: PeriodicJob, tick: int):
+        job.due_tick = tick
+        self.__wheel[tick % len(self.__wheel)].append(job)
+
+    def __pop_due_jobs(self) -> list[PeriodicJob]:
+        current = self.__current_tick()
+        size = len(self.__wheel)
+        if current - self.__last_tick >= size:
+            slots = range(size)  # Slept over a full turn, check every slot
+        else:
+            slots = [tick % size for tick in range(self.__last_tick + 1, current + 1)]
+        self.__last_tick = current
+
+        due = list()
+        for slot in slots:
+            jobs = self.__wheel[slot]
+            if not jobs:
+                continue
+            remaining = [job for job in jobs if job.due_tick > current]
+            if len(remaining) < len(jobs):
+                due.extend([job for job in jobs if job.due_tick <= current])
+                self.__wheel[slot] = remaining
+        return due
+
+    def __next_due_time(self) -> float:
+        """
+        :return: Monotonic time of the next occupied tick, one wheel turn from now when no job is due within a turn
+        """
+        current = max(self.__current_tick(), self.__last_tick + 1)
+        size = len(self.__wheel)
+        for tick in range(current, current + size):
+            for job in self.__wheel[tick % size]:
+                if job.due_tick == tick:
+                    return self.__tick_time(tick)
+        return self.__tick_time(current + size)
+
+    def __current_tick(self) -> int:
+        return int((time.monotonic() - self.__start) / self.__tick)
+
+    def __tick_time(self, tick: int) -> float:
+        return self.__start + tick * self.__tick
@@ -0,0 +1,109 @@
+import heapq
+import os
+import time
+
+from typing import Optional, TypedDict
+
+PROC_ROOT = '/proc'
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+# Rust mapping:
+# struct ProcessStats {
+#     pid: u32,
+#     name: String,
+#     cpu_percent: f64,
+#     rss_bytes: u64,
+# }
+class ProcessStats(TypedDict):
+    pid: int
+    name: str  # Command name (comm), truncated to 15 characters by the kernel
+    cpu_percent: float  # Percent of one cpu over the interval, can go over 100
+    rss_bytes: int
+
+
+def parse_stat(content: bytes) -> tuple[str, int, int, int]:
+    """
+    Parses the content of /proc/<pid>/stat.
+    :return: (name, start time, cpu ticks (user + system), rss pages)
+    """
+    # The name is between the first '(' and the last ')', it can contain spaces and parentheses
+    name_start = content.index(b'(')
+    name_end = content.rindex(b')')
+    fields = content[name_end + 2:].split()
+    # fields[0] is field 3 (state) of proc_pid_stat(5)
+    utime = int(fields[11])
+    stime = int(fields[12])
+    starttime = int(fields[19])
+    rss = int(fields[21])
+    return content[name_start + 1:name_end].decode('utf-8', errors='replace'), starttime, utime + stime, rss
+
+
+class ProcessScanner:
+    """
+    Top processes by cpu usage, read from /proc/<pid>/stat.
+
+    Keeps the cpu ticks of each pid between samples to compute the usage over the interval. A pid reused by a new
+    process is detected with its start time.
+    """
+
+    def __init__(self, proc_root: str = PROC_ROOT, top: int = 10):
+        """
+        :param top: Maximum number of processes reported
+        """
+        self.__proc_root = proc_root
+        self.__top = top
+        self.__previous: dict[int, tuple[int, int]] = dict()  # pid: (start time, cpu ticks)
+        self.__previous_time: Optional[float] = None
+
+    def read(self) -> list[ProcessStats]:
+        """
+        :return: Up to top processes with the highest cpu usage since the previous call, empty on the first call.
+        """
+        now = time.monotonic()
+        elapsed = now - self.__previous_time if self.__previous_time is not None else 0.0
+        self.__previous_time = now
+
+        ticks_per_percent = CLOCK_TICKS * elapsed / 100
+        current: dict[int, tuple[int, int]] = dict()
+        candidates: list[tuple[int, int, str, int]] = list()  # (delta ticks, pid, name, rss pages)
+        previous = self.__previous
+        proc_root = self.__proc_root
+
+        for entry in os.listdir(proc_root):
+            if not entry.isdigit():
+                continue
+            try:
+                fd = os.open(f'{proc_root}/{entry}/stat', os.O_RDONLY)
+                try:
+                    content = os.read(fd, 1024)
+                finally:
+                    os.close(fd)
+                name, starttime, ticks, rss = parse_stat(content)
+            except (FileNotFoundError, ProcessLookupError, PermissionError, ValueError, IndexError):
+                continue  # Process exited or unreadable
+
+            pid = int(entry)
+            current[pid] = (starttime, ticks)
+            previous_stat = previous.get(pid)
+            if previous_stat is not None and previous_stat[0] == starttime:
+                delta = ticks - previous_stat[1]
+                if delta > 0:
+                    candidates.append((delta, pid, name, rss))
+
+        self.__previous = current
+
+        if ticks_per_percent <= 0:
+            return list()
+
+        return [
+            {
+                'pid': pid,
+                'name': name,
+                'cpu_percent': round(delta / ticks_per_percent, 1),
+                'rss_bytes': rss * PAGE_SIZE,
+            }
+            for delta, pid, name, rss in heapq.nlargest(self.__top, candidates)
+        ]
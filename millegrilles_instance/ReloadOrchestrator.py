@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+
+from subprocess import CalledProcessError
+from typing import Callable
+
+from millegrilles_instance.SystemdUtil import SystemdController
+
+SERVICE_MIDDLEWARE = 'middleware'
+SERVICE_APPLICATIONS = 'applications'
+SERVICE_NGINX = 'nginx'
+
+# The applications use the middleware (MQ, mongo, redis) and nginx proxies both
+SERVICE_ORDER = [SERVICE_MIDDLEWARE, SERVICE_APPLICATIONS, SERVICE_NGINX]
+
+ACTION_RELOAD = 'reload'
+ACTION_RESTART = 'restart'
+
+
+class ReloadIntent:
+    """
+    Reload or restart requested on a service, merged with the other requests received during the same window.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+        self.action = ACTION_RELOAD
+        self.update_certs = False  # Run certs_updater before the applications
+        self.restart_on_failure = False  # Restart when the reload fails
+        self.requests = 0
+        self.waiters: list[asyncio.Future] = list()
+
+    def merge(self, action: str, update_certs: bool, restart_on_failure: bool):
+        if action == ACTION_RESTART:
+            self.action = ACTION_RESTART  # A restart also reloads the configuration
+        self.update_certs = self.update_certs or update_certs
+        self.restart_on_failure = self.restart_on_failure or restart_on_failure
+        self.requests += 1
+
+    def __repr__(self):
+        return f'ReloadIntent({self.action} {self.service}, requests={self.requests})'
+
+
+class ReloadOrchestrator:
+    """
+    Collects the reload/restart requests on the instance services over a short window, then runs one action per
+    service in dependency order (middleware, applications, nginx). A burst of requests on a service results in a
+    single reload, or a single restart when any of the requests was a restart.
+
+    A restart of the middleware runs last in its batch: restarting MQ may crash the manager, the restarts of the
+    applications and nginx (e.g. with renewed certificates) must not be lost with it.
+    """
+
+    def __init__(self, systemd: SystemdController, get_instance_name: Callable[[], str],
+                 window: float, max_delay: float):
+        """
+        :param get_instance_name: Prefix of the systemd units, read when the actions run
+        :param window: Seconds without a new request before running the actions
+        :param max_delay: Maximum seconds between the first request and running the actions
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__systemd = systemd
+        self.__get_instance_name = get_instance_name
+        self.__window = window
+        self.__max_delay = max_delay
+        self.__pending: dict[str, ReloadIntent] = dict()
+        self.__requested = asyncio.Event()
+        self.__batches = 0
+
+    @property
+    def pending(self) -> list[ReloadIntent]:
+        intents = [self.__pending[s] for s in SERVICE_ORDER if s in self.__pending]
+        # Stable sort, only moves a middleware restart to the end
+        return sorted(intents, key=lambda i: i.service == SERVICE_MIDDLEWARE and i.action == ACTION_RESTART)
+
+    @property
+    def batches(self) -> int:
+        """ Number of batches of actions run """
+        return self.__batches
+
+    def request(self, service: str, action: str = ACTION_RELOAD, update_certs=False,
+                restart_on_failure=False) -> asyncio.Future:
+        """
+        Must be called from the event loop.
+        :param service: One of SERVICE_ORDER
+        :param action: ACTION_RELOAD or ACTION_RESTART
+        :return: Future done when the merged action on the service is done, with its exception on failure
+        """
+        if service not in SERVICE_ORDER:
+            raise ValueError('Unknown service %s' % service)
+        if action not in (ACTION_RELOAD, ACTION_RESTART):
+            raise ValueError('Unknown action %s' % action)
+
+        intent = self.__pending.get(service)
+        if intent is None:
+            intent = ReloadIntent(service)
+            self.__pending[service] = intent
+        intent.merge(action, update_certs, restart_on_failure)
+
+        waiter = asyncio.get_running_loop().create_future()
+        intent.waiters.append(waiter)
+        self.__requested.set()
+        return waiter
+
+    async def reload(self, service: str, update_certs=False, restart_on_failure=False):
+        await self.request(service, ACTION_RELOAD, update_certs, restart_on_failure)
+
+    async def restart(self, service: str):
+        await self.request(service, ACTION_RESTART)
+
+    async def run(self, stopping: Callable[[], bool]):
+        try:
+            while stopping() is False:
+                await self.__requested.wait()
+                await self.__wait_end_of_burst()
+                if stopping():
+                    break
+                await self.flush()
+        finally:
+            for intent in self.__pending.values():
+                for waiter in intent.waiters:
+                    waiter.cancel()
+            self.__pending.clear()
+
+    async def flush(self):
+        """
+        Runs the pending actions now, in dependency order. Requests received meanwhile go in the next batch.
+        """
+        self.__requested.clear()
+        intents, self.__pending = self.pending, dict()
+        if not intents:
+            return
+        self.__batches += 1
+        self.__logger.info("Running %s" % ', '.join([str(i) for i in intents]))
+
+        try:
+            for intent in intents:
+                try:
+                    await self.__run_intent(intent)
+                except Exception as e:
+                    self.__logger.error("Error on %s: %s" % (intent, e))
+                    for waiter in intent.waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                else:
+                    for waiter in intent.waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+        finally:
+            # Cancelled while running
+            for intent in intents:
+                for waiter in intent.waiters:
+                    if not waiter.done():
+                        waiter.cancel()
+
+    async def __wait_end_of_burst(self):
+        deadline = time.monotonic() + self.__max_delay
+        while True:
+            self.__requested.clear()
+            timeout = min(self.__window, deadline - time.monotonic())
+            if timeout <= 0:
+                return
+            try:
+                await asyncio.wait_for(self.__requested.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    async def __run_intent(self, intent: ReloadIntent):
+        unit = f'{self.__get_instance_name()}-{intent.service}'
+
+        if intent.update_certs:
+            # Need to generate certificates first to avoid reload issue with applications service
+            await self.__systemd.start(f'{self.__get_instance_name()}-certs_updater')
+
+        if intent.action == ACTION_RESTART:
+            await self.__systemd.restart(unit)
+            return
+
+        try:
+            await self.__systemd.reload(unit)
+        except CalledProcessError:
+            if intent.restart_on_failure is False:
+                raise
+            self.__logger.warning("Error during %s reload, trying restart" % unit)
+            await self.__systemd.restart(unit)
@@ -0,0 +1,63 @@
+import json
+import logging
+import pathlib
+import sys
+import time
+
+from contextlib import contextmanager
+from typing import TypedDict
+
+
+class StartupRecord(TypedDict):
+    service: str
+    phase: str  # import, wiring or setup
+    start_ms: float  # Relative to process start
+    duration_ms: float
+    modules_loaded: int
+
+
+class StartupProfiler:
+    """
+    Records import, wiring and setup time of each service during manager startup.
+    Recording is always on (a few perf_counter calls), the report is only written with --profile-startup.
+    """
+
+    def __init__(self):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__start = time.perf_counter()
+        self.__records: list[StartupRecord] = list()
+
+    @contextmanager
+    def measure(self, service: str, phase: str):
+        modules_before = len(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.__records.append({
+                'service': service,
+                'phase': phase,
+                'start_ms': round((start - self.__start) * 1000, 3),
+                'duration_ms': round((end - start) * 1000, 3),
+                'modules_loaded': len(sys.modules) - modules_before,
+            })
+
+    def report(self) -> dict:
+        services: dict[str, dict[str, float]] = dict()
+        for record in self.__records:
+            service = services.setdefault(record['service'], dict())
+            key = f"{record['phase']}_ms"
+            service[key] = round(service.get(key, 0.0) + record['duration_ms'], 3)
+
+        return {
+            'total_ms': round((time.perf_counter() - self.__start) * 1000, 3),
+            'services': services,
+            'records': self.__records,
+        }
+
+    def write(self, path: pathlib.Path):
+        report = self.report()
+        with open(path, 'wt') as f:
+            json.dump(report, f, indent=2)
+        self.__logger.info("Startup profile written to %s (total %.1f ms)" % (path, report['total_ms']))
@@ -0,0 +1,283 @@
+import logging
+import math
+
+from array import array
+from typing import Optional, TypedDict
+
+NAN = float('nan')
+
+# Metrics kept in the history, one column each. Extracted from the SystemState of each sample.
+HISTORY_METRICS = (
+    'cpu_usage_percent',
+    'load_average_1m',
+    'memory_percent',
+    'swap_percent',
+    'disk_used_percent',  # Fullest partition
+    'network_bytes_sent_per_sec',
+    'network_bytes_recv_per_sec',
+    'disk_read_bytes_per_sec',
+    'disk_write_bytes_per_sec',
+    'disk_read_iops',
+    'disk_write_iops',
+    'temperature_max',
+)
+
+
+# Rust mapping:
+# struct SystemHistoryResponse {
+#     ok: bool,
+#     resolution: u32,
+#     timestamps: Vec<i64>,
+#     values: HashMap<String, Vec<Option<f64>>>,
+# }
+class SystemHistoryResponse(TypedDict):
+    ok: bool
+    resolution: int  # Seconds per point
+    timestamps: list[int]  # Start of each point, epoch seconds
+    values: dict[str, list[Optional[float]]]  # Average over each point by metric, None when not available
+
+
+def extract_metrics(state: dict) -> list[float]:
+    """
+    :param state: SystemState
+    :return: Values in the order of HISTORY_METRICS, NaN when not available.
+    """
+    def get(*keys):
+        value = state
+        try:
+            for key in keys:
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return NAN
+        return float(value) if value is not None else NAN
+
+    return [
+        get('cpu_usage_percent'),
+        get('load_average', 0),
+        get('memory', 'percent'),
+        get('swap', 'percent'),
+        fullest_partition_percent(state),
+        get('network_rates', 'bytes_sent_per_sec'),
+        get('network_rates', 'bytes_recv_per_sec'),
+        get('disk_io_rates', 'read_bytes_per_sec'),
+        get('disk_io_rates', 'write_bytes_per_sec'),
+        get('disk_io_rates', 'read_iops'),
+        get('disk_io_rates', 'write_iops'),
+        max_temperature(state),
+    ]
+
+
+def fullest_partition_percent(state: dict) -> float:
+    disk_used = NAN
+    for partition in state.get('disk') or list():
+        if partition['total'] > 0:
+            percent = partition['used'] * 100 / partition['total']
+            if disk_used != disk_used or percent > disk_used:
+                disk_used = percent
+    return disk_used
+
+
+def max_temperature(state: dict) -> float:
+    temperature_max = NAN
+    for sensors in (state.get('system_temperature') or dict()).values():
+        for sensor in sensors:
+            current = sensor[1]  # shwtemp(label, current, high, critical)
+            if current is not None and (temperature_max != temperature_max or current > temperature_max):
+                temperature_max = float(current)
+    return temperature_max
+
+
+class MetricsTier:
+    """
+    Fixed size ring of points at one resolution. Samples are averaged into the current point until a sample falls
+    in the next one. Each metric is a column in an array of doubles.
+    """
+
+    def __init__(self, resolution: int, retention: int, metrics_count: int):
+        self.__resolution = resolution
+        self.__retention = retention
+        self.__capacity = retention // resolution
+        self.__timestamps = array('d', [NAN]) * self.__capacity
+        self.__columns = [array('d', [NAN]) * self.__capacity for _ in range(metrics_count)]
+        self.__head = 0  # Next slot to write
+        self.__count = 0
+
+        # Point being accumulated
+        self.__current: Optional[float] = None
+        self.__sums = [0.0] * metrics_count
+        self.__counts = [0] * metrics_count
+
+    @property
+    def resolution(self) -> int:
+        return self.__resolution
+
+    @property
+    def retention(self) -> int:
+        return self.__retention
+
+    def __len__(self):
+        return self.__count
+
+    def add(self, timestamp: float, values: list[float]) -> bool:
+        """
+        :return: False when the sample is older than the current point (e.g. clock moved back) and was dropped.
+        """
+        point = timestamp - timestamp % self.__resolution
+        if self.__current is not None:
+            if point < self.__current:
+                return False
+            elif point > self.__current:
+                self.__flush()
+        self.__current = point
+        for i, value in enumerate(values):
+            if value == value:  # Skip NaN
+                self.__sums[i] += value
+                self.__counts[i] += 1
+        return True
+
+    def points(self, start: float, end: float) -> list[tuple[float, list[float]]]:
+        """
+        :return: Points in [start, end] in chronological order, including the point being accumulated.
+        """
+        result = list()
+        capacity = self.__capacity
+        oldest = self.__head - self.__count
+        for i in range(oldest, self.__head):
+            idx = i % capacity
+            timestamp = self.__timestamps[idx]
+            if start <= timestamp <= end:
+                result.append((timestamp, [column[idx] for column in self.__columns]))
+
+        if self.__current is not None and start <= self.__current <= end:
+            result.append((self.__current, self.__current_values()))
+
+        return result
+
+    def __current_values(self) -> list[float]:
+        return [s / c if c > 0 else NAN for s, c in zip(self.__sums, self.__counts)]
+
+    def __flush(self):
+        idx = self.__head
+        self.__timestamps[idx] = self.__current
+        for column, value in zip(self.__columns, self.__current_values()):
+            column[idx] = value
+        self.__head = (idx + 1) % self.__capacity
+        self.__count = min(self.__count + 1, self.__capacity)
+        self.__sums = [0.0] * len(self.__sums)
+        self.__counts = [0] * len(self.__counts)
+
+
+class SystemHistory:
+    """
+    In-memory history of the system metrics. Each sample goes to every tier: the first tier holds recent samples at full
+    resolution, the others hold averages over longer periods.
+    """
+
+    def __init__(self, tiers: list[tuple[int, int]], max_points: int):
+        """
+        :param tiers: (resolution, retention) in seconds, from the finest resolution to the coarsest
+        :param max_points: Maximum number of points in a response, the resolution is lowered to fit
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__tiers = [MetricsTier(resolution, retention, len(HISTORY_METRICS)) for resolution, retention in tiers]
+        self.__max_points = max_points
+        self.__last_timestamp: Optional[float] = None
+
+    @property
+    def tiers(self) -> list[MetricsTier]:
+        return self.__tiers
+
+    def add(self, timestamp: float, state: dict):
+        self.add_values(timestamp, extract_metrics(state))
+
+    def add_values(self, timestamp: float, values: list[float]):
+        for tier in self.__tiers:
+            if tier.add(timestamp, values) is False:
+                self.__logger.debug("Dropping history sample at %s, older than the current point" % timestamp)
+                return
+        self.__last_timestamp = timestamp
+
+    def load(self, samples: list[tuple[float, list[float]]]):
+        """
+        Loads chronological samples, e.g. from the history file on startup. Each tier only gets the samples within
+        its retention.
+        """
+        if len(samples) == 0:
+            return
+        latest = samples[-1][0]
+        for tier in self.__tiers:
+            since = latest - tier.retention - tier.resolution
+            for timestamp, values in samples:
+                if timestamp >= since:
+                    tier.add(timestamp, values)
+        self.__last_timestamp = latest
+
+    def query(self, start: float, end: float, resolution: int = 0, metrics: Optional[list[str]] = None) -> SystemHistoryResponse:
+        """
+        :param start: Epoch seconds
+        :param end: Epoch seconds
+        :param resolution: Requested seconds per point, the finest resolution available is used when lower
+        :param metrics: Names from HISTORY_METRICS, all when None
+        :raises ValueError: Unknown metric or invalid range
+        """
+        if end < start:
+            raise ValueError('end is before start')
+        if metrics is None:
+            metrics = list(HISTORY_METRICS)
+        try:
+            columns = [HISTORY_METRICS.index(m) for m in metrics]
+        except ValueError:
+            raise ValueError(f'Unknown metric, available: {", ".join(HISTORY_METRICS)}')
+
+        # Finest tier that still holds the start of the range, coarsest tier when none does
+        latest = self.__last_timestamp or end
+        tier = next((t for t in self.__tiers if latest - start <= t.retention), self.__tiers[-1])
+
+        resolution = max(resolution, tier.resolution)
+        points_needed = (end - start) / resolution
+        if points_needed > self.__max_points:
+            # Round up to a multiple of the tier resolution
+            resolution = math.ceil((end - start) / self.__max_points / tier.resolution) * tier.resolution
+
+        timestamps: list[int] = list()
+        values: list[list[Optional[float]]] = [list() for _ in columns]
+        for point, point_values in downsample(tier.points(start, end), tier.resolution, resolution):
+            timestamps.append(int(point))
+            for output, column in zip(values, columns):
+                value = point_values[column]
+                output.append(round(value, 3) if value == value else None)
+
+        return {
+            'ok': True,
+            'resolution': int(resolution),
+            'timestamps': timestamps,
+            'values': {name: column_values for name, column_values in zip(metrics, values)},
+        }
+
+
+def downsample(points: list[tuple[float, list[float]]], source_resolution: int, resolution: int):
+    """
+    Averages chronological points into buckets of resolution seconds. NaN values are ignored.
+    """
+    if resolution <= source_resolution:
+        yield from points
+        return
+
+    current: Optional[float] = None
+    sums: list[float] = list()
+    counts: list[int] = list()
+    for timestamp, values in points:
+        point = timestamp - timestamp % resolution
+        if point != current:
+            if current is not None:
+                yield current, [s / c if c > 0 else NAN for s, c in zip(sums, counts)]
+            current = point
+            sums = [0.0] * len(values)
+            counts = [0] * len(values)
+        for i, value in enumerate(values):
+            if value == value:
+                sums[i] += value
+                counts[i] += 1
+
+    if current is not None:
+        yield current, [s / c if c > 0 else NAN for s, c in zip(sums, counts)]
@@ -0,0 +1,210 @@
+import logging
+import mmap
+import os
+import pathlib
+import struct
+import zlib
+
+from typing import Iterator, Optional
+
+from millegrilles_instance.SystemHistory import NAN, SystemHistory, fullest_partition_percent, max_temperature
+
+# Record fields by path in the SystemState, with the struct format of each value. Byte counts are doubles (exact up
+# to 2**53) to keep NaN for missing values, percents and rates are floats.
+# Changing this schema changes the schema hash, the existing file is then discarded.
+RECORD_SCHEMA: tuple[tuple[str, str], ...] = (
+    ('cpu_usage_percent', 'f'),
+    ('load_average.0', 'f'),
+    ('load_average.1', 'f'),
+    ('load_average.2', 'f'),
+    # MemoryInfo
+    ('memory.total', 'd'),
+    ('memory.available', 'd'),
+    ('memory.percent', 'f'),
+    ('memory.used', 'd'),
+    ('memory.free', 'd'),
+    # SwapInfo
+    ('swap.total', 'd'),
+    ('swap.used', 'd'),
+    ('swap.free', 'd'),
+    ('swap.percent', 'f'),
+    # NetworkRates
+    ('network_rates.bytes_sent_per_sec', 'f'),
+    ('network_rates.bytes_recv_per_sec', 'f'),
+    ('network_rates.packets_sent_per_sec', 'f'),
+    ('network_rates.packets_recv_per_sec', 'f'),
+    ('network_rates.errors_per_sec', 'f'),
+    ('network_rates.drops_per_sec', 'f'),
+    # DiskIORates
+    ('disk_io_rates.read_bytes_per_sec', 'f'),
+    ('disk_io_rates.write_bytes_per_sec', 'f'),
+    ('disk_io_rates.read_iops', 'f'),
+    ('disk_io_rates.write_iops', 'f'),
+    ('disk_io_rates.read_latency_ms', 'f'),
+    ('disk_io_rates.write_latency_ms', 'f'),
+    ('uptime_seconds', 'd'),
+    # Summaries of the variable length lists
+    ('disk_used_percent', 'f'),
+    ('temperature_max', 'f'),
+)
+
+# Record: seq (0 for an empty slot), timestamp, schema values, crc32 of the preceding bytes
+RECORD_HEADER = '<Qd'
+RECORD_FORMAT = RECORD_HEADER + ''.join(code for _, code in RECORD_SCHEMA)
+RECORD_STRUCT = struct.Struct(RECORD_FORMAT + 'I')
+CRC_OFFSET = struct.calcsize(RECORD_FORMAT)
+
+FILE_MAGIC = b'MGSH'
+FILE_VERSION = 1
+# File header: magic, version, record size, capacity, schema hash, padded to HEADER_SIZE
+FILE_HEADER = struct.Struct('<4sHHII')
+HEADER_SIZE = 64
+
+SCHEMA_HASH = zlib.crc32(RECORD_STRUCT.format.encode('utf-8') + ','.join(p for p, _ in RECORD_SCHEMA).encode('utf-8'))
+
+# Position of each HISTORY_METRICS value in a record (after seq and timestamp), same order as HISTORY_METRICS
+_SCHEMA_INDEX = {path: i + 2 for i, (path, _) in enumerate(RECORD_SCHEMA)}
+HISTORY_RECORD_INDEX = tuple(_SCHEMA_INDEX[path] for path in (
+    'cpu_usage_percent',
+    'load_average.0',
+    'memory.percent',
+    'swap.percent',
+    'disk_used_percent',
+    'network_rates.bytes_sent_per_sec',
+    'network_rates.bytes_recv_per_sec',
+    'disk_io_rates.read_bytes_per_sec',
+    'disk_io_rates.write_bytes_per_sec',
+    'disk_io_rates.read_iops',
+    'disk_io_rates.write_iops',
+    'temperature_max',
+))
+
+
+def record_values(state: dict) -> list[float]:
+    """
+    :return: Values of a SystemState in the order of RECORD_SCHEMA, NaN when not available.
+    """
+    values = list()
+    for path, _ in RECORD_SCHEMA:
+        if path == 'disk_used_percent':
+            values.append(fullest_partition_percent(state))
+            continue
+        elif path == 'temperature_max':
+            values.append(max_temperature(state))
+            continue
+
+        value = state
+        try:
+            for key in path.split('.'):
+                value = value[int(key)] if isinstance(value, (list, tuple)) else value[key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            value = None
+        values.append(float(value) if value is not None else NAN)
+    return values
+
+
+class SystemHistoryFile:
+    """
+    Circular file of fixed size SystemState records under var/, memory-mapped.
+
+    Appending a sample packs one record in place, in slot seq % capacity. Each record carries its sequence number and
+    a crc32: a record torn by a crash fails the crc and is skipped when the file is read back.
+    """
+
+    def __init__(self, path: pathlib.Path, capacity: int, sync_interval: int = 30):
+        """
+        :param capacity: Number of records in the file
+        :param sync_interval: Records appended between calls to msync
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__path = path
+        self.__capacity = capacity
+        self.__sync_interval = sync_interval
+        self.__mmap: Optional[mmap.mmap] = None
+        self.__next_seq = 1
+        self.__unsynced = 0
+
+    @property
+    def size(self) -> int:
+        return HEADER_SIZE + self.__capacity * RECORD_STRUCT.size
+
+    def open(self):
+        """
+        Opens the file, creates it when missing or when its layout does not match this schema.
+        """
+        self.__path.parent.mkdir(parents=True, exist_ok=True)
+        header = FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD_STRUCT.size, self.__capacity, SCHEMA_HASH)
+
+        fd = os.open(self.__path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.pread(fd, FILE_HEADER.size, 0)
+            if existing != header or os.fstat(fd).st_size != self.size:
+                if len(existing) > 0:
+                    self.__logger.warning("System history file %s has a different layout, resetting it" % self.__path)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)  # Sparse, empty slots read as seq 0
+                os.pwrite(fd, header, 0)
+            self.__mmap = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+
+        last_seq = 0
+        for seq, _ in self.__iter_slots():
+            if seq > last_seq:
+                last_seq = seq
+        self.__next_seq = last_seq + 1
+
+    def close(self):
+        if self.__mmap is not None:
+            self.__mmap.flush()
+            self.__mmap.close()
+            self.__mmap = None
+
+    def append(self, timestamp: float, state: dict):
+        """
+        Writes a sample over the oldest record. O(1): one record is packed in place.
+        """
+        seq = self.__next_seq
+        self.__next_seq += 1
+        offset = HEADER_SIZE + (seq % self.__capacity) * RECORD_STRUCT.size
+
+        record = bytearray(RECORD_STRUCT.size)
+        struct.pack_into(RECORD_FORMAT, record, 0, seq, timestamp, *record_values(state))
+        struct.pack_into('<I', record, CRC_OFFSET, zlib.crc32(memoryview(record)[:CRC_OFFSET]))
+        self.__mmap[offset:offset + RECORD_STRUCT.size] = record
+
+        self.__unsynced += 1
+        if self.__unsynced >= self.__sync_interval:
+            self.__mmap.flush()
+            self.__unsynced = 0
+
+    def records(self) -> list[tuple]:
+        """
+        :return: Valid records (seq, timestamp, values...) ordered by seq.
+        """
+        records = [record for _, record in self.__iter_slots()]
+        records.sort(key=lambda r: r[0])
+        return records
+
+    def replay(self, history: SystemHistory) -> int:
+        """
+        Loads the records into the history.
+        :return: Number of records loaded
+        """
+        samples = [(record[1], [record[i] for i in HISTORY_RECORD_INDEX]) for record in self.records()]
+        history.load(samples)
+        return len(samples)
+
+    def __iter_slots(self) -> Iterator[tuple[int, tuple]]:
+        view = memoryview(self.__mmap)[HEADER_SIZE:]
+        try:
+            for slot, record in enumerate(RECORD_STRUCT.iter_unpack(view)):
+                seq = record[0]
+                if seq == 0:
+                    continue  # Empty slot
+                start = slot * RECORD_STRUCT.size
+                if zlib.crc32(view[start:start + CRC_OFFSET]) != record[-1]:
+                    continue  # Torn or corrupted record
+                yield seq, record[:-1]
+        finally:
+            view.release()
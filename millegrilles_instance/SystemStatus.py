@@ -1,20 +1,31 @@
 import asyncio
 import datetime
 import logging
-import socket
+import os
 from asyncio import TaskGroup
 
 import psutil
 import time
-from typing import Any, Dict, List, Optional, Union, TypedDict
+from typing import Any, Dict, List, NotRequired, Optional, TypedDict
 
 from aiohttp import ClientSession, ClientError, ClientTimeout
 from urllib.parse import urlparse
 
+from millegrilles_instance import Constantes as ConstantesInstance
+from millegrilles_instance.ApcUps import ApcUpsClient
 from millegrilles_instance.Configuration import ConfigurationInstance
+from millegrilles_instance.HostIdentity import HostIdentityCache, VIRTUAL_INTERFACE_PREFIXES
+from millegrilles_instance.PartitionProbe import PartitionProber
+from millegrilles_instance.ContainerStats import ContainerServiceStats, ContainerStatsCollector
+from millegrilles_instance.ProcessStats import ProcessScanner, ProcessStats
 from millegrilles_instance.Context import InstanceContext
+from millegrilles_instance.SystemHistory import SystemHistory
+from millegrilles_instance.SystemHistoryFile import SystemHistoryFile
+from millegrilles_instance.SystemStatusDelta import SystemStatusDeltaEncoder
 from millegrilles_messages.messages import Constantes as MilleGrillesConstantes
 from millegrilles_messages.messages.EnveloppeCertificat import EnveloppeCertificat
+from millegrilles_messages.messages.MessagesModule import MessageWrapper
+from millegrilles_messages.bus.PikaMessageProducer import MilleGrillesPikaMessageProducer
 
 
 # Rust mapping:
@@ -34,12 +45,14 @@ class HostInfo(TypedDict):
 #     free: u64,
 #     used: u64,
 #     total: u64,
+#     stale: Option<bool>,
 # }
 class PartitionUsageItem(TypedDict):
     mountpoint: str
     free: int
     used: int
     total: int
+    stale: NotRequired[bool]  # Mount not answering, last known values (0 when never read)
 
 # Rust mapping:
 # struct MemoryInfo {
@@ -107,6 +120,58 @@ class DiskIOInfo(TypedDict):
     read_time: float
     write_time: float
 
+# Rust mapping:
+# struct NetworkRates {
+#     bytes_sent_per_sec: f64,
+#     bytes_recv_per_sec: f64,
+#     packets_sent_per_sec: f64,
+#     packets_recv_per_sec: f64,
+#     errors_per_sec: f64,
+#     drops_per_sec: f64,
+# }
+class NetworkRates(TypedDict):
+    bytes_sent_per_sec: float
+    bytes_recv_per_sec: float
+    packets_sent_per_sec: float
+    packets_recv_per_sec: float
+    errors_per_sec: float
+    drops_per_sec: float
+
+# Rust mapping:
+# struct NetworkInterfaceRates {
+#     name: String,
+#     #[serde(flatten)]
+#     rates: NetworkRates,
+# }
+class NetworkInterfaceRates(NetworkRates):
+    name: str
+
+# Rust mapping:
+# struct DiskIORates {
+#     read_bytes_per_sec: f64,
+#     write_bytes_per_sec: f64,
+#     read_iops: f64,
+#     write_iops: f64,
+#     read_latency_ms: f64,
+#     write_latency_ms: f64,
+# }
+class DiskIORates(TypedDict):
+    read_bytes_per_sec: float
+    write_bytes_per_sec: float
+    read_iops: float
+    write_iops: float
+    read_latency_ms: float  # Average time per read over the interval
+    write_latency_ms: float
+
+# Rust mapping:
+# struct DiskDeviceRates {
+#     name: String,
+#     #[serde(flatten)]
+#     rates: DiskIORates,
+# }
+class DiskDeviceRates(DiskIORates):
+    name: str
+
 # Rust mapping:
 # struct SystemState {
 #     host: Option<HostInfo>,
@@ -118,6 +183,12 @@ class DiskIOInfo(TypedDict):
 #     cpu_usage_percent: f64,
 #     network: NetworkInfo,
 #     disk_io: Option<DiskIOInfo>,
+#     network_rates: Option<NetworkRates>,
+#     network_interfaces: Option<Vec<NetworkInterfaceRates>>,
+#     disk_io_rates: Option<DiskIORates>,
+#     disk_devices: Option<Vec<DiskDeviceRates>>,
+#     containers: Option<Vec<ContainerServiceStats>>,
+#     top_processes: Option<Vec<ProcessStats>>,
 #     uptime_seconds: f64,
 #     system_temperature: Option<serde_json::Value>,
 #     system_fans: Option<serde_json::Value>,
@@ -134,6 +205,12 @@ class SystemState(TypedDict, total=False):
     cpu_usage_percent: float
     network: NetworkInfo
     disk_io: DiskIOInfo
+    network_rates: NetworkRates  # Rates are available from the second sample
+    network_interfaces: List[NetworkInterfaceRates]
+    disk_io_rates: DiskIORates
+    disk_devices: List[DiskDeviceRates]
+    containers: List[ContainerServiceStats]  # Per compose service of the instance
+    top_processes: List[ProcessStats]  # Highest cpu usage first
     uptime_seconds: float
     system_temperature: Dict[str, Any]
     system_fans: Dict[str, Any]
@@ -141,15 +218,94 @@ class SystemState(TypedDict, total=False):
     apc: Dict[str, Any]
 
 
+def counter_rates(previous: Dict[str, tuple], current: Dict[str, tuple], elapsed: float) -> Dict[str, Dict[str, float]]:
+    """
+    Per second rate of every counter of every device, computed in a single pass over the two samples.
+    Devices that are new or whose counters went backwards (reset, device re-created) are skipped for this sample.
+    :param previous: Previous psutil sample, namedtuples by device name
+    :param current: Current psutil sample
+    :param elapsed: Seconds between the samples
+    :return: Deltas divided by elapsed, keyed by device then by counter name. Also includes the raw deltas of the
+             counters under the key 'delta_<name>' for derived values (e.g. latency).
+    """
+    rates: Dict[str, Dict[str, float]] = dict()
+    if elapsed <= 0:
+        return rates
+    for name, counters in current.items():
+        try:
+            previous_counters = previous[name]
+        except KeyError:
+            continue  # New device
+        deltas = [c - p for c, p in zip(counters, previous_counters)]
+        if any(d < 0 for d in deltas):
+            continue  # Counter reset
+        device_rates = {f'delta_{field}': d for field, d in zip(counters._fields, deltas)}
+        device_rates.update({field: d / elapsed for field, d in zip(counters._fields, deltas)})
+        rates[name] = device_rates
+    return rates
+
+
+def network_rates(rates: Dict[str, float]) -> NetworkRates:
+    return {
+        'bytes_sent_per_sec': round(rates['bytes_sent'], 2),
+        'bytes_recv_per_sec': round(rates['bytes_recv'], 2),
+        'packets_sent_per_sec': round(rates['packets_sent'], 2),
+        'packets_recv_per_sec': round(rates['packets_recv'], 2),
+        'errors_per_sec': round(rates['errin'] + rates['errout'], 2),
+        'drops_per_sec': round(rates['dropin'] + rates['dropout'], 2),
+    }
+
+
+def disk_io_rates(rates: Dict[str, float]) -> DiskIORates:
+    delta_reads = rates['delta_read_count']
+    delta_writes = rates['delta_write_count']
+    return {
+        'read_bytes_per_sec': round(rates['read_bytes'], 2),
+        'write_bytes_per_sec': round(rates['write_bytes'], 2),
+        'read_iops': round(rates['read_count'], 2),
+        'write_iops': round(rates['write_count'], 2),
+        # read_time and write_time are cumulative milliseconds spent on the operations
+        'read_latency_ms': round(rates['delta_read_time'] / delta_reads, 3) if delta_reads > 0 else 0.0,
+        'write_latency_ms': round(rates['delta_write_time'] / delta_writes, 3) if delta_writes > 0 else 0.0,
+    }
+
+
 class SystemStatus:
 
-    def __init__(self, configuration: ConfigurationInstance):
+    def __init__(self, configuration: ConfigurationInstance, host_identity: Optional[HostIdentityCache] = None):
+        """
+        :param host_identity: Shared host identity cache, a private one (refreshed on the first read only) when None
+        """
         self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.__configuration = configuration
-        self.__apc_info: Union[Dict[str, Any], bool, None] = None
+        if host_identity is None:
+            host_identity = HostIdentityCache(ConstantesInstance.HOST_IDENTITY_POLL_INTERVAL,
+                                              ConstantesInstance.HOST_IDENTITY_REFRESH_INTERVAL)
+        self.__host_identity = host_identity
+        self.__apc_client = ApcUpsClient(ConstantesInstance.APC_NIS_HOST, ConstantesInstance.APC_NIS_PORT,
+                                         ConstantesInstance.APC_POLL_INTERVAL)
         self.__current_state: SystemState = {}
         psutil.cpu_percent(interval=None)
 
+        # Previous counter samples used to compute rates: (monotonic time, network per nic, disk per device)
+        self.__previous_counters: Optional[tuple[float, dict, dict]] = None
+        self.__block_devices: Dict[str, bool] = dict()  # Cache, True for whole block devices (not partitions)
+
+        self.__partition_prober = PartitionProber(ConstantesInstance.PARTITION_PROBE_TIMEOUT,
+                                                  ConstantesInstance.PARTITION_QUARANTINE_DELAY)
+
+        self.__process_scanner: Optional[ProcessScanner] = None
+        if os.path.isdir('/proc'):
+            self.__process_scanner = ProcessScanner(top=ConstantesInstance.SYSTEM_STATUS_TOP_PROCESSES)
+
+        self.__container_stats: Optional[ContainerStatsCollector] = None
+        if not configuration.is_docker_disabled:
+            collector = ContainerStatsCollector(f'{configuration.instance_name}-', configuration.docker_data_root)
+            if collector.enabled:
+                self.__container_stats = collector
+            else:
+                self.__logger.info("Per container stats not available: %s" % collector.disabled_reason)
+
     @property
     def current_state(self) -> SystemState:
         return self.__current_state
@@ -158,33 +314,12 @@ class SystemStatus:
         info_systeme: SystemState = {}
         
         # Host info
-        hostname = socket.getfqdn()
-        ip_addresses: List[str] = []
-
-        # Get all non-loopback, non-docker IP addresses (IPv4 and IPv6)
-        for interface, addrs in psutil.net_if_addrs().items():
-            # Skip common container/virtual network interfaces
-            if any(prefix in interface for prefix in ['docker', 'veth', 'br-', 'docker0', 'cali', 'flannel']):
-                continue
-            for addr in addrs:
-                if addr.family in (socket.AF_INET, socket.AF_INET6):
-                    # Skip loopback
-                    if addr.address.startswith('127.') or addr.address == '::1':
-                        continue
-                    ip_addresses.append(addr.address)
-
-        # Fallback if no suitable IP was found
-        if not ip_addresses:
-            try:
-                ip_addresses.append(socket.gethostbyname(hostname))
-            except Exception:
-                pass
-
+        identity = self.__host_identity.get()
         ports = self.__configuration.instance_ports
 
         info_systeme['host'] = {
-            'hostname': hostname,
-            'ip_addresses': ip_addresses,
+            'hostname': identity['hostname'],
+            'ip_addresses': identity['ip_addresses'],
             'ports': ports
         }
 
@@ -237,6 +372,17 @@ class SystemStatus:
                 'write_time': disk_io.write_time,
             }
 
+        self.__read_rates(info_systeme, net, disk_io)
+
+        if self.__process_scanner is not None:
+            info_systeme['top_processes'] = self.__process_scanner.read()
+
+        if self.__container_stats is not None:
+            try:
+                info_systeme['containers'] = self.__container_stats.read()
+            except OSError as e:
+                self.__logger.warning("Error reading container stats: %s" % e)
+
         # Uptime
         info_systeme['uptime_seconds'] = time.time() - psutil.boot_time()
 
@@ -262,42 +408,84 @@ class SystemStatus:
         except AttributeError:
             pass
 
-        if self.__apc_info and self.__apc_info is not False:
-            info_systeme['apc'] = self.__apc_info
+        apc_status = self.__apc_client.status
+        if apc_status:
+            info_systeme['apc'] = apc_status
 
         self.__current_state = info_systeme
 
         return info_systeme
 
-    async def apc_info(self) -> bool:
+    def __read_rates(self, info_systeme: SystemState, net, disk_io):
         """
-        Charge l'information du UPS de type APC.
-        L'option se desactive automatiquement au premier echec
+        Adds per second rates (total, per network interface and per block device) computed against the previous sample.
         """
-        from apcaccess import status as apc
-
-        if self.__apc_info is False:
-            return True  # Make the thread stop
+        now = time.monotonic()
+        net_per_nic = psutil.net_io_counters(pernic=True)
+        disk_per_device = psutil.disk_io_counters(perdisk=True) or dict()
+        # Totals are added as a pseudo device to compute everything in the same pass
+        net_per_nic = {**net_per_nic, '': net}
+        if disk_io:
+            disk_per_device = {**disk_per_device, '': disk_io}
+
+        previous = self.__previous_counters
+        self.__previous_counters = (now, net_per_nic, disk_per_device)
+        if previous is None:
+            return  # First sample
+
+        previous_time, previous_net, previous_disk = previous
+        elapsed = now - previous_time
+
+        net_rates = counter_rates(previous_net, net_per_nic, elapsed)
+        total_rates = net_rates.pop('', None)
+        if total_rates:
+            info_systeme['network_rates'] = network_rates(total_rates)
+        interfaces: List[NetworkInterfaceRates] = list()
+        for name, rates in sorted(net_rates.items()):
+            if name == 'lo' or any(prefix in name for prefix in VIRTUAL_INTERFACE_PREFIXES):
+                continue
+            interfaces.append({'name': name, **network_rates(rates)})
+        info_systeme['network_interfaces'] = interfaces
+
+        disk_rates = counter_rates(previous_disk, disk_per_device, elapsed)
+        total_rates = disk_rates.pop('', None)
+        if total_rates:
+            info_systeme['disk_io_rates'] = disk_io_rates(total_rates)
+        devices: List[DiskDeviceRates] = list()
+        for name, rates in sorted(disk_rates.items()):
+            if self.__is_block_device(name):
+                devices.append({'name': name, **disk_io_rates(rates)})
+        info_systeme['disk_devices'] = devices
+
+    def __is_block_device(self, name: str) -> bool:
+        """ Whole disks only, partitions, loop and ram devices are excluded. """
         try:
-            resultat = await asyncio.to_thread(apc.get, timeout=10)
-            parsed = apc.parse(resultat, strip_units=True)
-            self.__apc_info = parsed
-        except Exception as e:
-            self.__logger.warning("UPS de type APC non accessible, desactiver (erreur %s)" % e)
-            self.__apc_info = False
-
-            return True  # Make the thread stop
+            return self.__block_devices[name]
+        except KeyError:
+            pass
+        if name.startswith('loop') or name.startswith('ram'):
+            value = False
+        else:
+            value = os.access(f"/sys/block/{name.replace('/', '!')}", os.F_OK)
+        self.__block_devices[name] = value
+        return value
 
-        return False  # Keep going
+    @property
+    def apc_client(self) -> ApcUpsClient:
+        return self.__apc_client
 
     def partition_usage(self) -> List[PartitionUsageItem]:
-        partitions = psutil.disk_partitions()
+        partitions = self.__partition_prober.partitions()
+        mountpoints = [p.mountpoint for p in partitions if 'rw' in p.opts and '/boot' not in p.mountpoint]
         reponse: List[PartitionUsageItem] = list()
-        for p in partitions:
-            if 'rw' in p.opts and '/boot' not in p.mountpoint:
-                usage = psutil.disk_usage(p.mountpoint)
-                reponse.append(
-                    {'mountpoint': p.mountpoint, 'free': usage.free, 'used': usage.used, 'total': usage.total})
+        for mountpoint, usage, stale in self.__partition_prober.probe(mountpoints):
+            if usage is not None:
+                item: PartitionUsageItem = {'mountpoint': mountpoint, 'free': usage.free, 'used': usage.used, 'total': usage.total}
+            else:
+                item: PartitionUsageItem = {'mountpoint': mountpoint, 'free': 0, 'used': 0, 'total': 0}
+            if stale:
+                item['stale'] = True
+            reponse.append(item)
         return reponse
 
 class SystemStatusManager:
@@ -311,7 +499,7 @@ class SystemStatusManager:
 
         self.__initial_refresh_done = asyncio.Event()
 
-        self.__handler = SystemStatus(context.configuration)
+        self.__handler = SystemStatus(context.configuration, context.host_identity)
 
         # Downgrade securite level 4.secure to 3.protege
         self.__securite: Optional[str] = None
@@ -320,6 +508,12 @@ class SystemStatusManager:
         self.__certissuer_not_before: Optional[datetime.datetime] = None
         self.__certissuer_not_after: Optional[datetime.datetime] = None
 
+        # Set when the delta mode is enabled in config.env
+        self.__delta_encoder: Optional[SystemStatusDeltaEncoder] = None
+
+        self.__history = SystemHistory(ConstantesInstance.SYSTEM_HISTORY_TIERS, ConstantesInstance.SYSTEM_HISTORY_MAX_POINTS)
+        self.__history_file: Optional[SystemHistoryFile] = None
+
     async def wait_initial_refresh_done(self):
         await self.__initial_refresh_done.wait()
 
@@ -330,40 +524,56 @@ class SystemStatusManager:
     async def setup(self):
         self.__securite = self.__context.securite if self.__context.securite != MilleGrillesConstantes.SECURITE_SECURE else MilleGrillesConstantes.SECURITE_PROTEGE
 
+        configuration = self.__context.configuration
+        if configuration.status_delta_enabled:
+            self.__logger.info("System status delta mode enabled (keyframe every %d seconds)" % configuration.status_keyframe_interval)
+            self.__delta_encoder = SystemStatusDeltaEncoder(
+                configuration.status_keyframe_interval, configuration.status_delta_thresholds)
+
+        history_path = configuration.path_millegrilles / 'var' / ConstantesInstance.FICHIER_SYSTEM_HISTORY
+        history_file = SystemHistoryFile(history_path, ConstantesInstance.SYSTEM_HISTORY_FILE_RECORDS)
+        try:
+            count = await asyncio.to_thread(self.__load_history, history_file)
+            self.__history_file = history_file
+            self.__logger.info("Loaded %d system history samples from %s" % (count, history_path))
+        except OSError as e:
+            self.__logger.warning("System history file %s not available, history kept in memory only: %s" % (history_path, e))
+
+        # Runs without producer to keep the history samples
+        self.__context.scheduler.add_job('system_status', 10, self.__emit_status, initial_delay=4,
+                                         requires_producer=False)
+
+    def __load_history(self, history_file: SystemHistoryFile) -> int:
+        history_file.open()
+        return history_file.replay(self.__history)
+
     async def run(self):
         self.__logger.debug("SystemStatusManager thread started")
         try:
             async with TaskGroup() as group:
                 group.create_task(self.__stop_thread())
-                group.create_task(self.__emit_status_thread())
+                group.create_task(self.__handler.apc_client.run(self.__stopping))
         except *Exception as e:  # Fail on first exception
             raise e
+        finally:
+            # The status job runs in the context scheduler, stop it and detach the file before closing it
+            self.__context.scheduler.remove_job('system_status')
+            history_file, self.__history_file = self.__history_file, None
+            if history_file is not None:
+                history_file.close()
         self.__logger.debug("SystemStatusManager thread done")
 
-    async def __emit_status_thread(self):
-        """
-        Thread that manages certificates that are about to expire. Refreshes the certificates and reloads the
-        docker compose services.
-        """
-        await self.__context.wait(4)
-        self.__logger.info("Starting emit status thread")
-        while self.__context.stopping is False:
-            try:
-                await self.__emit_status()
-            except Exception:
-                self.__logger.exception("Error renewing certificates in manager")
-            await self.__context.wait(10)
-        self.__logger.info("Stopping emit status thread")
+    async def __emit_status(self, producer: Optional[MilleGrillesPikaMessageProducer]):
+        system_state = await asyncio.to_thread(self.__handler.read_system_status)
+        now = time.time()
+        self.__history.add(now, system_state)
+        if self.__history_file is not None:
+            self.__history_file.append(now, system_state)
 
-    async def __emit_status(self):
-        try:
-            producer = await asyncio.wait_for(self.__context.get_producer(), 1)
-        except asyncio.TimeoutError:
+        if producer is None:
             self.__logger.warning("Timeout waiting for producer to emit instance status")
             return
 
-        system_state = await asyncio.to_thread(self.__handler.read_system_status)
-
         securite = MilleGrillesConstantes.SECURITE_SECURE if self.__context.configuration.is_secure_manager else self.__securite
 
         await self.get_certissuer_status()
@@ -382,13 +592,61 @@ class SystemStatusManager:
             'certissuer': certissuer,
         }
 
-        await producer.event(
-            event_message,
-            'instance',
-            'presenceInstanceV2',
-            partition=self.__context.instance_id,
-            exchange=self.__securite,
-        )
+        action = ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_V2
+        if self.__delta_encoder is not None:
+            frame = self.__delta_encoder.encode(event_message)
+            if frame is None:
+                return  # Nothing changed beyond the thresholds
+            elif 'state' in frame:
+                # Keyframe, same content as the full event with the sequence added
+                event_message = {'session': frame['session'], 'seq': frame['seq'], **frame['state']}
+            else:
+                event_message = frame
+                action = ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_DELTA
+
+        try:
+            await producer.event(
+                event_message,
+                'instance',
+                action,
+                partition=self.__context.instance_id,
+                exchange=self.__securite,
+            )
+        except Exception as e:
+            if self.__delta_encoder is not None:
+                # Receivers missed this frame, resync them with a keyframe
+                self.__delta_encoder.request_keyframe()
+            raise e
+
+    async def get_history(self, message: MessageWrapper) -> dict:
+        """
+        Request content: {"start": epoch, "end": epoch, "resolution": seconds, "metrics": [names]}, all optional.
+        Defaults to the last 3 hours at the finest resolution. The response includes the latency statistics of the
+        periodic jobs under "jobs".
+        """
+        request = message.parsed
+        now = time.time()
+        try:
+            end = float(request.get('end') or now)
+            start = float(request.get('start') or end - 3 * 3600)
+            resolution = int(request.get('resolution') or 0)
+            response = self.__history.query(start, end, resolution, request.get('metrics'))
+        except (TypeError, ValueError) as e:
+            return {'ok': False, 'err': str(e)}
+        response['jobs'] = self.__context.scheduler.stats()
+        return response
+
+    async def get_keyframe(self) -> dict:
+        """
+        :return: Status event content receivers should hold at the current sequence. Used by receivers that detected
+                 a gap in the delta sequence.
+        """
+        if self.__delta_encoder is None:
+            return {'ok': False, 'err': 'System status delta mode is not enabled'}
+        keyframe = self.__delta_encoder.keyframe()
+        if keyframe is None:
+            return {'ok': False, 'err': 'System status not available yet'}
+        return {'ok': True, 'session': keyframe['session'], 'seq': keyframe['seq'], **keyframe['state']}
 
     async def get_certissuer_status(self):
         certissuer_url = self.__context.configuration.certissuer_url
@@ -0,0 +1,249 @@
+import time
+import uuid
+
+from typing import Any, Optional, TypedDict, Union
+
+# Minimum change of a numeric field before it is sent in a delta, keyed by the dotted path in the status event.
+# A threshold applies to the field and to everything below it, list elements share the path of their list
+# (e.g. system_state.disk.free). Fields without a threshold are sent on any change.
+DEFAULT_DELTA_THRESHOLDS: dict[str, float] = {
+    'system_state.cpu_usage_percent': 2.0,
+    'system_state.load_average': 0.05,
+    'system_state.uptime_seconds': 3600,  # Receivers extrapolate from the keyframe
+    'system_state.memory.percent': 1.0,
+    'system_state.memory.available': 16 * 1024 * 1024,
+    'system_state.memory.used': 16 * 1024 * 1024,
+    'system_state.memory.free': 16 * 1024 * 1024,
+    'system_state.swap.percent': 1.0,
+    'system_state.swap.used': 16 * 1024 * 1024,
+    'system_state.swap.free': 16 * 1024 * 1024,
+    'system_state.disk.free': 64 * 1024 * 1024,
+    'system_state.disk.used': 64 * 1024 * 1024,
+    'system_state.network.bytes_sent': 1024 * 1024,
+    'system_state.network.bytes_recv': 1024 * 1024,
+    'system_state.network.packets_sent': 1000,
+    'system_state.network.packets_recv': 1000,
+    'system_state.disk_io.read_bytes': 1024 * 1024,
+    'system_state.disk_io.write_bytes': 1024 * 1024,
+    'system_state.disk_io.read_count': 100,
+    'system_state.disk_io.write_count': 100,
+    'system_state.disk_io.read_time': 1000,
+    'system_state.disk_io.write_time': 1000,
+    'system_state.system_temperature': 1.0,
+    'system_state.system_fans': 50,
+}
+
+# Rates, for the totals and for each element of the per device lists
+DEFAULT_DELTA_THRESHOLDS.update({
+    f'{prefix}.{field}': threshold
+    for prefix in ('system_state.network_rates', 'system_state.network_interfaces')
+    for field, threshold in (('bytes_sent_per_sec', 64 * 1024), ('bytes_recv_per_sec', 64 * 1024),
+                             ('packets_sent_per_sec', 100), ('packets_recv_per_sec', 100))
+})
+DEFAULT_DELTA_THRESHOLDS.update({
+    f'{prefix}.{field}': threshold
+    for prefix in ('system_state.disk_io_rates', 'system_state.disk_devices')
+    for field, threshold in (('read_bytes_per_sec', 256 * 1024), ('write_bytes_per_sec', 256 * 1024),
+                             ('read_iops', 20), ('write_iops', 20),
+                             ('read_latency_ms', 2.0), ('write_latency_ms', 2.0))
+})
+DEFAULT_DELTA_THRESHOLDS.update({
+    'system_state.containers.cpu_percent': 2.0,
+    'system_state.containers.memory_bytes': 16 * 1024 * 1024,
+    'system_state.containers.read_bytes_per_sec': 256 * 1024,
+    'system_state.containers.write_bytes_per_sec': 256 * 1024,
+    'system_state.containers.read_iops': 20,
+    'system_state.containers.write_iops': 20,
+    'system_state.top_processes.cpu_percent': 5.0,
+    'system_state.top_processes.rss_bytes': 16 * 1024 * 1024,
+})
+
+
+# Rust mapping:
+# struct SystemStatusKeyframe {
+#     session: String,
+#     seq: u64,
+#     state: serde_json::Value,
+# }
+class SystemStatusKeyframe(TypedDict):
+    session: str  # Changes when the manager restarts
+    seq: int
+    state: dict[str, Any]
+
+
+# Rust mapping:
+# struct SystemStatusDelta {
+#     session: String,
+#     seq: u64,
+#     keyframe_seq: u64,
+#     changes: serde_json::Value,
+#     removed: Vec<Vec<String>>,
+# }
+class SystemStatusDelta(TypedDict):
+    session: str
+    seq: int  # Previous event is seq - 1, a receiver that missed it needs a keyframe
+    keyframe_seq: int
+    changes: dict[str, Any]  # Merged recursively into dicts, other values are replaced
+    removed: list[list[str]]  # Key paths removed from the state
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _threshold(thresholds: dict[str, float], path: str) -> Optional[float]:
+    while path:
+        try:
+            return thresholds[path]
+        except KeyError:
+            path = path.rpartition('.')[0]
+    return None
+
+
+def _changed(previous, current, thresholds: dict[str, float], path: str) -> bool:
+    if _is_number(previous) and _is_number(current):
+        threshold = _threshold(thresholds, path)
+        if threshold is None:
+            return previous != current
+        return abs(current - previous) >= threshold
+
+    if isinstance(previous, dict) and isinstance(current, dict):
+        if previous.keys() != current.keys():
+            return True
+        return any(_changed(previous[k], current[k], thresholds, f'{path}.{k}') for k in current.keys())
+
+    if isinstance(previous, (list, tuple)) and isinstance(current, (list, tuple)):
+        if len(previous) != len(current):
+            return True
+        # Elements share the threshold of the list
+        return any(_changed(p, c, thresholds, path) for p, c in zip(previous, current))
+
+    return previous != current
+
+
+def diff_state(previous: dict, current: dict, thresholds: dict[str, float],
+               path: Optional[str] = None) -> tuple[dict, list[list[str]]]:
+    """
+    Compares two states.
+    :return: Changes to merge into previous and key paths to remove from it to get current (within thresholds).
+    """
+    changes: dict[str, Any] = dict()
+    removed: list[list[str]] = list()
+
+    for key, value in current.items():
+        key_path = f'{path}.{key}' if path else key
+        try:
+            previous_value = previous[key]
+        except KeyError:
+            changes[key] = value
+            continue
+
+        if isinstance(value, dict) and isinstance(previous_value, dict):
+            sub_changes, sub_removed = diff_state(previous_value, value, thresholds, key_path)
+            if len(sub_changes) > 0:
+                changes[key] = sub_changes
+            removed.extend([[key] + r for r in sub_removed])
+        elif _changed(previous_value, value, thresholds, key_path):
+            changes[key] = value
+
+    for key in previous.keys():
+        if key not in current:
+            removed.append([key])
+
+    return changes, removed
+
+
+def apply_delta(state: dict, changes: dict, removed: list[list[str]]) -> dict:
+    """
+    Applies a delta to a state. The state is not modified, unchanged branches are shared with the result.
+    """
+    result = dict(state)
+    for key, value in changes.items():
+        previous_value = result.get(key)
+        if isinstance(value, dict) and isinstance(previous_value, dict):
+            result[key] = apply_delta(previous_value, value, list())
+        else:
+            result[key] = value
+
+    for key_path in removed:
+        result = _without(result, key_path)
+
+    return result
+
+
+def _without(state: dict, key_path: list[str]) -> dict:
+    key = key_path[0]
+    if key not in state:
+        return state
+    result = dict(state)
+    if len(key_path) == 1:
+        del result[key]
+    elif isinstance(result[key], dict):
+        result[key] = _without(result[key], key_path[1:])
+    return result
+
+
+class SystemStatusDeltaEncoder:
+    """
+    Encodes successive status events as a periodic keyframe followed by deltas.
+
+    Changes are measured against the state receivers hold (last keyframe with all deltas applied), not against the
+    previous sample: a value drifting slowly below its threshold is still sent once the accumulated change crosses it.
+    """
+
+    def __init__(self, keyframe_interval: float, thresholds: Optional[dict[str, float]] = None):
+        self.__keyframe_interval = keyframe_interval
+        self.__thresholds = DEFAULT_DELTA_THRESHOLDS.copy()
+        if thresholds:
+            self.__thresholds.update(thresholds)
+
+        self.__session = uuid.uuid4().hex
+        self.__seq = 0
+        self.__keyframe_seq = 0
+        self.__keyframe_time: Optional[float] = None
+        self.__reference: Optional[dict] = None  # State as reconstructed by receivers at self.__seq
+        self.__keyframe_requested = False
+
+    @property
+    def seq(self) -> int:
+        return self.__seq
+
+    def request_keyframe(self):
+        """ The next call to encode() produces a keyframe. """
+        self.__keyframe_requested = True
+
+    def keyframe(self) -> Optional[SystemStatusKeyframe]:
+        """
+        :return: State receivers hold at the current seq, None before the first event. Used to answer keyframe requests.
+        """
+        if self.__reference is None:
+            return None
+        return {'session': self.__session, 'seq': self.__seq, 'state': self.__reference}
+
+    def encode(self, state: dict) -> Union[SystemStatusKeyframe, SystemStatusDelta, None]:
+        """
+        :return: A keyframe, a delta or None when nothing changed beyond the thresholds.
+        """
+        now = time.monotonic()
+        if self.__reference is None or self.__keyframe_requested or \
+                now - self.__keyframe_time >= self.__keyframe_interval:
+            self.__seq += 1
+            self.__keyframe_seq = self.__seq
+            self.__keyframe_time = now
+            self.__keyframe_requested = False
+            self.__reference = state
+            return self.keyframe()
+
+        changes, removed = diff_state(self.__reference, state, self.__thresholds)
+        if len(changes) == 0 and len(removed) == 0:
+            return None
+
+        self.__seq += 1
+        self.__reference = apply_delta(self.__reference, changes, removed)
+        return {
+            'session': self.__session,
+            'seq': self.__seq,
+            'keyframe_seq': self.__keyframe_seq,
+            'changes': changes,
+            'removed': removed,
+        }
@@ -1,45 +1,131 @@
-import subprocess
-import sys
+import asyncio
+import collections
 import logging
+import time
 
-LOGGER = logging.getLogger(__name__)
-
-def reload_nginx(instance_name: str):
-    LOGGER.info(f"Reloading {instance_name}-nginx...")
-    run_command(f"systemctl --user reload {instance_name}-nginx")
-
-def restart_nginx(instance_name: str):
-    LOGGER.info(f"Restarting {instance_name}-nginx...")
-    run_command(f"systemctl --user restart {instance_name}-nginx")
-
-def reload_middleware(instance_name: str):
-    LOGGER.info(f"Reloading {instance_name}-middleware...")
-    run_command(f"systemctl --user reload {instance_name}-middleware")
-
-def restart_middleware(instance_name: str):
-    LOGGER.info(f"Restarting {instance_name}-middleware...")
-    run_command(f"systemctl --user restart {instance_name}-middleware")
-
-def reload_compose_applications(instance_name: str, update_certs=True):
-    # Need to generate certificates first to avoid reload issue with applications service
-    if update_certs:
-        LOGGER.info(f"Generating certificates using {instance_name}-certs_updater...")
-        run_command(f"systemctl --user start {instance_name}-certs_updater")
-    LOGGER.info(f"Reloading {instance_name}-applications...")
-    run_command(f"systemctl --user reload {instance_name}-applications")
-
-def restart_compose_applications(instance_name: str):
-    # Need to generate certificates first to avoid reload issue with applications service
-    LOGGER.info(f"Restarting {instance_name}-applications...")
-    run_command(f"systemctl --user restart {instance_name}-applications")
-
-def run_command(command, env=None):
-    try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True, env=env)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        LOGGER.error(f"Error executing command: {e}")
-        LOGGER.info(f"Command: {e.cmd}")
-        LOGGER.info(f"Stdout: {e.stdout}")
-        LOGGER.info(f"Stderr: {e.stderr}")
-        raise e
+from subprocess import CalledProcessError
+from typing import Optional
+
+
+class SystemdJob:
+    """
+    One systemctl action on a unit, tracked until systemd reports the job done.
+    """
+
+    def __init__(self, action: str, unit: str):
+        self.action = action
+        self.unit = unit
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.returncode: Optional[int] = None
+        self.stdout = ''
+        self.stderr = ''
+
+    @property
+    def done(self) -> bool:
+        return self.returncode is not None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def __repr__(self):
+        return f'SystemdJob({self.action} {self.unit}, returncode={self.returncode})'
+
+
+class SystemdController:
+    """
+    Controls the units of the systemd user manager with systemctl, without a shell and without blocking the event loop.
+
+    systemctl waits for the systemd job to complete (no --no-block) so a job is done when the process exits. Jobs on
+    the same unit run one after the other, jobs on different units can run in parallel.
+    """
+
+    def __init__(self, systemctl: str = 'systemctl', user: bool = True, timeout: float = 300.0):
+        """
+        :param systemctl: systemctl executable, replaced by a stand-in for tests
+        :param timeout: Seconds before a job is considered failed
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__systemctl = systemctl
+        self.__user = user
+        self.__timeout = timeout
+        self.__unit_locks: dict[str, asyncio.Lock] = dict()
+        self.__running: dict[str, SystemdJob] = dict()
+        self.__history: collections.deque[SystemdJob] = collections.deque(maxlen=50)
+
+    @property
+    def running(self) -> list[SystemdJob]:
+        return list(self.__running.values())
+
+    @property
+    def history(self) -> list[SystemdJob]:
+        """ Most recent jobs done, oldest first """
+        return list(self.__history)
+
+    async def run_job(self, action: str, unit: str) -> SystemdJob:
+        """
+        :raises CalledProcessError: When systemctl fails or times out
+        """
+        lock = self.__unit_locks.get(unit)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.__unit_locks[unit] = lock
+
+        async with lock:
+            job = SystemdJob(action, unit)
+            command = [self.__systemctl]
+            if self.__user:
+                command.append('--user')
+            command.extend([action, unit])
+
+            self.__running[unit] = job
+            job.started = time.monotonic()
+            try:
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+                except OSError as e:
+                    job.returncode = 127  # Same as the shell when the command is not found
+                    job.stderr = str(e)
+                else:
+                    try:
+                        stdout, stderr = await asyncio.wait_for(process.communicate(), self.__timeout)
+                    except asyncio.TimeoutError:
+                        process.kill()
+                        stdout, stderr = await process.communicate()
+                        stderr += f'\nTimeout after {self.__timeout} seconds'.encode('utf-8')
+                    job.returncode = process.returncode if process.returncode is not None else -1
+                    job.stdout = stdout.decode('utf-8', errors='replace').strip()
+                    job.stderr = stderr.decode('utf-8', errors='replace').strip()
+            finally:
+                job.finished = time.monotonic()
+                if job.returncode is None:
+                    job.returncode = -1  # Cancelled
+                del self.__running[unit]
+                self.__history.append(job)
+
+        if job.returncode != 0:
+            self.__logger.error("Error on %s %s (code %d): %s" % (action, unit, job.returncode, job.stderr))
+            raise CalledProcessError(job.returncode, command, job.stdout, job.stderr)
+
+        self.__logger.debug("%s %s done in %.2f seconds" % (action, unit, job.duration))
+        return job
+
+    async def reload(self, unit: str) -> SystemdJob:
+        return await self.run_job('reload', unit)
+
+    async def restart(self, unit: str) -> SystemdJob:
+        return await self.run_job('restart', unit)
+
+    async def start(self, unit: str) -> SystemdJob:
+        return await self.run_job('start', unit)
+
+    async def run_parallel(self, jobs: list[tuple[str, str]]) -> list:
+        """
+        Runs independent (action, unit) jobs in parallel.
+        :return: SystemdJob or the exception raised, in the same order
+        """
+        return await asyncio.gather(*[self.run_job(action, unit) for action, unit in jobs], return_exceptions=True)
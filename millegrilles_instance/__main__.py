@@ -4,29 +4,28 @@ import sys
 
 from asyncio import TaskGroup
 from concurrent.futures.thread import ThreadPoolExecutor
-from typing import Awaitable
-
-from millegrilles_instance.ManagerSetup import setup_manager
-from millegrilles_instance.SystemStatus import SystemStatus, SystemStatusManager
-from millegrilles_instance.apps.AppManager import AppManager
-from millegrilles_instance.apps.CertificatesManager import CertificatesManager
-from millegrilles_messages.bus.BusContext import ForceTerminateExecution, StopListener
-from millegrilles_messages.bus.BusExceptions import ConfigurationFileError
-from millegrilles_messages.bus.PikaConnector import MilleGrillesPikaConnector
-from millegrilles_instance.Configuration import ConfigurationInstance
-from millegrilles_instance.Context import InstanceContext
-from millegrilles_instance.Manager import InstanceManager
-from millegrilles_instance.MgbusHandler import MgbusHandler
+from typing import Awaitable, TYPE_CHECKING
+
+from millegrilles_instance.StartupProfile import StartupProfiler
+
+# Subsystems are imported when wiring() needs them, see --profile-startup for the breakdown
+if TYPE_CHECKING:
+    from millegrilles_instance.Context import InstanceContext
 
 LOGGER = logging.getLogger(__name__)
 
+PROFILER = StartupProfiler()
+
 
 async def force_terminate_task_group():
     """Used to force termination of a task group."""
+    from millegrilles_messages.bus.BusContext import ForceTerminateExecution
     raise ForceTerminateExecution()
 
 
-async def run_manager(context: InstanceContext) -> None:
+async def run_manager(context: 'InstanceContext') -> None:
+    from millegrilles_messages.bus.BusContext import ForceTerminateExecution, StopListener
+
     LOGGER.setLevel(logging.INFO)
     LOGGER.info("Starting")
 
@@ -37,6 +36,10 @@ async def run_manager(context: InstanceContext) -> None:
         LOGGER.error("Permission denied on loading configuration and preparing folders : %s" % str(e))
         sys.exit(2)  # Quit
 
+    profile_path = context.configuration.profile_startup
+    if profile_path:
+        PROFILER.write(profile_path)
+
     try:
         # Use taskgroup to run all threads
         async with TaskGroup() as group:
@@ -59,30 +62,61 @@ async def run_manager(context: InstanceContext) -> None:
     sys.exit(3)
 
 
-async def wiring(context: InstanceContext) -> list[Awaitable]:
+async def wiring(context: 'InstanceContext') -> list[Awaitable]:
     # Some executor threads get used to handle threading.Event triggers for the duration of the execution.
     # Ensure there are enough.
     loop = asyncio.get_event_loop()
     loop.set_default_executor(ThreadPoolExecutor(max_workers=15))
 
     # Handlers (services)
-    bus_connector = MilleGrillesPikaConnector(context)
-    context.bus_connector = bus_connector
-    app_manager = AppManager(context)
-    certificate_manager = CertificatesManager(context)
-    system_status_manager = SystemStatusManager(context)
+    with PROFILER.measure('bus_connector', 'import'):
+        from millegrilles_messages.bus.PikaConnector import MilleGrillesPikaConnector
+    with PROFILER.measure('bus_connector', 'wiring'):
+        bus_connector = MilleGrillesPikaConnector(context)
+        context.bus_connector = bus_connector
+
+    with PROFILER.measure('app_manager', 'import'):
+        from millegrilles_instance.apps.AppManager import AppManager
+    with PROFILER.measure('app_manager', 'wiring'):
+        app_manager = AppManager(context)
+
+    with PROFILER.measure('certificate_manager', 'import'):
+        from millegrilles_instance.apps.CertificatesManager import CertificatesManager
+    with PROFILER.measure('certificate_manager', 'wiring'):
+        certificate_manager = CertificatesManager(context)
+
+    with PROFILER.measure('csr_pool', 'import'):
+        from millegrilles_instance.apps.CsrPool import CsrPool
+        from millegrilles_instance.apps.Certificates import count_managed_certificates
+    with PROFILER.measure('csr_pool', 'wiring'):
+        csr_pool = CsrPool(context, get_size=lambda: count_managed_certificates(context))
+        context.csr_pool = csr_pool
+
+    with PROFILER.measure('system_status_manager', 'import'):
+        from millegrilles_instance.SystemStatus import SystemStatusManager
+    with PROFILER.measure('system_status_manager', 'wiring'):
+        system_status_manager = SystemStatusManager(context)
 
     # Facade
-    manager = InstanceManager(context, app_manager)
-    context.add_reload_listener(manager.callback_changement_configuration)
+    with PROFILER.measure('manager', 'import'):
+        from millegrilles_instance.Manager import InstanceManager
+    with PROFILER.measure('manager', 'wiring'):
+        manager = InstanceManager(context, app_manager)
+        context.add_reload_listener(manager.callback_changement_configuration)
 
     # Access modules
-    bus_handler = MgbusHandler(manager)
+    with PROFILER.measure('bus_handler', 'import'):
+        from millegrilles_instance.MgbusHandler import MgbusHandler
+    with PROFILER.measure('bus_handler', 'wiring'):
+        bus_handler = MgbusHandler(manager, system_status_manager)
 
     # Setup / injecting dependencies
-    await manager.setup(bus_handler)
-    await system_status_manager.setup()
-    await app_manager.setup()
+    with PROFILER.measure('manager', 'setup'):
+        await manager.setup(bus_handler)
+    with PROFILER.measure('system_status_manager', 'setup'):
+        await system_status_manager.setup()
+    with PROFILER.measure('app_manager', 'setup'):
+        await app_manager.setup()
 
     # Create tasks
     coros = [
@@ -91,6 +125,7 @@ async def wiring(context: InstanceContext) -> list[Awaitable]:
         manager.run(),
         bus_handler.run(),
         certificate_manager.run(),
+        csr_pool.run(),
         system_status_manager.run(),
     ]
 
@@ -98,26 +133,38 @@ async def wiring(context: InstanceContext) -> list[Awaitable]:
 
 
 async def main():
-    config = ConfigurationInstance.load()
+    with PROFILER.measure('configuration', 'import'):
+        from millegrilles_instance.Configuration import ConfigurationInstance
+    with PROFILER.measure('configuration', 'setup'):
+        config = ConfigurationInstance.load()
     if config.verbose:
         LOGGER.setLevel(logging.DEBUG)
     else:
         LOGGER.setLevel(logging.INFO)
 
+    with PROFILER.measure('context', 'import'):
+        from millegrilles_messages.bus.BusExceptions import ConfigurationFileError
+        from millegrilles_instance.Context import InstanceContext
     try:
-        context = InstanceContext(config)
+        with PROFILER.measure('context', 'wiring'):
+            context = InstanceContext(config)
     except ConfigurationFileError as e:
         LOGGER.error("Error loading configuration files %s, quitting" % str(e))
         sys.exit(1)  # Quit
 
     if config.init_only:
         LOGGER.info("Starting maintenance of the environment")
+        with PROFILER.measure('setup_manager', 'import'):
+            from millegrilles_instance.ManagerSetup import setup_manager
         try:
-            await setup_manager(context)
+            with PROFILER.measure('setup_manager', 'setup'):
+                await setup_manager(context)
         except Exception as e:
             LOGGER.exception("Error initializing manager")
             sys.exit(2)
         LOGGER.info("Manager initialization completed")
+        if config.profile_startup:
+            PROFILER.write(config.profile_startup)
     else:
         await run_manager(context)
 
@@ -1,14 +1,32 @@
 import asyncio
+import hashlib
 import json
 import logging
+import os
+import pathlib
 
 from asyncio import TaskGroup
 from typing import Optional
 
+from millegrilles_instance import Constantes as ConstantesInstance
 from millegrilles_instance.Context import InstanceContext
+from millegrilles_instance.apps.Certificates import get_compose_file_paths
+from millegrilles_instance.apps.ComposeCache import COMPOSE_FILE_CACHE
+from millegrilles_instance.apps.ImagePrefetch import ImagePrefetch, ImagePrefetchProgress, ImagePrefetchResult, \
+    compose_images, compose_pull_always
+from millegrilles_messages.bus.PikaMessageProducer import MilleGrillesPikaMessageProducer
 from millegrilles_messages.messages import Constantes as MilleGrillesConstantes
 
 
+def read_installed_applications(path: pathlib.Path) -> tuple[str, dict]:
+    """
+    :return: (sha256 hex digest of the file, parsed content)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    return hashlib.sha256(data).hexdigest(), json.loads(data)
+
+
 class AppManager:
 
     def __init__(self, context: InstanceContext):
@@ -22,66 +40,173 @@ class AppManager:
 
         self.__securite: Optional[str] = None
 
+        self.__applications_path: Optional[pathlib.Path] = None
+        self.__applications: Optional[dict] = None
+        self.__applications_hash: Optional[str] = None
+        self.__published_hash: Optional[str] = None  # Hash of the last full list sent
+
     async def wait_initial_refresh_done(self):
         await self.__initial_refresh_done.wait()
 
     async def __stop_thread(self):
         await self.__context.wait()
         self.__stopping.set()
+        self.__applications_changed.set()
 
     async def setup(self):
         self.__securite = self.__context.securite if self.__context.securite != MilleGrillesConstantes.SECURITE_SECURE else MilleGrillesConstantes.SECURITE_PROTEGE
 
+        self.__applications_path = self.__context.configuration.path_millegrilles / "etc" / "installed_applications.json"
+        self.__context.file_watcher.watch([self.__applications_path], lambda _: self.__applications_changed.set())
+        self.__applications_changed.set()  # Initial load
+
+        # Heartbeat with the hash of the list, the full list is only sent when it changes
+        self.__context.scheduler.add_job('application_list', 30, self.__emit_application_heartbeat, initial_delay=4)
+
     async def run(self):
         self.__logger.debug("SystemStatus thread started")
         try:
             async with TaskGroup() as group:
                 group.create_task(self.__stop_thread())
-                group.create_task(self.__emit_application_list_thread())
+                group.create_task(self.__application_changes_thread())
         except *Exception as e:  # Fail on first exception
             raise e
         self.__logger.debug("SystemStatus thread done")
 
-    async def __emit_application_list_thread(self):
+    async def get_installed_applications(self) -> dict:
+        """
+        Full list, requested by CoreTopologie when the hash of the heartbeat differs from its copy.
+        """
+        if self.__applications is None:
+            return {'ok': False, 'err': 'No installed applications file found'}
+        return {'ok': True, 'hash': self.__applications_hash, 'applications': self.__applications}
+
+    async def prefetch_images(self) -> ImagePrefetchResult:
+        """
+        Pulls the missing docker images of the middleware and applications before the services are reloaded.
+        Progress is sent on the bus while the images are pulled.
+        """
+        configuration = self.__context.configuration
+        env = dict(os.environ)
+        env.update(configuration.config_env)
+
+        images: list[str] = list()
+        always: set[str] = set()
+        for compose_file in get_compose_file_paths(self.__context.securite, configuration):
+            if compose_file.exists():
+                content = await asyncio.to_thread(COMPOSE_FILE_CACHE.load, compose_file)
+                images.extend(compose_images(content, env).keys())
+                always.update(compose_pull_always(content, env))
+
+        progress_queue: asyncio.Queue[ImagePrefetchProgress] = asyncio.Queue()
+        prefetch = ImagePrefetch(docker=configuration.docker, concurrency=ConstantesInstance.IMAGE_PREFETCH_CONCURRENCY,
+                                 progress=progress_queue.put_nowait,
+                                 progress_interval=ConstantesInstance.IMAGE_PREFETCH_PROGRESS_INTERVAL, env=env)
+
+        async def emit_progress():
+            while True:
+                progress = await progress_queue.get()
+                try:
+                    await self.__emit_prefetch_progress(progress)
+                except Exception as e:
+                    self.__logger.info("Image prefetch progress not sent: %s" % e)
+                if progress['done']:
+                    return
+
+        async with TaskGroup() as group:
+            group.create_task(emit_progress())
+            result = await prefetch.prefetch(images, always)
+
+        if result['failed']:
+            self.__logger.warning("Images not pulled: %s" % ', '.join(result['failed'].keys()))
+        self.__logger.info("Image prefetch done: %d pulled, %d already present" % (len(result['pulled']), len(result['skipped'])))
+        return result
+
+    async def __emit_prefetch_progress(self, progress: ImagePrefetchProgress):
+        producer = await asyncio.wait_for(self.__context.get_producer(), 1)
+        await producer.event(
+            progress,
+            'instance',
+            ConstantesInstance.EVENEMENT_IMAGE_PREFETCH_PROGRESS,
+            partition=self.__context.instance_id,
+            exchange=self.__securite,
+        )
+
+    async def __application_changes_thread(self):
         """
-        Thread that reads the list of installed applications and sends it to CoreTopology.
+        Publishes the list of installed applications as soon as the file changes.
         """
-        await self.__context.wait(4)
-        self.__logger.info("Starting emit applications thread")
-        while self.__context.stopping is False:
+        while self.__stopping.is_set() is False:
+            await self.__applications_changed.wait()
+            self.__applications_changed.clear()
+            if self.__stopping.is_set():
+                break
             try:
-                await self.__emit_application_list()
+                if await self.__load_applications():
+                    await self.__emit_application_list()
             except Exception:
                 self.__logger.exception("Error sending installed application list")
-            await self.__context.wait(30)
-        self.__logger.info("Stopping emit applications thread")
-
-    async def __emit_application_list(self):
-        try:
-            producer = await asyncio.wait_for(self.__context.get_producer(), 1)
-        except asyncio.TimeoutError:
-            self.__logger.warning("Timeout waiting for producer to emit applications list")
-            return
 
-        installed_applications_path = self.__context.configuration.path_millegrilles / "etc" / "installed_applications.json"
+    async def __load_applications(self) -> bool:
+        """
+        :return: True when the content changed
+        """
         try:
-            with open(installed_applications_path, 'r') as f:
-                content = await asyncio.to_thread(json.load, f)
+            content_hash, content = await asyncio.to_thread(read_installed_applications, self.__applications_path)
         except FileNotFoundError:
             self.__logger.info("No installed applications file found")
-            return
+            self.__applications = self.__applications_hash = None
+            return False
+        except ValueError:
+            self.__logger.warning("Invalid installed applications file, keeping the previous list")
+            return False
+
+        if content_hash == self.__applications_hash:
+            return False
+        self.__applications_hash = content_hash
+        self.__applications = content
+        return True
+
+    async def __emit_application_heartbeat(self, producer: MilleGrillesPikaMessageProducer):
+        if self.__applications_hash is None:
+            return  # No applications file
+        if self.__published_hash != self.__applications_hash:
+            # The list was not sent yet (e.g. producer not ready on change)
+            return await self.__emit_application_list(producer)
+
+        await producer.event(
+            {'hash': self.__applications_hash},
+            'instance',
+            ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_HASH,
+            partition=self.__context.instance_id,
+            exchange=self.__securite,
+        )
+
+    async def __emit_application_list(self, producer: Optional[MilleGrillesPikaMessageProducer] = None):
+        """
+        Sends the list of installed applications to CoreTopology.
+        """
+        if producer is None:
+            try:
+                producer = await asyncio.wait_for(self.__context.get_producer(), 1)
+            except asyncio.TimeoutError:
+                self.__logger.info("Producer not ready, installed applications list sent on the next heartbeat")
+                return
 
+        applications_hash = self.__applications_hash
         event_message = {
-            'applications': content,
+            'applications': self.__applications,
+            'hash': applications_hash,
         }
 
         await producer.event(
             event_message,
             'instance',
-            'presenceInstanceApplicationsV2',
+            ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_V2,
             partition=self.__context.instance_id,
             exchange=self.__securite,
         )
+        self.__published_hash = applications_hash
 
 # from typing import Dict, List, Optional, TypedDict
 #
@@ -0,0 +1,225 @@
+import heapq
+import json
+import logging
+import os
+import pathlib
+import time
+
+from typing import Callable, Optional, TypedDict
+
+from millegrilles_instance import Constantes as ConstantesInstance
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+class CertificateIndexEntry(TypedDict):
+    mtime_ns: int
+    size: int
+    not_before: float  # Epoch seconds
+    not_after: float  # Epoch seconds
+    renew_at: float  # Epoch seconds, renewal threshold
+    failures: int  # Consecutive failed renewals of this file, delays the next attempt
+
+
+class ManagerCertificateSummary(TypedDict):
+    path: str
+    mtime_ns: int
+    size: int
+    not_after: float
+
+
+class CertificateIndexSummary(TypedDict):
+    """
+    Inputs of the last renewal pass. Lets the --init check decide that nothing is due without loading the
+    compose files or the certificates.
+    """
+    sources: dict[str, Optional[list[int]]]  # Compose file stamps (mtime_ns, inode, size), None when missing
+    certificates: list[str]  # Certificate files expected for the compose services
+    passwords: list[str]  # Password files expected for the compose services
+    manager: Optional[ManagerCertificateSummary]
+
+
+# Loads a certificate file and returns (not_before, not_after, renew_now) with dates as epoch seconds.
+CertificateLoader = Callable[[pathlib.Path], tuple[float, float, bool]]
+
+
+class CertificateExpiryIndex:
+    """
+    Persistent index of certificate expiry dates under secrets/.
+    Entries are keyed by the certificate path and validated with the file mtime and size: a PEM file is only parsed
+    again when it changes. A deadline heap gives the next time a certificate needs work.
+    """
+
+    def __init__(self, index_path: pathlib.Path):
+        self.__index_path = index_path
+        self.__entries: dict[str, CertificateIndexEntry] = dict()
+        self.__heap: list[tuple[float, str]] = list()
+        self.__summary: Optional[CertificateIndexSummary] = None
+        self.__dirty = False
+        self.__loads = 0
+
+    @staticmethod
+    def load(index_path: pathlib.Path):
+        index = CertificateExpiryIndex(index_path)
+        try:
+            with open(index_path, 'rt') as f:
+                content = json.load(f)
+            if content.get('version') == INDEX_VERSION:
+                index.__entries = content['certificates']
+                index.__summary = content.get('summary')
+        except FileNotFoundError:
+            pass  # New index
+        except (ValueError, KeyError, AttributeError) as e:
+            LOGGER.warning("Invalid certificate index %s, rebuilding (%s)" % (index_path, e))
+        index.__rebuild_heap()
+        return index
+
+    def save(self):
+        if self.__dirty is False:
+            return  # Nothing changed
+        content = {'version': INDEX_VERSION, 'certificates': self.__entries, 'summary': self.__summary}
+        self.__index_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.__index_path.with_name(self.__index_path.name + '.work')
+        with open(temp_path, 'wt') as f:
+            json.dump(content, f)
+        os.replace(temp_path, self.__index_path)
+        self.__dirty = False
+
+    @property
+    def loads(self) -> int:
+        """ Number of certificate files parsed since this index was loaded. """
+        return self.__loads
+
+    @property
+    def entries(self) -> dict[str, CertificateIndexEntry]:
+        return self.__entries
+
+    @property
+    def summary(self) -> Optional[CertificateIndexSummary]:
+        return self.__summary
+
+    @summary.setter
+    def summary(self, value: CertificateIndexSummary):
+        if value != self.__summary:
+            self.__summary = value
+            self.__dirty = True
+
+    def get(self, cert_path: pathlib.Path, loader: CertificateLoader) -> CertificateIndexEntry:
+        """
+        :return: Index entry for the certificate. The file is only parsed when it changed since the last call.
+        :raises FileNotFoundError: When the certificate file does not exist
+        """
+        key = str(cert_path)
+        try:
+            stat = os.stat(cert_path)
+        except FileNotFoundError:
+            self.remove(cert_path)
+            raise
+
+        entry = self.__entries.get(key)
+        if entry is not None and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry
+
+        return self.__load_entry(cert_path, stat, loader)
+
+    def refresh(self, cert_path: pathlib.Path, loader: CertificateLoader) -> CertificateIndexEntry:
+        """
+        Parses the certificate file again, even when unchanged. Used to confirm a renewal deadline.
+        """
+        return self.__load_entry(cert_path, os.stat(cert_path), loader)
+
+    def remove(self, cert_path: pathlib.Path):
+        try:
+            del self.__entries[str(cert_path)]
+            self.__dirty = True
+        except KeyError:
+            pass
+
+    def prune(self, cert_paths: list[pathlib.Path]):
+        """
+        Removes entries for certificates that are not managed anymore.
+        """
+        keep = set([str(p) for p in cert_paths])
+        for key in list(self.__entries.keys()):
+            if key not in keep:
+                del self.__entries[key]
+                self.__dirty = True
+
+    def renewal_failed(self, cert_path: pathlib.Path):
+        """
+        Delays the next renewal attempt of a certificate that could not be renewed: CERTIFICATE_RENEW_RETRY,
+        doubled on each consecutive failure up to CERTIFICATE_CHECK_MAX_DELAY. The count is reset when the file changes.
+        """
+        key = str(cert_path)
+        entry = self.__entries.get(key)
+        if entry is None:
+            return  # Missing certificate, no deadline to delay
+        failures = entry.get('failures', 0) + 1
+        delay = min(ConstantesInstance.CERTIFICATE_RENEW_RETRY * 2 ** (failures - 1),
+                    ConstantesInstance.CERTIFICATE_CHECK_MAX_DELAY)
+        entry['failures'] = failures
+        entry['renew_at'] = time.time() + delay
+        heapq.heappush(self.__heap, (entry['renew_at'], key))
+        self.__dirty = True
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        :return: Epoch time when the next certificate needs to be renewed, None when the index is empty.
+        """
+        while len(self.__heap) > 0:
+            renew_at, key = self.__heap[0]
+            entry = self.__entries.get(key)
+            if entry is not None and entry['renew_at'] == renew_at:
+                return renew_at
+            heapq.heappop(self.__heap)  # Stale item
+        return None
+
+    def __load_entry(self, cert_path: pathlib.Path, stat: os.stat_result, loader: CertificateLoader) -> CertificateIndexEntry:
+        not_before, not_after, renew_now = loader(cert_path)
+        self.__loads += 1
+        now = time.time()
+
+        if renew_now:
+            renew_at = now
+        else:
+            renew_at = not_before + (not_after - not_before) * ConstantesInstance.CERTIFICATE_RENEW_RATIO
+            # The certificate library has the final say on renewal, retry later if it disagrees with the ratio
+            renew_at = max(renew_at, now + ConstantesInstance.CERTIFICATE_RENEW_RETRY)
+            renew_at = min(renew_at, not_after)
+
+        key = str(cert_path)
+        previous = self.__entries.get(key)
+        if previous is not None and previous['mtime_ns'] == stat.st_mtime_ns and previous['size'] == stat.st_size:
+            failures = previous.get('failures', 0)  # Same file, not renewed yet
+        else:
+            failures = 0
+
+        entry: CertificateIndexEntry = {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'not_before': not_before,
+            'not_after': not_after,
+            'renew_at': renew_at,
+            'failures': failures,
+        }
+        self.__entries[key] = entry
+        heapq.heappush(self.__heap, (renew_at, key))
+        self.__dirty = True
+        return entry
+
+    def __rebuild_heap(self):
+        self.__heap = [(entry['renew_at'], key) for key, entry in self.__entries.items()]
+        heapq.heapify(self.__heap)
+
+
+def file_stamp(path: pathlib.Path) -> Optional[list[int]]:
+    """
+    :return: File stamp [mtime_ns, inode, size] as stored in the summary, None when the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_ino, stat.st_size]
@@ -1,21 +1,27 @@
 import asyncio
 import base64
+import datetime
 import logging
 import pathlib
 import secrets
+import time
 
 import math
-import requests
-import yaml
 
 from typing import Optional, Any, TypedDict
 
 from aiohttp import ClientError, ClientSession, TCPConnector, ClientTimeout
 
+from millegrilles_instance import Constantes as ConstantesInstance
 from millegrilles_instance.Configuration import ConfigurationInstance
 from millegrilles_instance.Context import InstanceContext
+from millegrilles_instance.apps.CertificateIndex import CertificateExpiryIndex, ManagerCertificateSummary, file_stamp
+from millegrilles_instance.apps.CertissuerClient import CertissuerClient
+from millegrilles_instance.apps.ComposeCache import COMPOSE_FILE_CACHE
+from millegrilles_instance.apps.ComposeGraph import ComposeDependencyGraph
+from millegrilles_instance.apps.ComposeServices import ComposeServiceIndex
+from millegrilles_instance.apps.CsrPool import CsrPool, build_clecsr
 from millegrilles_messages.bus.PikaMessageProducer import MilleGrillesPikaMessageProducer
-from millegrilles_messages.certificats.Generes import CleCsrGenere
 from millegrilles_messages.messages import Constantes as MillegrillesConstantes
 from millegrilles_messages.messages.CleCertificat import CleCertificat
 from millegrilles_messages.messages.EnveloppeCertificat import EnveloppeCertificat
@@ -42,36 +48,21 @@ def extract_certificate_list(configuration_file: dict):
 
 
 def load_yaml_recursive(yaml_file: pathlib.Path) -> dict:
-    with open(yaml_file) as f:
-        compose_configuration: dict = yaml.safe_load(f)
-
-    try:
-        include_files = compose_configuration['include']
-        files_dict = dict()
-        compose_configuration['x-include-content'] = files_dict
-        for include_file in include_files:
-            try:
-                include_file = include_file['path']
-            except (TypeError, KeyError):
-                pass
-            yaml_file_parent = yaml_file.parent
-            parent_join = yaml_file_parent.joinpath(include_file)
-            include_file_path = parent_join.resolve()
-            file_content = load_yaml_recursive(include_file_path)
-            files_dict[include_file_path] = file_content
-    except KeyError:
-        pass
-
-    return compose_configuration
+    """
+    Loads a compose file with its includes. Parsed files are cached and only parsed again when they change,
+    the returned content is shared and must not be modified.
+    """
+    return COMPOSE_FILE_CACHE.load(yaml_file)
 
 
-def load_compose_files(securite: str, configuration: ConfigurationInstance) -> list[dict[str, Any]]:
+def get_compose_file_paths(securite: str, configuration: ConfigurationInstance) -> list[pathlib.Path]:
     """
     :param securite: Security level of the node
     :param configuration: Instance configuration
-    :return: Path to the node type's docker-compose yml file for this instance
+    :return: Paths to the root compose files of this instance: node type, service dependencies and applications.
+             The applications file is optional and may not exist.
     """
-    composefiles: list[dict[str, Any]] = list()
+    compose_files: list[pathlib.Path] = list()
 
     if securite == MillegrillesConstantes.SECURITE_PUBLIC:
         filename = 'node-public.yml'
@@ -84,9 +75,7 @@ def load_compose_files(securite: str, configuration: ConfigurationInstance) -> l
     else:
         raise ValueError("Unsupported security type")
 
-    compose_file_nodetype = configuration.path_millegrilles / "etc/compose/middleware" / filename
-    config_nodetype = load_yaml_recursive(compose_file_nodetype)
-    composefiles.append(config_nodetype)
+    compose_files.append(configuration.path_millegrilles / "etc/compose/middleware" / filename)
 
     # Add service dependencies (certs, downloading new docker images)
     if securite == MillegrillesConstantes.SECURITE_SECURE:
@@ -101,17 +90,44 @@ def load_compose_files(securite: str, configuration: ConfigurationInstance) -> l
         certs_service_file = None
 
     if certs_service_file:
-        config_services = load_yaml_recursive(certs_service_file)
-        composefiles.append(config_services)
+        compose_files.append(certs_service_file)
+
+    compose_files.append(configuration.path_millegrilles / "etc/compose/applications.yml")
+
+    return compose_files
+
+
+def load_compose_files(securite: str, configuration: ConfigurationInstance) -> list[dict[str, Any]]:
+    """
+    :param securite: Security level of the node
+    :param configuration: Instance configuration
+    :return: Content of the node type's docker-compose yml files for this instance
+    """
+    composefiles: list[dict[str, Any]] = list()
 
     applications_file = configuration.path_millegrilles / "etc/compose/applications.yml"
-    if applications_file.exists():
-        config_applications = load_yaml_recursive(applications_file)
-        composefiles.append(config_applications)
+    for compose_file in get_compose_file_paths(securite, configuration):
+        if compose_file == applications_file and not applications_file.exists():
+            continue  # Optional
+        composefiles.append(load_yaml_recursive(compose_file))
 
     return composefiles
 
 
+def load_service_index(securite: str, configuration: ConfigurationInstance) -> ComposeServiceIndex:
+    """
+    :return: Services of the node type's docker-compose yml files with their project file
+    """
+    return ComposeServiceIndex.build(get_compose_file_paths(securite, configuration), COMPOSE_FILE_CACHE)
+
+
+def load_dependency_graph(securite: str, configuration: ConfigurationInstance) -> ComposeDependencyGraph:
+    """
+    :return: Dependencies between the services of the node type's docker-compose yml files
+    """
+    return ComposeDependencyGraph.build(get_compose_file_paths(securite, configuration), COMPOSE_FILE_CACHE)
+
+
 class CertificateConfiguration(TypedDict):
     name: str
     roles: list[str]
@@ -143,7 +159,7 @@ def extract_certificate_configuration(config_file: dict) -> list[CertificateConf
     else:
         for service_name, service_config in services.items():
             try:
-                cert_config = service_config['x-millegrilles-certificat']
+                cert_config = service_config['x-millegrilles-certificat'].copy()  # Parsed content is cached, do not modify
                 cert_config['name'] = service_name
                 certs.append(cert_config)
             except KeyError:
@@ -152,36 +168,155 @@ def extract_certificate_configuration(config_file: dict) -> list[CertificateConf
     return certs
 
 
-def check_certificates(configuration: ConfigurationInstance, certs: list[CertificateConfiguration]) -> list[CertificateConfiguration]:
+def load_certificate_configurations(securite: str, configuration: ConfigurationInstance) -> list[CertificateConfiguration]:
+    """
+    :return: Certificate and password configurations (x-millegrilles-certificat) of the compose services
+    """
+    certs = list()
+    for file_content in load_compose_files(securite, configuration):
+        certs.extend(extract_certificate_configuration(file_content))
+    return certs
+
+
+def signed_certificates(certs: list[CertificateConfiguration]) -> list[CertificateConfiguration]:
+    """
+    :return: Configurations that need a signed certificate, the others only have passwords
+    """
+    return [c for c in certs if set(c.keys()) - {'name', 'passwords'}]
+
+
+def count_managed_certificates(context: InstanceContext) -> int:
+    """
+    :return: Number of certificates signed for the compose services of this instance, sizes the CSR pool
+    """
+    if context.configuration.is_docker_disabled:
+        return 0
+    return len(signed_certificates(load_certificate_configurations(context.securite, context.configuration)))
+
+
+def get_certificate_path(configuration: ConfigurationInstance, cert: CertificateConfiguration) -> pathlib.Path:
     secret_path = configuration.path_millegrilles / "secrets"
+    if cert.get('split'):
+        return secret_path / f"{cert['name']}.cert.pem"
+    else:
+        return secret_path / f"{cert['name']}.pem"
+
+
+def epoch_seconds(value: datetime.datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)  # Naive dates from certificates are UTC
+    return value.timestamp()
+
+
+def load_certificate_expiry(cert_path: pathlib.Path) -> tuple[float, float, bool]:
+    """
+    Loader for the certificate expiry index.
+    :return: not_before, not_after (epoch seconds) and whether the certificate must be renewed now
+    """
+    cert_enveloppe = EnveloppeCertificat.from_file(cert_path)
+    info_expiration = cert_enveloppe.calculer_expiration()
+    renew_now = info_expiration.get('expire') is True or info_expiration.get('renouveler') is True
+    return epoch_seconds(cert_enveloppe.not_valid_before), epoch_seconds(cert_enveloppe.not_valid_after), renew_now
+
+
+def load_certificate_index(configuration: ConfigurationInstance) -> CertificateExpiryIndex:
+    return CertificateExpiryIndex.load(configuration.path_millegrilles / "var" / ConstantesInstance.FICHIER_CERTIFICATE_INDEX)
+
+
+def check_certificates(configuration: ConfigurationInstance, certs: list[CertificateConfiguration],
+                       index: Optional[CertificateExpiryIndex] = None) -> list[CertificateConfiguration]:
+    """
+    :param index: Expiry index, certificate files are only parsed when they changed. A transient index is used when None.
+    """
+    if index is None:
+        index = CertificateExpiryIndex(configuration.path_millegrilles / "var" / ConstantesInstance.FICHIER_CERTIFICATE_INDEX)
 
     to_renew = list()
     init_only = configuration.init_only
 
     for cert in certs:
-        if cert.get('split'):
-            cert_path = secret_path / f"{cert['name']}.cert.pem"
-        else:
-            cert_path = secret_path / f"{cert['name']}.pem"
+        cert_path = get_certificate_path(configuration, cert)
 
         try:
-            cert_enveloppe = EnveloppeCertificat.from_file(cert_path)
+            entry = index.get(cert_path, load_certificate_expiry)
         except FileNotFoundError:
             to_renew.append(cert)  # Generate new certificate
             continue
 
-        info_expiration = cert_enveloppe.calculer_expiration()
-        if info_expiration.get('expire'):
+        if entry['not_after'] <= time.time():
             # Always regenerate certificates that are expired immediately
             # This has an impact on some domains like Maitredescles (it needs to be notified on key changes to migrate its secrets)
             to_renew.append(cert)
-        elif not init_only and info_expiration.get('renouveler'):
+        elif not init_only and entry['renew_at'] <= time.time():
             # Only renew certificates if the manager is currently running (so not in --init mode)
-            to_renew.append(cert)
+            # Confirm the renewal with the certificate itself, the index threshold is an estimate
+            entry = index.refresh(cert_path, load_certificate_expiry)
+            if entry['renew_at'] <= time.time():
+                to_renew.append(cert)
 
     return to_renew
 
 
+def update_certificate_index(context: InstanceContext, index: CertificateExpiryIndex,
+                             certs: list[CertificateConfiguration]):
+    """
+    Indexes new certificate files and removes entries that are not managed anymore. Records the inputs of this pass
+    (compose files, expected secrets, manager certificate) for the --init check, then saves the index.
+    """
+    configuration = context.configuration
+    secret_path = configuration.path_millegrilles / "secrets"
+
+    cert_paths = list()
+    expected_certificates = list()
+    for cert in certs:
+        cert_path = get_certificate_path(configuration, cert)
+        if set(cert.keys()) - {'name', 'passwords'}:
+            expected_certificates.append(str(cert_path))
+        try:
+            index.get(cert_path, load_certificate_expiry)
+            cert_paths.append(cert_path)
+        except FileNotFoundError:
+            pass  # Passwords only or not generated
+    index.prune(cert_paths)
+
+    sources: dict[str, Optional[list[int]]] = dict()
+    for compose_file in get_compose_file_paths(context.securite, configuration):
+        if compose_file.exists():
+            for path, stamp in COMPOSE_FILE_CACHE.stamps(compose_file).items():
+                sources[str(path)] = list(stamp)
+        else:
+            sources[str(compose_file)] = None
+
+    passwords = list()
+    for cert in certs:
+        for p in cert.get('passwords') or list():
+            passwords.append(str(secret_path / f"{p}.txt"))
+
+    manager_path = pathlib.Path(configuration.key_path)
+    manager_stamp = file_stamp(manager_path)
+    if manager_stamp is not None:
+        manager: Optional[ManagerCertificateSummary] = {
+            'path': str(manager_path),
+            'mtime_ns': manager_stamp[0],
+            'size': manager_stamp[2],
+            'not_after': epoch_seconds(context.signing_key.enveloppe.not_valid_after),
+        }
+    else:
+        manager = None
+
+    index.summary = {
+        'sources': sources,
+        'certificates': expected_certificates,
+        'passwords': sorted(set(passwords)),
+        'manager': manager,
+    }
+
+    try:
+        index.save()
+    except OSError as e:
+        LOGGER.warning("Unable to save the certificate index: %s" % e)
+
+
 def check_passwords(configuration: ConfigurationInstance, certs: list[CertificateConfiguration]) -> list[str]:
     secret_path = configuration.path_millegrilles / "secrets"
 
@@ -210,7 +345,7 @@ async def signer_module_core(producer: MilleGrillesPikaMessageProducer, context:
     config = context.configuration
     instance_id = config.instance_id
     idmg = config.idmg
-    clecsr = CleCsrGenere.build(instance_id, idmg)
+    clecsr = await build_clecsr(context.csr_pool, instance_id, idmg)
     csr_str = clecsr.get_pem_csr()
 
     configuration_cert['csr'] = csr_str
@@ -250,14 +385,15 @@ async def check_certissuer_available(context: InstanceContext):
 
 
 
-def signer_module_certissuer(config: ConfigurationInstance, cert_config: CertificateConfiguration, formatteur_message: FormatteurMessageMilleGrilles) -> CleCertificat:
+async def signer_module_certissuer(client: CertissuerClient, cert_config: CertificateConfiguration, formatteur_message: FormatteurMessageMilleGrilles,
+                                   csr_pool: Optional[CsrPool] = None) -> CleCertificat:
     certificat = formatteur_message.clecert.enveloppe
     instance_id = certificat.subject_common_name
     idmg = certificat.idmg
 
     # instance_id = config.instance_id
     # idmg = config.idmg
-    cle_csr = CleCsrGenere.build(instance_id, idmg)
+    cle_csr = await build_clecsr(csr_pool, instance_id, idmg)
     csr_str = cle_csr.get_pem_csr()
 
     cert_request: dict = cert_config.copy()
@@ -266,10 +402,7 @@ def signer_module_certissuer(config: ConfigurationInstance, cert_config: Certifi
     # Demander un nouveau certificat. Timeout long (60 secondes).
     message_signe, _uuid = formatteur_message.signer_message(MillegrillesConstantes.KIND_DOCUMENT, cert_request)
 
-    url_issuer = f"{config.certissuer_url}/signerModule"
-    response = requests.post(url_issuer, json=message_signe)
-    response.raise_for_status()
-    response_message = response.json()
+    response_message = await client.sign_module(message_signe)
     certificat = response_message['certificat']
 
     clecertificat = CleCertificat.from_pems(cle_csr.get_pem_cle(), ''.join(certificat))
@@ -304,16 +437,18 @@ async def renew_certificates(context: InstanceContext) -> list[dict]:
         raise Exception("Manager certificate is expired - it must be renewed manually")
 
     # Process config files
-    certs = list()
-    configuration_file = load_compose_files(context.securite, context.configuration)
-    for file_content in configuration_file:
-        new_certs = extract_certificate_configuration(file_content)
-        certs.extend(new_certs)
+    certs = load_certificate_configurations(context.securite, context.configuration)
+
+    # Keep enough pre-generated keys to renew every certificate of the compose services
+    if context.csr_pool is not None:
+        context.csr_pool.resize(len(signed_certificates(certs)))
 
     # Get certs to renew
-    certs_to_renew = check_certificates(context.configuration, certs)
+    index = load_certificate_index(context.configuration)
+    certs_to_renew = check_certificates(context.configuration, certs, index)
 
     if not certs_to_renew:
+        update_certificate_index(context, index, certs)
         return []  # Done
 
     cert_issuer_avaiable = await check_certissuer_available(context)
@@ -325,9 +460,10 @@ async def renew_certificates(context: InstanceContext) -> list[dict]:
 
     renewed_config: list[dict] = list()
 
-    # Submit certs
+    # Prepare signing requests
     formatteur = context.formatteur
     secrets_path = context.configuration.path_millegrilles / "secrets"
+    to_sign: list[tuple[CertificateConfiguration, CertificateConfiguration]] = list()
     for cert_config in certs_to_renew:
         # Inject local hostname when required
         cert_config_copy: CertificateConfiguration = cert_config.copy()
@@ -355,62 +491,89 @@ async def renew_certificates(context: InstanceContext) -> list[dict]:
             pass  # No passwords
 
         if len(keys) > 0:
-            if cert_issuer_avaiable:
-                cle_certificat = signer_module_certissuer(context.configuration, cert_config_copy, formatteur)
-            elif producer:
-                cle_certificat = await signer_module_core(producer, context, cert_config_copy)
-            else:
-                raise Exception('No means of accessing certissuer found')
-
-            key_pem = cle_certificat.private_key_bytes().decode('utf-8')
-            new_certificate = cle_certificat.enveloppe
-            cert_pem = "\n".join(new_certificate.chaine_pem()) + "\n"
-
-            # Check if we have to notify the maitre des cles (if --init, the certificate will only show up when ALREADY expired)
-            if not context.configuration.init_only and not context.configuration.is_docker_disabled:
-                try:
-                    if MillegrillesConstantes.DOMAINE_MAITRE_DES_CLES in cert_config_copy['domaines']:
-                        try:
-                            cert_path = secrets_path / f"{cert_config_copy['name']}.cert.pem"
-                            old_cert = EnveloppeCertificat.from_file(cert_path)
-                            await rotation_maitredescles(context, old_cert, new_certificate)
-                        except (TimeoutError, ValueError):
-                            LOGGER.exception("Error rotation certificate for keymaster")
-                            continue  # Keep going with other certificates
-                        except FileNotFoundError:
-                            LOGGER.warning("Old keymaster certificate cannot be loaded, rotating without warning")
-                except KeyError:
-                    pass
-
-            if cert_config.get('split'):
-                key_path = secrets_path / f"{cert_config_copy['name']}.key.pem"
-                cert_path = secrets_path / f"{cert_config_copy['name']}.cert.pem"
-
-                # Delete old files when present
-                try:
-                    key_path.unlink()
-                except FileNotFoundError:
-                    pass
-                try:
-                    cert_path.unlink()
-                except FileNotFoundError:
-                    pass
-
-                # Write new files
-                with open(key_path, "w") as key_file:
-                    key_file.write(key_pem)
-                with open(cert_path, "w") as cert_file:
-                    cert_file.write(cert_pem)
-            else:
-                # Combined key/cert pem file
-                pem_path = secrets_path / f"{cert_config_copy['name']}.pem"
-                with open(pem_path, "w") as pem_file:
-                    pem_file.write(key_pem)
-                    pem_file.write("\n")
-                    pem_file.write(cert_pem)
-
-            LOGGER.debug(f"Certificate {cert_config_copy['name']} renewed")
-            renewed_config.append(cert_config_copy)
+            to_sign.append((cert_config, cert_config_copy))
+
+    csr_pool = context.csr_pool
+
+    # Submit certs. Signing runs concurrently with a bounded number of requests in flight.
+    if cert_issuer_avaiable:
+        certissuer_url = context.configuration.certissuer_url
+        ssl_context = context.ssl_context if certissuer_url.startswith('https') else None
+        async with CertissuerClient(certissuer_url, ssl_context=ssl_context) as client:
+            results = await asyncio.gather(
+                *[signer_module_certissuer(client, c, formatteur, csr_pool) for (_, c) in to_sign], return_exceptions=True)
+    elif producer:
+        semaphore = asyncio.Semaphore(ConstantesInstance.CERTIFICATE_SIGNING_CONCURRENCY)
+
+        async def signer_core_bounded(cert_config_copy: CertificateConfiguration) -> CleCertificat:
+            async with semaphore:
+                return await signer_module_core(producer, context, cert_config_copy)
+
+        results = await asyncio.gather(*[signer_core_bounded(c) for (_, c) in to_sign], return_exceptions=True)
+    else:
+        raise Exception('No means of accessing certissuer found')
+
+    signing_error: Optional[BaseException] = None
+    for (cert_config, cert_config_copy), cle_certificat in zip(to_sign, results):
+        if isinstance(cle_certificat, asyncio.CancelledError):
+            raise cle_certificat
+        elif isinstance(cle_certificat, BaseException):
+            LOGGER.error(f"Error signing certificate {cert_config_copy['name']}: {cle_certificat}")
+            if signing_error is None:
+                signing_error = cle_certificat
+            index.renewal_failed(get_certificate_path(context.configuration, cert_config))
+            continue  # Keep going with other certificates
+
+        key_pem = cle_certificat.private_key_bytes().decode('utf-8')
+        new_certificate = cle_certificat.enveloppe
+        cert_pem = "\n".join(new_certificate.chaine_pem()) + "\n"
+
+        # Check if we have to notify the maitre des cles (if --init, the certificate will only show up when ALREADY expired)
+        if not context.configuration.init_only and not context.configuration.is_docker_disabled:
+            try:
+                if MillegrillesConstantes.DOMAINE_MAITRE_DES_CLES in cert_config_copy['domaines']:
+                    try:
+                        cert_path = secrets_path / f"{cert_config_copy['name']}.cert.pem"
+                        old_cert = EnveloppeCertificat.from_file(cert_path)
+                        await rotation_maitredescles(context, old_cert, new_certificate)
+                    except (TimeoutError, ValueError):
+                        LOGGER.exception("Error rotation certificate for keymaster")
+                        index.renewal_failed(get_certificate_path(context.configuration, cert_config))
+                        continue  # Keep going with other certificates
+                    except FileNotFoundError:
+                        LOGGER.warning("Old keymaster certificate cannot be loaded, rotating without warning")
+            except KeyError:
+                pass
+
+        if cert_config.get('split'):
+            key_path = secrets_path / f"{cert_config_copy['name']}.key.pem"
+            cert_path = secrets_path / f"{cert_config_copy['name']}.cert.pem"
+
+            # Delete old files when present
+            try:
+                key_path.unlink()
+            except FileNotFoundError:
+                pass
+            try:
+                cert_path.unlink()
+            except FileNotFoundError:
+                pass
+
+            # Write new files
+            with open(key_path, "w") as key_file:
+                key_file.write(key_pem)
+            with open(cert_path, "w") as cert_file:
+                cert_file.write(cert_pem)
+        else:
+            # Combined key/cert pem file
+            pem_path = secrets_path / f"{cert_config_copy['name']}.pem"
+            with open(pem_path, "w") as pem_file:
+                pem_file.write(key_pem)
+                pem_file.write("\n")
+                pem_file.write(cert_pem)
+
+        LOGGER.debug(f"Certificate {cert_config_copy['name']} renewed")
+        renewed_config.append(cert_config_copy)
 
     # Generate missing passwords
     passwords_to_generate = check_passwords(context.configuration, certs)
@@ -421,6 +584,15 @@ async def renew_certificates(context: InstanceContext) -> list[dict]:
             file.write(password)
         LOGGER.debug(f"Password {p} generated")
 
+    update_certificate_index(context, index, certs)
+
+    if csr_pool is not None:
+        LOGGER.info("CSR pool stats: %s" % csr_pool.stats)
+
+    if signing_error is not None and len(renewed_config) == 0:
+        # Nothing could be signed, report the first error. Failed certificates are retried after a delay.
+        raise signing_error
+
     return renewed_config
 
 
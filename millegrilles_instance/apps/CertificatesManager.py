@@ -1,13 +1,33 @@
 import asyncio
 import logging
+import os
+import pathlib
+import time
 
 from asyncio import TaskGroup
+from subprocess import CalledProcessError
+from typing import Optional
 
-from millegrilles_messages.messages import Constantes as MilleGrillesConstantes
+from millegrilles_instance import Constantes as ConstantesInstance
 
 from millegrilles_instance.Context import InstanceContext
-from millegrilles_instance.SystemdUtil import restart_compose_applications, restart_middleware, restart_nginx
-from millegrilles_instance.apps.Certificates import renew_certificates
+from millegrilles_instance.ReloadOrchestrator import ACTION_RESTART, SERVICE_APPLICATIONS, SERVICE_MIDDLEWARE, SERVICE_NGINX
+from millegrilles_instance.apps.Certificates import renew_certificates, load_certificate_index, load_service_index, \
+    load_dependency_graph
+from millegrilles_instance.apps.ComposeServices import ComposeServiceEntry, compose_restart, group_by_project
+
+
+def project_unit_service(project_file: pathlib.Path) -> Optional[str]:
+    """
+    :return: Orchestrator service of the systemd unit running the compose project, None when not managed
+    """
+    if project_file.parent.name == 'middleware':
+        return SERVICE_MIDDLEWARE
+    elif project_file.name == 'nginx.yml':
+        return SERVICE_NGINX
+    elif project_file.name == 'applications.yml':
+        return SERVICE_APPLICATIONS
+    return None
 
 
 class CertificatesManager:
@@ -54,11 +74,24 @@ class CertificatesManager:
         while self.__context.stopping is False:
             try:
                 await self.__renew_certificates()
+                delay = await asyncio.to_thread(self.__next_check_delay)
             except Exception:
                 self.__logger.exception("Error renewing certificates in manager")
-            await self.__context.wait(3600)
+                delay = ConstantesInstance.CERTIFICATE_RENEW_RETRY
+            self.__logger.debug("Next certificate check in %d seconds" % delay)
+            await self.__context.wait(delay)
         self.__logger.info("Stopping certificate renewal check thread")
 
+    def __next_check_delay(self) -> float:
+        """
+        :return: Seconds until the next certificate in the expiry index needs work.
+        """
+        next_deadline = load_certificate_index(self.__context.configuration).next_deadline()
+        if next_deadline is None:
+            return ConstantesInstance.CERTIFICATE_CHECK_MAX_DELAY
+        delay = next_deadline - time.time()
+        return min(max(delay, ConstantesInstance.CERTIFICATE_CHECK_MIN_DELAY), ConstantesInstance.CERTIFICATE_CHECK_MAX_DELAY)
+
     async def __renew_certificates(self):
         renewed_config = await renew_certificates(self.__context)
         if len(renewed_config) == 0:
@@ -66,47 +99,45 @@ class CertificatesManager:
             return  # Done
 
         names_renewed: set[str] = set([c['name'] for c in renewed_config])
-
-        # Possible improvements:
-        #   - read .yml files and extract service names directly
-        #   - use docker compose restart on individual services
-
-        try:
-            names_renewed.remove('nginx')  # Hard-coded module name
-            nginx_renewed = True
-        except KeyError:
-            nginx_renewed = False
-
-        middleware_renewed = False
-        # Hard-coded module names
-        if self.__context.securite == MilleGrillesConstantes.SECURITE_PROTEGE:
-            middleware_list = ['mq', 'mongo', 'midcompte', 'redis', 'ceduleur', 'webauth']
-        else:
-            middleware_list = ['redis', 'webauth']
-        for name in middleware_list:
-            try:
-                names_renewed.remove(name)
-                middleware_renewed = True
-            except KeyError:
-                pass
-
-        # Anything left is in the applications.yml file
-        applications_renewed = len(names_renewed) > 0
-
-        instance_name = self.__context.configuration.instance_name
-        if nginx_renewed:
-            self.__logger.info("Certificates updated, reloading nginx")
-            await asyncio.to_thread(restart_nginx, instance_name)
-
-        if not self.__context.configuration.is_docker_disabled:
-
-            if applications_renewed:
-                self.__logger.info("Certificates updated, restarting applications")
-                await asyncio.to_thread(restart_compose_applications, instance_name)
-
-            if middleware_renewed:
-                # Note : restarting the middleware potentially cuts the connection to MQ (closes the manager)
-                self.__logger.warning("Certificates updated, restarting middleware (MQ may restart - this crashes the manager)")
-                await asyncio.to_thread(restart_middleware, instance_name)
+        configuration = self.__context.configuration
+
+        # Restart only the containers using the renewed certificates
+        securite = self.__context.securite
+        service_index = await asyncio.to_thread(load_service_index, securite, configuration)
+        services: dict[str, ComposeServiceEntry] = dict()
+        unit_restarts = set()
+        for name in sorted(names_renewed):
+            certificate_services = service_index.certificate_services(name)
+            if len(certificate_services) > 0:
+                services.update([(s['name'], s) for s in certificate_services])
+            else:
+                self.__logger.warning("No compose service found for certificate %s, restarting the applications" % name)
+                unit_restarts.add(SERVICE_APPLICATIONS)
+
+        # Dependencies first, the services of a wave restart in parallel
+        graph = await asyncio.to_thread(load_dependency_graph, securite, configuration)
+        env = dict(os.environ)
+        env.update(configuration.config_env)
+        for wave in graph.restart_waves(services.keys()):
+            projects = group_by_project([services[name] for name in wave])
+            self.__logger.info("Certificates updated, restarting %s" % ', '.join(wave))
+            results = await asyncio.gather(*[
+                compose_restart(project_file, service_names, configuration.docker,
+                                cwd=configuration.path_millegrilles, env=env)
+                for project_file, service_names in projects.items()
+            ], return_exceptions=True)
+            for (project_file, service_names), result in zip(projects.items(), results):
+                if isinstance(result, CalledProcessError):
+                    unit_service = project_unit_service(project_file)
+                    if unit_service is None:
+                        raise result
+                    self.__logger.warning("Error restarting %s (%s), restarting %s" % (', '.join(service_names), result.stderr, unit_service))
+                    unit_restarts.add(unit_service)
+                elif isinstance(result, BaseException):
+                    raise result
+
+        # Fallback on the systemd units, merged with the other restarts requested during the same window
+        orchestrator = self.__context.reload_orchestrator
+        await asyncio.gather(*[orchestrator.request(s, ACTION_RESTART) for s in unit_restarts])
 
         self.__logger.info("Modules have been restarted after certificate renewal")
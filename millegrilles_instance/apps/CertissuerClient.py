@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import ssl
+
+from typing import Optional
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from millegrilles_instance import Constantes as ConstantesInstance
+
+
+class CertissuerClient:
+    """
+    Non-blocking client for the local certissuer.
+    A single keep-alive session is shared by all signing requests and the number of requests in flight is bounded.
+    Use as an async context manager.
+    """
+
+    def __init__(self, certissuer_url: str, max_in_flight: int = ConstantesInstance.CERTIFICATE_SIGNING_CONCURRENCY,
+                 timeout: float = 60, ssl_context: Optional[ssl.SSLContext] = None):
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__certissuer_url = certissuer_url
+        self.__max_in_flight = max_in_flight
+        self.__timeout = ClientTimeout(total=timeout)
+        self.__ssl_context = ssl_context
+        self.__semaphore = asyncio.Semaphore(max_in_flight)
+        self.__session: Optional[ClientSession] = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def open(self):
+        if self.__session is not None:
+            return  # Already open
+        # Keep one pooled connection per request slot, reused across signing requests
+        if self.__ssl_context is not None:
+            connector = TCPConnector(limit=self.__max_in_flight, ssl=self.__ssl_context)
+        else:
+            connector = TCPConnector(limit=self.__max_in_flight)
+        self.__session = ClientSession(timeout=self.__timeout, connector=connector)
+
+    async def close(self):
+        if self.__session is not None:
+            session = self.__session
+            self.__session = None
+            await session.close()
+
+    @property
+    def max_in_flight(self) -> int:
+        return self.__max_in_flight
+
+    async def sign_module(self, message_signe: dict) -> dict:
+        """
+        Submits a signed CSR request to the certissuer /signerModule endpoint.
+        :param message_signe: Signed message containing the CSR
+        :return: Parsed json response from the certissuer
+        """
+        if self.__session is None:
+            raise Exception('CertissuerClient session is not open')
+
+        url_issuer = f"{self.__certissuer_url}/signerModule"
+        async with self.__semaphore:
+            async with self.__session.post(url_issuer, json=message_signe) as response:
+                response.raise_for_status()
+                return await response.json()
@@ -0,0 +1,119 @@
+import os
+import pathlib
+
+import yaml
+
+from typing import Optional
+
+try:
+    # libyaml C loader, much faster on large include trees
+    from yaml import CSafeLoader as YamlSafeLoader
+except ImportError:
+    from yaml import SafeLoader as YamlSafeLoader
+
+
+# File identity used to validate cache entries: (mtime_ns, inode, size)
+FileStamp = tuple[int, int, int]
+
+
+class ComposeFileNode:
+
+    def __init__(self, stamp: FileStamp, content: dict, include_paths: list[pathlib.Path]):
+        self.stamp = stamp
+        self.content = content
+        self.include_paths = include_paths
+        self.children: Optional[list[dict]] = None
+        self.assembled: Optional[dict] = None
+
+
+class ComposeFileCache:
+    """
+    Memoizes parsed docker compose files and their include graph.
+    Each file is validated by path, mtime, inode and size. A file is only parsed again when it changed, and an
+    assembled subtree is reused as-is when the file and all of its includes are unchanged.
+
+    The returned dicts are shared between calls and must be treated as read-only.
+    """
+
+    def __init__(self):
+        self.__nodes: dict[pathlib.Path, ComposeFileNode] = dict()
+        self.__parses = 0
+
+    @property
+    def parses(self) -> int:
+        """ Number of yaml files parsed by this cache. """
+        return self.__parses
+
+    def load(self, yaml_file: pathlib.Path) -> dict:
+        """
+        Loads a compose file. The content of included files is added under 'x-include-content', keyed by the resolved
+        path of each include.
+        """
+        return self.__load(pathlib.Path(yaml_file), set())
+
+    def stamps(self, yaml_file: pathlib.Path) -> dict[pathlib.Path, FileStamp]:
+        """
+        :return: Stamps of the file and of all its includes, from the last load.
+        """
+        stamps: dict[pathlib.Path, FileStamp] = dict()
+        pending = [pathlib.Path(yaml_file)]
+        while len(pending) > 0:
+            path = pending.pop()
+            if path in stamps:
+                continue
+            node = self.__nodes[path]
+            stamps[path] = node.stamp
+            pending.extend(node.include_paths)
+        return stamps
+
+    def clear(self):
+        self.__nodes.clear()
+
+    def __load(self, yaml_file: pathlib.Path, visiting: set[pathlib.Path]) -> dict:
+        if yaml_file in visiting:
+            raise ValueError(f"Include cycle detected on {yaml_file}")
+
+        stat = os.stat(yaml_file)
+        stamp: FileStamp = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+        node = self.__nodes.get(yaml_file)
+        if node is None or node.stamp != stamp:
+            node = self.__parse(yaml_file, stamp)
+            self.__nodes[yaml_file] = node
+
+        visiting.add(yaml_file)
+        try:
+            children = [self.__load(p, visiting) for p in node.include_paths]
+        finally:
+            visiting.remove(yaml_file)
+
+        if node.assembled is not None and len(children) == len(node.children) and \
+                all(child is previous for child, previous in zip(children, node.children)):
+            return node.assembled  # Unchanged subtree
+
+        assembled = dict(node.content)
+        if 'include' in node.content:
+            assembled['x-include-content'] = {p: c for p, c in zip(node.include_paths, children)}
+        node.children = children
+        node.assembled = assembled
+
+        return assembled
+
+    def __parse(self, yaml_file: pathlib.Path, stamp: FileStamp) -> ComposeFileNode:
+        with open(yaml_file) as f:
+            content: dict = yaml.load(f, Loader=YamlSafeLoader) or dict()
+        self.__parses += 1
+
+        include_paths: list[pathlib.Path] = list()
+        for include_file in content.get('include') or list():
+            try:
+                include_file = include_file['path']
+            except (TypeError, KeyError):
+                pass
+            include_paths.append(yaml_file.parent.joinpath(include_file).resolve())
+
+        return ComposeFileNode(stamp, content, include_paths)
+
+
+# Shared cache for the manager process
+COMPOSE_FILE_CACHE = ComposeFileCache()
@@ -0,0 +1,125 @@
+import pathlib
+
+from typing import Iterable, Optional
+
+from millegrilles_instance.apps.ComposeCache import ComposeFileCache, COMPOSE_FILE_CACHE
+
+
+def service_dependencies(service: Optional[dict]) -> set[str]:
+    """
+    :return: Names of the services this service needs to be running: depends_on (list or mapping), links and
+             network_mode service:<name>
+    """
+    dependencies = set()
+    if not service:
+        return dependencies
+
+    dependencies.update(service.get('depends_on') or list())  # Keys of the long syntax mapping
+
+    for link in service.get('links') or list():
+        dependencies.add(link.split(':')[0])  # service:alias
+
+    network_mode = service.get('network_mode')
+    if isinstance(network_mode, str) and network_mode.startswith('service:'):
+        dependencies.add(network_mode[len('service:'):])
+
+    return dependencies
+
+
+class ComposeDependencyGraph:
+    """
+    Dependency graph of the services declared in compose files and their includes (middleware, coremodules,
+    applications). Gives the order to restart a set of services, dependencies first, without adding the services
+    that depend on them.
+    """
+
+    def __init__(self):
+        self.__dependencies: dict[str, set[str]] = dict()
+        self.__dependents: dict[str, set[str]] = dict()
+
+    @staticmethod
+    def build(root_files: list[pathlib.Path], cache: ComposeFileCache = COMPOSE_FILE_CACHE):
+        """
+        :param root_files: Compose files to load with their includes, missing files are skipped
+        """
+        graph = ComposeDependencyGraph()
+        for root_file in root_files:
+            root_file = pathlib.Path(root_file)
+            if root_file.exists():
+                graph.add_content(cache.load(root_file))
+        return graph
+
+    def add_content(self, content: dict):
+        """
+        Adds the services of a loaded compose file, including the content of its includes.
+        """
+        for child in (content.get('x-include-content') or dict()).values():
+            self.add_content(child)
+        for service_name, service in (content.get('services') or dict()).items():
+            self.add_service(service_name, service_dependencies(service))
+
+    def add_service(self, name: str, dependencies: Iterable[str]):
+        self.__dependencies.setdefault(name, set()).update(dependencies)
+        self.__dependents.setdefault(name, set())
+        for dependency in dependencies:
+            self.__dependents.setdefault(dependency, set()).add(name)
+
+    @property
+    def services(self) -> list[str]:
+        return sorted(self.__dependencies.keys())
+
+    def dependencies(self, name: str) -> set[str]:
+        return set(self.__dependencies.get(name) or set())
+
+    def dependents(self, name: str) -> set[str]:
+        return set(self.__dependents.get(name) or set())
+
+    def restart_waves(self, names: Iterable[str]) -> list[list[str]]:
+        """
+        Orders services for a restart. Services in the same wave do not depend on each other and can restart in
+        parallel, each wave only depends on the previous ones. Dependencies outside the requested services are
+        followed for the ordering but are not added.
+        :raises ValueError: On a dependency cycle
+        """
+        requested = set(names)
+        levels: dict[str, int] = dict()
+
+        for name in sorted(requested):
+            self.__level(name, requested, levels, list())
+
+        waves: list[list[str]] = list()
+        for name in sorted(requested):
+            level = levels[name]
+            while len(waves) <= level:
+                waves.append(list())
+            waves[level].append(name)
+        return [w for w in waves if len(w) > 0]
+
+    def stop_waves(self, names: Iterable[str]) -> list[list[str]]:
+        """
+        Order to stop or remove services: dependents first.
+        """
+        return list(reversed(self.restart_waves(names)))
+
+    def __level(self, name: str, requested: set[str], levels: dict[str, int], path: list[str]) -> int:
+        """
+        :return: Wave of a service, -1 for a service outside the requested set without requested dependencies
+        """
+        level = levels.get(name)
+        if level is not None:
+            return level
+        if name in path:
+            raise ValueError("Dependency cycle: %s" % ' -> '.join(path[path.index(name):] + [name]))
+
+        path.append(name)
+        dependency_level = -1
+        for dependency in sorted(self.__dependencies.get(name) or set()):
+            dependency_level = max(dependency_level, self.__level(dependency, requested, levels, path))
+        path.pop()
+
+        if name in requested:
+            level = dependency_level + 1
+        else:
+            level = dependency_level  # Only passes the order through
+        levels[name] = level
+        return level
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import pathlib
+
+from subprocess import CalledProcessError
+from typing import Optional, TypedDict
+
+from millegrilles_instance.apps.ComposeCache import ComposeFileCache, COMPOSE_FILE_CACHE
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ComposeServiceEntry(TypedDict):
+    name: str
+    project_file: pathlib.Path  # Compose file used with -f by the systemd unit running the service
+    compose_file: pathlib.Path  # Compose file where the service is declared
+    certificate: bool  # Has a x-millegrilles-certificat configuration
+
+
+class ComposeServiceIndex:
+    """
+    Index of the services declared in a compose include graph.
+
+    The project of a service is the nearest file with a top-level name, the file itself or one that includes it
+    (e.g. middleware/node-protege.yml for redis, coremodules/nginx.yml for nginx). Without a name, the root file is
+    the project.
+    """
+
+    def __init__(self):
+        self.__services: dict[str, ComposeServiceEntry] = dict()
+        # service: (configs and secrets referenced, top-level configs and secrets files of its project)
+        self.__service_references: dict[str, tuple[list[tuple[str, str]], dict[tuple[str, str], str]]] = dict()
+
+    @staticmethod
+    def build(root_files: list[pathlib.Path], cache: ComposeFileCache = COMPOSE_FILE_CACHE):
+        """
+        :param root_files: Compose files to index, missing files are skipped
+        """
+        index = ComposeServiceIndex()
+        for root_file in root_files:
+            root_file = pathlib.Path(root_file)
+            if not root_file.exists():
+                continue
+            index.__walk(root_file.resolve(), cache.load(root_file), None, dict())
+        return index
+
+    @property
+    def services(self) -> dict[str, ComposeServiceEntry]:
+        return self.__services
+
+    def get(self, name: str) -> Optional[ComposeServiceEntry]:
+        return self.__services.get(name)
+
+    def certificate_services(self, name: str) -> list[ComposeServiceEntry]:
+        """
+        :param name: Certificate name, same as the service with the x-millegrilles-certificat configuration
+        :return: The service owning the certificate and the services mounting its files
+        """
+        services = list()
+        owner = self.__services.get(name)
+        if owner is not None:
+            services.append(owner)
+
+        cert_files = {f'{name}.pem', f'{name}.cert.pem', f'{name}.key.pem'}
+        for service_name in self.__services.keys():
+            if service_name == name:
+                continue
+            for source in self.service_sources(service_name):
+                source_path = pathlib.PurePosixPath(source)
+                if source_path.parent.name == 'secrets' and source_path.name in cert_files:
+                    services.append(self.__services[service_name])
+                    break
+
+        return services
+
+    def service_sources(self, name: str) -> list[str]:
+        """
+        :return: Files mounted by the service as configs and secrets
+        """
+        references, project_sources = self.__service_references[name]
+        return [project_sources[r] for r in references if r in project_sources]
+
+    def __walk(self, path: pathlib.Path, content: dict, project_file: Optional[pathlib.Path],
+               project_sources: dict[tuple[str, str], str]):
+        if content.get('name') or project_file is None:
+            # Start of a project, configs and secrets are shared by all its files
+            project_file = path
+            project_sources = dict()
+
+        for kind in ('configs', 'secrets'):
+            for source_name, source in (content.get(kind) or dict()).items():
+                try:
+                    project_sources[(kind, source_name)] = source['file']
+                except (TypeError, KeyError):
+                    pass  # Not a file
+
+        services = content.get('services') or dict()
+        for service_name, service in services.items():
+            if service_name in self.__services:
+                continue  # First declaration wins
+            self.__services[service_name] = {
+                'name': service_name,
+                'project_file': project_file,
+                'compose_file': path,
+                'certificate': 'x-millegrilles-certificat' in (service or dict()),
+            }
+            references = list()
+            for kind in ('configs', 'secrets'):
+                for reference in (service or dict()).get(kind) or list():
+                    source_name = reference if isinstance(reference, str) else reference.get('source')
+                    references.append((kind, source_name))
+            # Top-level configs can be declared in another file of the project, resolved on use
+            self.__service_references[service_name] = (references, project_sources)
+
+        for child_path, child in (content.get('x-include-content') or dict()).items():
+            self.__walk(child_path, child, project_file, project_sources)
+
+
+def group_by_project(services: list[ComposeServiceEntry]) -> dict[pathlib.Path, list[str]]:
+    """
+    :return: Service names for each project file, without duplicates
+    """
+    projects: dict[pathlib.Path, list[str]] = dict()
+    for service in services:
+        names = projects.setdefault(service['project_file'], list())
+        if service['name'] not in names:
+            names.append(service['name'])
+    return projects
+
+
+async def compose_restart(project_file: pathlib.Path, service_names: list[str], docker: str = 'docker',
+                          cwd: Optional[pathlib.Path] = None, env: Optional[dict[str, str]] = None,
+                          timeout: float = 300.0):
+    """
+    Restarts the containers of the services without touching the rest of the project.
+    :raises CalledProcessError: When docker fails or times out
+    """
+    command = [docker, 'compose', '-f', str(project_file), 'restart', *service_names]
+    LOGGER.info("Restarting %s from %s" % (', '.join(service_names), project_file))
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command, cwd=cwd, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    except OSError as e:
+        raise CalledProcessError(127, command, '', str(e))
+
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        stdout, stderr = await process.communicate()
+        stderr += f'\nTimeout after {timeout} seconds'.encode('utf-8')
+
+    if process.returncode != 0:
+        raise CalledProcessError(process.returncode if process.returncode is not None else -1, command,
+                                 stdout.decode('utf-8', errors='replace'), stderr.decode('utf-8', errors='replace'))
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+
+from asyncio import TaskGroup
+from collections import deque
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import Callable, Optional, TypedDict
+
+from millegrilles_instance.ConfigurationDiff import ConfigurationDiff
+from millegrilles_instance.Context import InstanceContext
+from millegrilles_messages.certificats.Generes import CleCsrGenere
+
+
+class CsrPoolStats(TypedDict):
+    hits: int
+    misses: int
+    generated: int
+    available: int
+    target: int
+
+
+class CsrPool:
+    """
+    Pool of pre-generated keypairs/CSRs for certificate renewal.
+    Keys are generated in a dedicated thread pool when the pool has been idle for a moment. Renewal then only
+    pays for the signing round trip.
+    """
+
+    def __init__(self, context: InstanceContext, max_workers: int = 2, idle_delay: float = 5.0,
+                 get_size: Optional[Callable[[], int]] = None):
+        """
+        :param get_size: Number of keys to keep ready (certificates managed for the compose services). Called in a
+                         thread when the pool starts and after the configuration or certificate is reloaded, so the
+                         pool is filled before the first renewal.
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__context = context
+        self.__idle_delay = idle_delay
+        self.__get_size = get_size
+        self.__size_requested = get_size is not None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='csr_pool')
+
+        self.__identity: Optional[tuple[str, str]] = None  # (instance_id, idmg) used to build the CSRs
+        self.__configured_identity: Optional[tuple[str, str]] = None  # Last identity seen in the configuration
+        self.__available: deque[CleCsrGenere] = deque()
+        self.__target_size = 0
+        self.__last_use = 0.0
+        self.__refill_event = asyncio.Event()
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__generated = 0
+
+        context.add_reload_listener(self.__configuration_reloaded)
+
+    async def run(self):
+        self.__logger.debug("CsrPool thread started")
+        self.__loop = asyncio.get_running_loop()
+        self.__seed_identity()  # Fill before the first renewal, e.g. the mass renewal on startup
+        self.__refill_event.set()
+        try:
+            async with TaskGroup() as group:
+                group.create_task(self.__stop_thread())
+                group.create_task(self.__refill_thread())
+        except *Exception as e:  # Fail on first exception
+            raise e
+        finally:
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+        self.__logger.debug("CsrPool thread done")
+
+    async def __stop_thread(self):
+        await self.__context.wait()
+        self.__refill_event.set()
+
+    async def __refill_thread(self):
+        while self.__context.stopping is False:
+            await self.__refill_event.wait()
+            self.__refill_event.clear()
+            await self.__update_size()
+            self.__seed_identity()
+
+            while self.__context.stopping is False and self.__identity and len(self.__available) < self.__target_size:
+                # Only generate when no renewal is consuming keys, generation competes for the CPU
+                idle_for = time.monotonic() - self.__last_use
+                if idle_for < self.__idle_delay:
+                    await self.__context.wait(self.__idle_delay - idle_for)
+                    continue
+
+                instance_id, idmg = self.__identity
+                clecsr = await self.__build(instance_id, idmg)
+                if self.__identity == (instance_id, idmg):
+                    self.__available.append(clecsr)
+
+            if self.__available:
+                self.__logger.debug("CsrPool refilled, %d keys available" % len(self.__available))
+
+    async def __build(self, instance_id: str, idmg: str) -> CleCsrGenere:
+        loop = asyncio.get_running_loop()
+        clecsr = await loop.run_in_executor(self.__executor, CleCsrGenere.build, instance_id, idmg)
+        self.__generated += 1
+        return clecsr
+
+    def __configuration_reloaded(self, diff: ConfigurationDiff):
+        """
+        Reload listener, called from the reload thread.
+        """
+        if self.__get_size is None or not (diff['full'] or diff['certificate']):
+            return
+        self.__size_requested = True
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__refill_event.set)
+
+    async def __update_size(self):
+        if self.__size_requested is False:
+            return
+        self.__size_requested = False
+        try:
+            size = await asyncio.to_thread(self.__get_size)
+        except Exception as e:
+            # E.g. configuration not loaded yet, sized again on the next reload
+            self.__logger.debug("CsrPool size not available: %s" % e)
+            return
+        self.resize(size)
+
+    def __context_identity(self) -> Optional[tuple[str, str]]:
+        try:
+            configuration = self.__context.configuration
+            identity = (configuration.instance_id, configuration.idmg)
+        except Exception:
+            return None  # Configuration not loaded yet
+        if identity[0] and identity[1]:
+            return identity
+        return None
+
+    def __seed_identity(self):
+        """
+        Uses the identity of the instance configuration, keys built for a previous identity are discarded.
+        """
+        identity = self.__context_identity()
+        if identity is not None and identity != self.__configured_identity:
+            self.__configured_identity = identity
+            self.__set_identity(identity)
+
+    def __set_identity(self, identity: tuple[str, str]):
+        if self.__identity != identity:
+            # CSRs embed the instance_id and idmg, discard keys built for another identity
+            self.__available.clear()
+            self.__identity = identity
+
+    def resize(self, size: int):
+        """
+        Sets the number of keys to keep ready. Use the number of certificates managed for the compose services.
+        """
+        self.__seed_identity()
+        self.__target_size = max(0, size)
+        while len(self.__available) > self.__target_size:
+            self.__available.pop()
+        self.__refill_event.set()
+
+    async def get(self, instance_id: str, idmg: str) -> CleCsrGenere:
+        """
+        :return: A pre-generated key/CSR when available, otherwise one generated on the spot (off the event loop).
+        """
+        self.__set_identity((instance_id, idmg))
+
+        self.__last_use = time.monotonic()
+        try:
+            clecsr = self.__available.popleft()
+            self.__hits += 1
+        except IndexError:
+            self.__misses += 1
+            clecsr = await self.__build(instance_id, idmg)
+
+        self.__refill_event.set()
+        return clecsr
+
+    @property
+    def stats(self) -> CsrPoolStats:
+        return {
+            'hits': self.__hits,
+            'misses': self.__misses,
+            'generated': self.__generated,
+            'available': len(self.__available),
+            'target': self.__target_size,
+        }
+
+
+async def build_clecsr(csr_pool: Optional[CsrPool], instance_id: str, idmg: str) -> CleCsrGenere:
+    """
+    Gets a key/CSR from the pool when one is configured. Without a pool (e.g. --init), the key is generated in a thread.
+    """
+    if csr_pool is not None:
+        return await csr_pool.get(instance_id, idmg)
+    return await asyncio.to_thread(CleCsrGenere.build, instance_id, idmg)
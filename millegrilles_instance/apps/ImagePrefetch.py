@@ -0,0 +1,314 @@
+import asyncio
+import json
+import logging
+import re
+import time
+
+from typing import Callable, Iterable, Optional, TypedDict
+
+# docker pull output: "<layer id>: <status>", optionally with "<current>/<total>" sizes
+LAYER_LINE = re.compile(r'^([0-9a-f]{12,64}): (.+)$')
+LAYER_SIZES = re.compile(r'([0-9.]+\s*[kMGT]?B)/([0-9.]+\s*[kMGT]?B)')
+SIZE_UNITS = {'B': 1, 'kB': 1000, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4}
+LAYER_DONE = ('Pull complete', 'Already exists')
+LAYER_DOWNLOADED = ('Download complete', 'Verifying Checksum', 'Extracting') + LAYER_DONE
+
+# ${VAR}, ${VAR:-default}, ${VAR-default} and $VAR in image names
+VARIABLE = re.compile(r'\$(?:\{([A-Za-z_][A-Za-z0-9_]*)(?:(:?-)([^}]*))?\}|([A-Za-z_][A-Za-z0-9_]*))')
+
+
+class ImagePrefetchProgress(TypedDict):
+    # Rust mapping: struct ImagePrefetchProgress, sent on the bus as is
+    images_total: int
+    images_done: int  # Pulled or skipped
+    images_skipped: int  # Already present locally
+    images_failed: int
+    layers_total: int  # Distinct layers seen, shared layers are counted once
+    layers_done: int
+    bytes_current: int  # Only known when docker reports layer sizes
+    bytes_total: int
+    pulling: list[str]  # Images being pulled
+    done: bool
+
+
+class ImagePrefetchResult(TypedDict):
+    pulled: list[str]
+    skipped: list[str]
+    failed: dict[str, str]  # image: error
+
+
+def parse_size(value: str) -> int:
+    number, unit = re.match(r'([0-9.]+)\s*([kMGT]?B)', value).groups()
+    return int(float(number) * SIZE_UNITS[unit])
+
+
+def interpolate(value: str, env: dict[str, str]) -> str:
+    """
+    Replaces the variables in a compose value, same rules as docker compose.
+    """
+    def replace(match: re.Match) -> str:
+        name, operator, default, plain_name = match.groups()
+        if plain_name is not None:
+            return env.get(plain_name, '')
+        current = env.get(name)
+        if operator == ':-' and not current:
+            return default
+        if operator == '-' and current is None:
+            return default
+        return current or ''
+    return VARIABLE.sub(replace, value)
+
+
+def normalize_image(image: str) -> str:
+    """
+    :return: Image reference with a tag (latest by default) unless pinned by digest
+    """
+    if '@' in image:
+        return image
+    last_part = image.rsplit('/', 1)[-1]
+    if ':' not in last_part:
+        return image + ':latest'
+    return image
+
+
+def compose_images(content: dict, env: dict[str, str]) -> dict[str, list[str]]:
+    """
+    :param content: Compose file content, with the included files under x-include-content
+    :return: Images to pull with the services using them. Services built locally or with pull_policy never/build
+             are skipped.
+    """
+    images: dict[str, list[str]] = dict()
+    for child in (content.get('x-include-content') or dict()).values():
+        for image, services in compose_images(child, env).items():
+            images.setdefault(image, list()).extend(services)
+
+    for service_name, service in (content.get('services') or dict()).items():
+        image = (service or dict()).get('image')
+        if not image or service.get('pull_policy') in ('never', 'build'):
+            continue
+        image = normalize_image(interpolate(image, env))
+        images.setdefault(image, list()).append(service_name)
+
+    return images
+
+
+def compose_pull_always(content: dict, env: dict[str, str]) -> set[str]:
+    """
+    :return: Images of services with pull_policy always, pulled even when present locally
+    """
+    images = set()
+    for child in (content.get('x-include-content') or dict()).values():
+        images.update(compose_pull_always(child, env))
+    for service in (content.get('services') or dict()).values():
+        if service and service.get('image') and service.get('pull_policy') == 'always':
+            images.add(normalize_image(interpolate(service['image'], env)))
+    return images
+
+
+def local_images_present(inspect_output: str, images: Iterable[str]) -> set[str]:
+    """
+    :param inspect_output: JSON list from docker image inspect
+    :return: Images already present locally. A digest reference must match a repo digest, a tag reference a repo tag.
+    """
+    try:
+        inspected = json.loads(inspect_output or '[]')
+    except ValueError:
+        return set()
+
+    references = set()
+    for image in inspected:
+        references.update(image.get('RepoTags') or list())
+        references.update(image.get('RepoDigests') or list())
+
+    present = set()
+    for image in images:
+        if image in references or image.removeprefix('docker.io/').removeprefix('library/') in references:
+            present.add(image)
+    return present
+
+
+class ProgressAggregator:
+    """
+    Combines the per-layer progress of all the pulls in a single progress state.
+    """
+
+    def __init__(self, images: list[str], skipped: set[str]):
+        self.__images = images
+        self.__skipped = set(skipped)
+        self.__pulled: set[str] = set()
+        self.__failed: set[str] = set()
+        self.__pulling: list[str] = list()
+        self.__layers: dict[str, tuple[str, int, int]] = dict()  # layer id: (status, current bytes, total bytes)
+
+    def start(self, image: str):
+        self.__pulling.append(image)
+
+    def finish(self, image: str, ok: bool):
+        self.__pulling.remove(image)
+        if ok:
+            self.__pulled.add(image)
+        else:
+            self.__failed.add(image)
+
+    def update(self, line: str) -> bool:
+        """
+        :param line: Line of docker pull output
+        :return: True when the line changed the progress
+        """
+        match = LAYER_LINE.match(line.strip())
+        if match is None:
+            return False
+        layer_id, status = match.groups()
+        _, current, total = self.__layers.get(layer_id, ('', 0, 0))
+
+        sizes = LAYER_SIZES.search(status)
+        if sizes is not None:
+            current, total = parse_size(sizes.group(1)), parse_size(sizes.group(2))
+        elif status.startswith(LAYER_DOWNLOADED):
+            current = total
+
+        self.__layers[layer_id] = (status, current, total)
+        return True
+
+    @property
+    def progress(self) -> ImagePrefetchProgress:
+        layers = self.__layers.values()
+        return {
+            'images_total': len(self.__images),
+            'images_done': len(self.__pulled) + len(self.__skipped),
+            'images_skipped': len(self.__skipped),
+            'images_failed': len(self.__failed),
+            'layers_total': len(self.__layers),
+            'layers_done': len([s for s, _, _ in layers if s.startswith(LAYER_DONE)]),
+            'bytes_current': sum([c for _, c, _ in layers]),
+            'bytes_total': sum([t for _, _, t in layers]),
+            'pulling': list(self.__pulling),
+            'done': len(self.__pulling) == 0 and
+                    len(self.__pulled) + len(self.__skipped) + len(self.__failed) == len(self.__images),
+        }
+
+
+class ImagePrefetch:
+    """
+    Pulls docker images before they are needed. Images are pulled once even when used by several services, with a
+    bounded number of concurrent pulls. Images already present locally are skipped.
+    """
+
+    def __init__(self, docker: str = 'docker', concurrency: int = 3,
+                 progress: Optional[Callable[[ImagePrefetchProgress], None]] = None, progress_interval: float = 0.5,
+                 env: Optional[dict[str, str]] = None, timeout: float = 3600.0):
+        """
+        :param docker: docker executable, replaced by a stand-in for tests
+        :param progress: Called with the combined progress, at most every progress_interval seconds and when done
+        :param timeout: Seconds before a pull is considered failed
+        """
+        self.__logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.__docker = docker
+        self.__concurrency = concurrency
+        self.__progress_callback = progress
+        self.__progress_interval = progress_interval
+        self.__env = env
+        self.__timeout = timeout
+        self.__last_progress = 0.0
+
+    async def prefetch(self, images: Iterable[str], always: Iterable[str] = ()) -> ImagePrefetchResult:
+        """
+        :param images: Images to pull, duplicates are pulled once
+        :param always: Images pulled even when present locally
+        """
+        images = list(dict.fromkeys([normalize_image(i) for i in images]))  # Dedupe, keep the order
+        always = set([normalize_image(i) for i in always])
+
+        present = await self.__local_images([i for i in images if i not in always])
+        aggregator = ProgressAggregator(images, present)
+        result: ImagePrefetchResult = {'pulled': list(), 'skipped': [i for i in images if i in present], 'failed': dict()}
+        if result['skipped']:
+            self.__logger.debug("Images already present: %s" % ', '.join(result['skipped']))
+
+        semaphore = asyncio.Semaphore(self.__concurrency)
+
+        async def pull_bounded(image: str):
+            async with semaphore:
+                aggregator.start(image)
+                self.__report(aggregator)
+                try:
+                    await self.__pull(image, aggregator)
+                except Exception as e:
+                    self.__logger.error("Error pulling %s: %s" % (image, e))
+                    result['failed'][image] = str(e)
+                    aggregator.finish(image, False)
+                else:
+                    result['pulled'].append(image)
+                    aggregator.finish(image, True)
+                self.__report(aggregator)
+
+        await asyncio.gather(*[pull_bounded(i) for i in images if i not in present])
+        self.__report(aggregator, force=True)
+        return result
+
+    async def __local_images(self, images: list[str]) -> set[str]:
+        if len(images) == 0:
+            return set()
+        # Exits with an error when an image is missing, the images found are still listed
+        _, stdout, _ = await self.__run('image', 'inspect', *images)
+        return local_images_present(stdout, images)
+
+    async def __pull(self, image: str, aggregator: ProgressAggregator):
+        process = await asyncio.create_subprocess_exec(
+            self.__docker, 'pull', image, env=self.__env,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+
+        async def read_progress():
+            # docker does not end the lines with a newline when redrawing the progress on a terminal
+            while line := await process.stdout.readline():
+                if aggregator.update(line.decode('utf-8', errors='replace')):
+                    self.__report(aggregator)
+
+        try:
+            _, stderr = await asyncio.wait_for(asyncio.gather(read_progress(), process.stderr.read()), self.__timeout)
+            await process.wait()
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise Exception(f'Timeout after {self.__timeout} seconds')
+
+        if process.returncode != 0:
+            raise Exception(stderr.decode('utf-8', errors='replace').strip() or f'docker pull exit code {process.returncode}')
+
+    async def __run(self, *args: str) -> tuple[int, str, str]:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.__docker, *args, env=self.__env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            return 127, '', str(e)
+        stdout, stderr = await asyncio.wait_for(process.communicate(), self.__timeout)
+        return process.returncode, stdout.decode('utf-8', errors='replace'), stderr.decode('utf-8', errors='replace')
+
+    def __report(self, aggregator: ProgressAggregator, force=False):
+        if self.__progress_callback is None:
+            return
+        now = time.monotonic()
+        if force is False and now - self.__last_progress < self.__progress_interval:
+            return
+        self.__last_progress = now
+        try:
+            self.__progress_callback(aggregator.progress)
+        except Exception:
+            self.__logger.exception("Error in image prefetch progress callback")
+
+
+def format_progress(progress: ImagePrefetchProgress) -> str:
+    """
+    One line summary for the command line.
+    """
+    line = f"Images {progress['images_done']}/{progress['images_total']}"
+    if progress['images_skipped']:
+        line += f" ({progress['images_skipped']} present)"
+    if progress['images_failed']:
+        line += f", {progress['images_failed']} failed"
+    if progress['layers_total']:
+        line += f", layers {progress['layers_done']}/{progress['layers_total']}"
+    if progress['bytes_total']:
+        line += f", {progress['bytes_current'] / 1e6:.1f}/{progress['bytes_total'] / 1e6:.1f} MB"
+    return line
+
@@ -0,0 +1,129 @@
+"""
+Benchmark of certificate signing against a local fake certissuer.
+
+Compares the previous blocking approach (one synchronous HTTP POST per service, run on the event loop) with
+CertissuerClient (shared keep-alive session, bounded concurrency). Reports total renewal wall time and the
+longest event-loop stall observed by a heartbeat task.
+
+Usage: python3 test/bench_certissuer_signing.py [--services 20] [--latency 0.05] [--in-flight 4]
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+import urllib.request
+
+from aiohttp import web
+
+from millegrilles_instance.apps.CertissuerClient import CertissuerClient
+
+HEARTBEAT_INTERVAL = 0.005
+
+
+class FakeCertissuer:
+    """
+    Fake certissuer served from a separate thread, the blocking client would otherwise deadlock the event loop.
+    """
+
+    def __init__(self, latency: float):
+        self.__latency = latency
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, daemon=True)
+        self.url = None
+
+    async def __start(self):
+        async def signer_module(request: web.Request):
+            message = await request.json()
+            await asyncio.sleep(self.__latency)  # Simulates CSR signing on the certissuer
+            return web.json_response({'certificat': ['-----BEGIN CERTIFICATE-----\n', message['contenu']]})
+
+        app = web.Application()
+        app.router.add_post('/signerModule', signer_module)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        return runner, f"http://127.0.0.1:{port}"
+
+    def __enter__(self):
+        self.__thread.start()
+        self.__runner, self.url = asyncio.run_coroutine_threadsafe(self.__start(), self.__loop).result()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        asyncio.run_coroutine_threadsafe(self.__runner.cleanup(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+
+
+class LoopStallMonitor:
+
+    def __init__(self):
+        self.max_stall = 0.0
+        self.__task = None
+
+    async def __run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            stall = time.perf_counter() - start - HEARTBEAT_INTERVAL
+            self.max_stall = max(self.max_stall, stall)
+
+    def __enter__(self):
+        self.__task = asyncio.create_task(self.__run())
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__task.cancel()
+
+
+def blocking_post(url: str, message: dict) -> dict:
+    request = urllib.request.Request(url, data=json.dumps(message).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+async def bench_blocking(url: str, services: int) -> tuple[float, float]:
+    with LoopStallMonitor() as monitor:
+        await asyncio.sleep(HEARTBEAT_INTERVAL * 2)  # Let the monitor start
+        start = time.perf_counter()
+        for i in range(0, services):
+            # Previous behaviour: synchronous call made directly from the coroutine
+            blocking_post(f"{url}/signerModule", {'contenu': f'service_{i}'})
+            await asyncio.sleep(0)
+        duration = time.perf_counter() - start
+    return duration, monitor.max_stall
+
+
+async def bench_client(url: str, services: int, in_flight: int) -> tuple[float, float]:
+    with LoopStallMonitor() as monitor:
+        await asyncio.sleep(HEARTBEAT_INTERVAL * 2)
+        start = time.perf_counter()
+        async with CertissuerClient(url, max_in_flight=in_flight) as client:
+            await asyncio.gather(*[client.sign_module({'contenu': f'service_{i}'}) for i in range(0, services)])
+        duration = time.perf_counter() - start
+    return duration, monitor.max_stall
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Certissuer signing benchmark")
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help="Signing latency of the fake certissuer (seconds)")
+    parser.add_argument('--in-flight', type=int, default=4)
+    args = parser.parse_args()
+
+    with FakeCertissuer(args.latency) as certissuer:
+        blocking_duration, blocking_stall = await bench_blocking(certissuer.url, args.services)
+        client_duration, client_stall = await bench_client(certissuer.url, args.services, args.in_flight)
+
+    print(f"Services: {args.services}, certissuer latency: {args.latency * 1000:.0f} ms")
+    print(f"{'Mode':<20} {'Wall time (ms)':>15} {'Max loop stall (ms)':>20}")
+    print(f"{'blocking POST':<20} {blocking_duration * 1000:>15.1f} {blocking_stall * 1000:>20.1f}")
+    print(f"{'CertissuerClient':<20} {client_duration * 1000:>15.1f} {client_stall * 1000:>20.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Benchmark of the top processes scan.
+
+Builds a fake /proc with --processes entries, then measures ProcessScanner.read() on it. The same scan is measured on
+the real /proc of this host, and compared with psutil.process_iter() with a cpu_percent call per process (the Process
+object approach).
+
+Usage: python3 test/bench_proc_scanner.py [--processes 2000] [--iterations 20]
+"""
+import argparse
+import pathlib
+import tempfile
+import time
+
+import psutil
+
+from millegrilles_instance.ProcessStats import ProcessScanner
+
+STAT_TEMPLATE = '{pid} (worker {pid}) S 1 {pid} {pid} 0 -1 4194304 77 0 0 0 {utime} {stime} 0 0 20 0 1 0 {start} 2703360 286 ' \
+                '18446744073709551615 1 1 0 0 0 0 0 0 0 0 0 17 0 0 0 0 0 0 0 0 0 0 0 0 0\n'
+
+
+def build_fake_proc(root: pathlib.Path, processes: int):
+    for pid in range(1, processes + 1):
+        path = root / str(pid)
+        path.mkdir()
+        (path / 'stat').write_text(STAT_TEMPLATE.format(pid=pid, utime=pid, stime=0, start=1000 + pid))
+    (root / 'self').mkdir()  # Non numeric entries are skipped
+
+
+def touch_fake_proc(root: pathlib.Path, processes: int, iteration: int):
+    # One process in ten used some cpu
+    for pid in range(1, processes + 1, 10):
+        (root / str(pid) / 'stat').write_text(
+            STAT_TEMPLATE.format(pid=pid, utime=pid + iteration * pid % 97, stime=0, start=1000 + pid))
+
+
+def bench(label: str, func, iterations: int):
+    func()  # Warm up, first call only primes the cache
+    durations = list()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    print("%-40s median %7.2f ms, max %7.2f ms" % (label, durations[len(durations) // 2] * 1000, durations[-1] * 1000))
+
+
+def psutil_top(top: int):
+    processes = list()
+    for proc in psutil.process_iter(['pid', 'name', 'memory_info']):
+        try:
+            processes.append((proc.cpu_percent(interval=None), proc.info))
+        except psutil.Error:
+            pass
+    processes.sort(key=lambda p: p[0], reverse=True)
+    return processes[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=2000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        build_fake_proc(root, args.processes)
+        scanner = ProcessScanner(str(root))
+        scanner.read()
+        touch_fake_proc(root, args.processes, 1)
+        time.sleep(0.01)
+        top = scanner.read()
+        print("Fake /proc top process: %s" % top[0])
+        bench(f"ProcessScanner fake /proc ({args.processes})", scanner.read, args.iterations)
+
+    real_count = len([p for p in pathlib.Path('/proc').iterdir() if p.name.isdigit()])
+    scanner = ProcessScanner()
+    bench(f"ProcessScanner /proc ({real_count})", scanner.read, args.iterations)
+    bench(f"psutil.process_iter /proc ({real_count})", lambda: psutil_top(10), args.iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import json
+import stat
+import sys
+
+import pytest
+
+# systemctl stand-in: logs the start and end of each call, takes FAKE_SYSTEMCTL_DELAY seconds,
+# fails for the units listed in FAKE_SYSTEMCTL_FAIL
+FAKE_SYSTEMCTL = '''#!{python}
+import json, os, sys, time
+log = os.environ['FAKE_SYSTEMCTL_LOG']
+with open(log, 'a') as f:
+    f.write(json.dumps(['start', time.monotonic(), sys.argv[1:]]) + '\\n')
+time.sleep(float(os.environ.get('FAKE_SYSTEMCTL_DELAY') or 0))
+with open(log, 'a') as f:
+    f.write(json.dumps(['end', time.monotonic(), sys.argv[1:]]) + '\\n')
+if sys.argv[-1] in (os.environ.get('FAKE_SYSTEMCTL_FAIL') or '').split(','):
+    print('Job for %s failed.' % sys.argv[-1], file=sys.stderr)
+    sys.exit(1)
+'''
+
+
+@pytest.fixture
+def fake_executable(tmp_path, monkeypatch):
+    """
+    Writes stand-in executables. fake_executable(name, script) formats {python} in the script, sets FAKE_<NAME>_LOG
+    to the log file the script writes JSON lines to and returns (path, calls), calls() returning the parsed lines.
+    """
+    def create(name: str, script: str):
+        path = tmp_path / name
+        path.write_text(script.format(python=sys.executable))
+        path.chmod(path.stat().st_mode | stat.S_IXUSR)
+        log = tmp_path / f'{name}.log'
+        log.touch()
+        monkeypatch.setenv(f'FAKE_{name.upper()}_LOG', str(log))
+
+        def calls():
+            return [json.loads(line) for line in log.read_text().splitlines()]
+
+        return str(path), calls
+
+    return create
+
+
+@pytest.fixture
+def fake_systemctl(fake_executable, monkeypatch):
+    monkeypatch.setenv('FAKE_SYSTEMCTL_DELAY', '0.3')
+    return fake_executable('systemctl', FAKE_SYSTEMCTL)
+
+
+# docker stand-in for image pulls: image inspect lists the images of FAKE_DOCKER_IMAGES (tags or digests), pull logs
+# its start and end, prints the progress of a layer shared by all images and of a layer of its own, takes
+# FAKE_DOCKER_DELAY seconds and fails for the images listed in FAKE_DOCKER_PULL_FAIL
+FAKE_DOCKER_PULL = '''#!{python}
+import hashlib, json, os, sys, time
+local = (os.environ.get('FAKE_DOCKER_IMAGES') or '').split(',')
+if sys.argv[1:3] == ['image', 'inspect']:
+    found = [r for r in sys.argv[3:] if r in local]
+    print(json.dumps([{{'RepoTags': [r] if '@' not in r else [], 'RepoDigests': [r] if '@' in r else []}} for r in found]))
+    sys.exit(0 if len(found) == len(sys.argv[3:]) else 1)
+image = sys.argv[2]
+log = os.environ['FAKE_DOCKER_LOG']
+with open(log, 'a') as f:
+    f.write(json.dumps(['start', time.monotonic(), sys.argv[1:]]) + '\\n')
+layers = ['a' * 12, hashlib.sha256(image.encode()).hexdigest()[:12]]
+for layer in layers:
+    print(layer + ': Pulling fs layer', flush=True)
+for layer in layers:
+    print(layer + ': Downloading [=====>     ]  1.5MB/3MB', flush=True)
+time.sleep(float(os.environ.get('FAKE_DOCKER_DELAY') or 0))
+if image in (os.environ.get('FAKE_DOCKER_PULL_FAIL') or '').split(','):
+    print('manifest unknown', file=sys.stderr)
+    sys.exit(1)
+for layer in layers:
+    print(layer + ': Download complete', flush=True)
+    print(layer + ': Pull complete', flush=True)
+print('Status: Downloaded newer image for ' + image)
+with open(log, 'a') as f:
+    f.write(json.dumps(['end', time.monotonic(), sys.argv[1:]]) + '\\n')
+'''
+
+
+@pytest.fixture
+def fake_docker_pull(fake_executable):
+    return fake_executable('docker', FAKE_DOCKER_PULL)
@@ -0,0 +1,103 @@
+import asyncio
+import struct
+
+from millegrilles_instance.ApcUps import ApcUpsClient, parse_status_line
+
+STATUS_LINES = [
+    'APC      : 001,036,0879\n',
+    'UPSNAME  : ups1\n',
+    'STATUS   : ONLINE \n',
+    'LINEV    : 121.0 Volts\n',
+    'LOADPCT  : 12.0 Percent\n',
+    'TIMELEFT : 45.5 Minutes\n',
+    'END APC  : 2024-01-01 12:00:00 -0500\n',
+]
+
+
+def test_parse_status_line():
+    assert parse_status_line('LINEV    : 121.0 Volts\n') == ('LINEV', '121.0')
+    assert parse_status_line('LOADPCT  : 12.0 Percent Load Capacity\n') == ('LOADPCT', '12.0')
+    assert parse_status_line('STATUS   : ONLINE \n') == ('STATUS', 'ONLINE')
+    assert parse_status_line('LASTXFER : Automatic or explicit self test\n') == ('LASTXFER', 'Automatic or explicit self test')
+    assert parse_status_line('APC      : 001,036,0879\n') is None  # Not published
+    assert parse_status_line('garbage') is None
+
+
+class FakeNis:
+    """ apcupsd NIS answering the status command, counts the connections. """
+
+    def __init__(self):
+        self.connections = 0
+        self.server = None
+        self.port = None
+
+    async def start(self, port=0):
+        self.server = await asyncio.start_server(self.__handle, '127.0.0.1', port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                length = struct.unpack('>H', await reader.readexactly(2))[0]
+                assert await reader.readexactly(length) == b'status'
+                for line in STATUS_LINES:
+                    encoded = line.encode('utf-8')
+                    writer.write(struct.pack('>H', len(encoded)) + encoded)
+                writer.write(struct.pack('>H', 0))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+
+def test_persistent_connection():
+    async def run():
+        nis = FakeNis()
+        await nis.start()
+        client = ApcUpsClient('127.0.0.1', nis.port, poll_interval=1)
+        try:
+            for _ in range(3):
+                status = await client.read_status()
+            assert status == {'UPSNAME': 'ups1', 'STATUS': 'ONLINE', 'LINEV': '121.0', 'LOADPCT': '12.0',
+                              'TIMELEFT': '45.5'}
+            assert client.status == status
+            assert nis.connections == 1
+        finally:
+            await client.close()
+            await nis.stop()
+
+    asyncio.run(run())
+
+
+def test_daemon_started_later():
+    async def run():
+        nis = FakeNis()
+        await nis.start()
+        port = nis.port
+        await nis.stop()  # Port now known to be free, daemon not started yet
+
+        stopping = asyncio.Event()
+        client = ApcUpsClient('127.0.0.1', port, poll_interval=0.05, min_backoff=0.05, max_backoff=0.1)
+        task = asyncio.create_task(client.run(stopping))
+        await asyncio.sleep(0.2)
+        assert client.status is None
+
+        nis = FakeNis()
+        await nis.start(port)
+        for _ in range(50):
+            if client.status is not None:
+                break
+            await asyncio.sleep(0.05)
+        assert client.status['STATUS'] == 'ONLINE'
+
+        stopping.set()
+        await asyncio.wait_for(task, 1)
+        await nis.stop()
+
+    asyncio.run(run())
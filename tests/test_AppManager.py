@@ -0,0 +1,153 @@
+import asyncio
+import json
+import pathlib
+
+from types import SimpleNamespace
+
+from millegrilles_instance import Constantes as ConstantesInstance
+from millegrilles_instance.apps.AppManager import AppManager
+
+
+class FakeProducer:
+
+    def __init__(self):
+        self.events = list()
+
+    async def event(self, message, domain, action, partition=None, exchange=None):
+        self.events.append((action, message))
+
+
+class FakeContext:
+    """
+    Context with the file watcher and scheduler callbacks exposed to the test.
+    """
+
+    def __init__(self, root: pathlib.Path):
+        self.configuration = SimpleNamespace(path_millegrilles=root)
+        self.securite = '3.protege'
+        self.instance_id = 'instance1'
+        self.producer = FakeProducer()
+        self.producer_ready = True
+        self.file_watcher = SimpleNamespace(watch=self.__watch)
+        self.scheduler = SimpleNamespace(add_job=self.__add_job)
+        self.file_changed = None
+        self.jobs = dict()
+        self.__stop_event = asyncio.Event()
+
+    def __watch(self, paths, callback):
+        self.file_changed = lambda: callback(set(paths))
+
+    def __add_job(self, name, interval, callback, **kwargs):
+        self.jobs[name] = callback
+
+    async def get_producer(self):
+        if not self.producer_ready:
+            await asyncio.Event().wait()  # Never ready
+        return self.producer
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.__stop_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stop(self):
+        self.__stop_event.set()
+
+
+def write_applications(root: pathlib.Path, content):
+    path = root / 'etc' / 'installed_applications.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content if isinstance(content, str) else json.dumps(content))
+
+
+def run_app_manager(root: pathlib.Path, steps, producer_ready=True):
+    """
+    Runs the AppManager with a fake context, steps(context, manager) drives the file changes and heartbeats.
+    """
+    async def run():
+        context = FakeContext(root)
+        context.producer_ready = producer_ready
+        manager = AppManager(context)
+        await manager.setup()
+        task = asyncio.create_task(manager.run())
+        try:
+            await asyncio.sleep(0.05)  # Initial load
+            await steps(context, manager)
+        finally:
+            context.stop()
+            await asyncio.wait_for(task, 1)
+        return context
+
+    return asyncio.run(run())
+
+
+def actions(context: FakeContext) -> list[str]:
+    return [action for action, _ in context.producer.events]
+
+
+def test_full_list_only_sent_on_change(tmp_path):
+    write_applications(tmp_path, {'app1': {'version': '1.0'}})
+
+    async def steps(context: FakeContext, manager: AppManager):
+        await context.jobs['application_list'](context.producer)
+        # Written again with the same content, e.g. manage_apps install of the same version
+        write_applications(tmp_path, {'app1': {'version': '1.0'}})
+        context.file_changed()
+        await asyncio.sleep(0.05)
+        await context.jobs['application_list'](context.producer)
+
+        write_applications(tmp_path, {'app1': {'version': '2.0'}})
+        context.file_changed()
+        await asyncio.sleep(0.05)
+
+    context = run_app_manager(tmp_path, steps)
+    assert actions(context) == [
+        ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_V2,
+        ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_HASH,
+        ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_HASH,
+        ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_V2,
+    ]
+    full_list, heartbeat = context.producer.events[0][1], context.producer.events[1][1]
+    assert full_list['applications'] == {'app1': {'version': '1.0'}}
+    assert heartbeat == {'hash': full_list['hash']}
+    assert context.producer.events[3][1]['applications'] == {'app1': {'version': '2.0'}}
+
+
+def test_heartbeat_sends_list_not_published(tmp_path):
+    write_applications(tmp_path, {'app1': {'version': '1.0'}})
+
+    async def steps(context: FakeContext, manager: AppManager):
+        await asyncio.sleep(1.1)  # Producer wait timed out on the initial load
+        assert context.producer.events == []
+        await context.jobs['application_list'](context.producer)
+        await context.jobs['application_list'](context.producer)
+
+    context = run_app_manager(tmp_path, steps, producer_ready=False)
+    assert actions(context) == [
+        ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_V2,
+        ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_HASH,
+    ]
+
+
+def test_invalid_file_keeps_previous_list(tmp_path):
+    write_applications(tmp_path, {'app1': {'version': '1.0'}})
+
+    async def steps(context: FakeContext, manager: AppManager):
+        initial = await manager.get_installed_applications()
+        write_applications(tmp_path, '{"app1": ')  # Partial write
+        context.file_changed()
+        await asyncio.sleep(0.05)
+        assert await manager.get_installed_applications() == initial
+
+    context = run_app_manager(tmp_path, steps)
+    assert actions(context) == [ConstantesInstance.EVENEMENT_PRESENCE_INSTANCE_APPLICATIONS_V2]
+
+
+def test_no_applications_file(tmp_path):
+    async def steps(context: FakeContext, manager: AppManager):
+        assert (await manager.get_installed_applications())['ok'] is False
+        await context.jobs['application_list'](context.producer)
+
+    context = run_app_manager(tmp_path, steps)
+    assert context.producer.events == []
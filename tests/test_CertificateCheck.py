@@ -0,0 +1,93 @@
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+import pytest
+
+from millegrilles_instance import Constantes as ConstantesInstance
+from millegrilles_instance.CertificateCheck import check_certificates_due
+from millegrilles_instance.apps.CertificateIndex import CertificateExpiryIndex, file_stamp
+
+PACKAGE_ROOT = pathlib.Path(__file__).parent.parent
+DAY = 86400
+
+
+@pytest.fixture
+def instance_root(tmp_path):
+    """ Instance where the last renewal pass left nothing to do. """
+    (tmp_path / 'secrets').mkdir()
+    (tmp_path / 'etc' / 'compose').mkdir(parents=True)
+    compose_file = tmp_path / 'etc' / 'compose' / 'applications.yml'
+    compose_file.write_text('include: []\n')
+    cert_file = tmp_path / 'secrets' / 'redis.cert.pem'
+    cert_file.write_text('cert')
+    manager_file = tmp_path / 'secrets' / 'manager.pem'
+    manager_file.write_text('manager')
+    (tmp_path / 'secrets' / 'redis.txt').write_text('password')
+
+    now = time.time()
+    index = CertificateExpiryIndex(tmp_path / 'var' / ConstantesInstance.FICHIER_CERTIFICATE_INDEX)
+    index.get(cert_file, lambda p: (now - DAY, now + 30 * DAY, False))
+    manager_stamp = file_stamp(manager_file)
+    index.summary = {
+        'sources': {str(compose_file): file_stamp(compose_file)},
+        'certificates': [str(cert_file)],
+        'passwords': [str(tmp_path / 'secrets' / 'redis.txt')],
+        'manager': {'path': str(manager_file), 'mtime_ns': manager_stamp[0], 'size': manager_stamp[2],
+                    'not_after': now + 30 * DAY},
+    }
+    index.save()
+    return tmp_path
+
+
+def test_nothing_due(instance_root):
+    assert check_certificates_due(instance_root) is None
+
+
+def test_no_index(tmp_path):
+    assert check_certificates_due(tmp_path) is not None
+
+
+def test_compose_change_escalates(instance_root):
+    compose_file = instance_root / 'etc' / 'compose' / 'applications.yml'
+    compose_file.write_text('include:\n  - applications/new_app.yml\n')
+    assert 'compose file changed' in check_certificates_due(instance_root)
+
+
+def test_missing_password_escalates(instance_root):
+    os.unlink(instance_root / 'secrets' / 'redis.txt')
+    assert 'password missing' in check_certificates_due(instance_root)
+
+
+def test_expired_certificate_escalates(instance_root):
+    index_path = instance_root / 'var' / ConstantesInstance.FICHIER_CERTIFICATE_INDEX
+    index = CertificateExpiryIndex.load(index_path)
+    cert_file = instance_root / 'secrets' / 'redis.cert.pem'
+    index.refresh(cert_file, lambda p: (time.time() - 2 * DAY, time.time() - 1, True))
+    index.save()
+    assert 'certificate expired' in check_certificates_due(instance_root)
+
+
+def test_startup_time_benchmark(instance_root):
+    """ The check must exit well under 100 ms when nothing is due, without importing the heavy modules. """
+    script = (
+        "import sys, time; start = time.perf_counter(); "
+        "from millegrilles_instance.CertificateCheck import main; main(); "
+        "heavy = [m for m in ('yaml', 'aiohttp', 'cryptography', 'pika', 'millegrilles_messages') if m in sys.modules]; "
+        "print('%.1f' % ((time.perf_counter() - start) * 1000), ','.join(heavy))"
+    )
+    env = dict(os.environ, PYTHONPATH=str(PACKAGE_ROOT))
+    durations = list()
+    for _ in range(0, 5):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', script, '--config', str(instance_root), '--init'],
+                                env=env, capture_output=True, text=True, check=True)
+        durations.append(time.perf_counter() - start)
+        in_process_ms, heavy_modules = (result.stdout.strip().split(' ') + [''])[:2]
+        assert heavy_modules == ''
+        assert float(in_process_ms) < 100
+
+    print(f"CertificateCheck process wall time: best {min(durations) * 1000:.1f} ms, worst {max(durations) * 1000:.1f} ms")
+    assert min(durations) < 0.5  # Includes interpreter startup, generous for loaded CI hosts
@@ -0,0 +1,129 @@
+import os
+import time
+
+import pytest
+
+from millegrilles_instance import Constantes as ConstantesInstance
+from millegrilles_instance.apps.CertificateIndex import CertificateExpiryIndex
+
+
+DAY = 86400
+
+
+@pytest.fixture
+def cert_file(tmp_path):
+    path = tmp_path / 'secrets' / 'redis.cert.pem'
+    path.parent.mkdir()
+    path.write_text('cert v1')
+    return path
+
+
+def make_loader(not_before: float, not_after: float, renew_now: bool = False):
+    calls = list()
+
+    def loader(path):
+        calls.append(path)
+        return not_before, not_after, renew_now
+
+    return loader, calls
+
+
+def test_unchanged_file_is_not_parsed_again(tmp_path, cert_file):
+    now = time.time()
+    loader, calls = make_loader(now - DAY, now + 30 * DAY)
+    index = CertificateExpiryIndex(tmp_path / 'index.json')
+
+    index.get(cert_file, loader)
+    index.get(cert_file, loader)
+    assert len(calls) == 1
+
+    # Changing the file invalidates the entry
+    cert_file.write_text('cert version 2')
+    index.get(cert_file, loader)
+    assert len(calls) == 2
+
+
+def test_persisted_index_is_reused(tmp_path, cert_file):
+    now = time.time()
+    loader, calls = make_loader(now - DAY, now + 30 * DAY)
+    index_path = tmp_path / 'var' / 'index.json'
+
+    index = CertificateExpiryIndex(index_path)
+    entry = index.get(cert_file, loader)
+    index.save()
+
+    reloaded = CertificateExpiryIndex.load(index_path)
+    assert reloaded.get(cert_file, loader) == entry
+    assert len(calls) == 1
+    assert reloaded.next_deadline() == entry['renew_at']
+
+
+def test_renew_threshold(tmp_path, cert_file):
+    now = time.time()
+    loader, _ = make_loader(now - DAY, now + 29 * DAY)
+    index = CertificateExpiryIndex(tmp_path / 'index.json')
+    entry = index.get(cert_file, loader)
+    expected = now - DAY + 30 * DAY * ConstantesInstance.CERTIFICATE_RENEW_RATIO
+    assert entry['renew_at'] == pytest.approx(expected)
+
+    # The certificate library asks for renewal: due immediately
+    loader, _ = make_loader(now - DAY, now + 29 * DAY, renew_now=True)
+    entry = index.refresh(cert_file, loader)
+    assert entry['renew_at'] <= time.time()
+
+
+def test_deadline_heap_and_prune(tmp_path, cert_file):
+    now = time.time()
+    other_file = cert_file.with_name('mq.cert.pem')
+    other_file.write_text('mq')
+    index = CertificateExpiryIndex(tmp_path / 'index.json')
+
+    index.get(cert_file, make_loader(now - DAY, now + 60 * DAY)[0])
+    soon = index.get(other_file, make_loader(now - 60 * DAY, now + 3 * DAY)[0])
+    assert index.next_deadline() == soon['renew_at']
+
+    index.prune([cert_file])
+    assert str(other_file) not in index.entries
+    assert index.next_deadline() == index.entries[str(cert_file)]['renew_at']
+
+
+def test_missing_file_removes_entry(tmp_path, cert_file):
+    now = time.time()
+    index = CertificateExpiryIndex(tmp_path / 'index.json')
+    index.get(cert_file, make_loader(now, now + DAY)[0])
+    os.unlink(cert_file)
+    with pytest.raises(FileNotFoundError):
+        index.get(cert_file, make_loader(now, now + DAY)[0])
+    assert index.next_deadline() is None
+
+
+def test_failed_renewal_is_delayed(tmp_path, cert_file):
+    now = time.time()
+    retry = ConstantesInstance.CERTIFICATE_RENEW_RETRY
+    other_file = cert_file.with_name('mq.cert.pem')
+    other_file.write_text('mq v1')
+    index = CertificateExpiryIndex(tmp_path / 'index.json')
+    due = make_loader(now - 29 * DAY, now + DAY, renew_now=True)[0]
+    index.get(cert_file, due)
+    index.get(other_file, due)
+    assert index.next_deadline() <= time.time()
+
+    # One certificate renewed, signing failed for the other one: the next pass waits for the retry delay
+    other_file.write_text('mq v2')
+    index.get(other_file, make_loader(now, now + 30 * DAY)[0])
+    index.renewal_failed(cert_file)
+    assert index.next_deadline() == pytest.approx(time.time() + retry, abs=5)
+
+    # Still failing when due again: the delay doubles, up to the maximum check delay
+    index.refresh(cert_file, due)
+    index.renewal_failed(cert_file)
+    assert index.entries[str(cert_file)]['failures'] == 2
+    assert index.next_deadline() == pytest.approx(time.time() + 2 * retry, abs=5)
+    for _ in range(0, 10):
+        index.renewal_failed(cert_file)
+    assert index.next_deadline() <= time.time() + ConstantesInstance.CERTIFICATE_CHECK_MAX_DELAY
+
+    # Renewed file: back to the normal threshold
+    cert_file.write_text('cert v2')
+    entry = index.get(cert_file, make_loader(now, now + 30 * DAY)[0])
+    assert entry['failures'] == 0
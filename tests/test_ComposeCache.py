@@ -0,0 +1,65 @@
+import os
+import pathlib
+
+from millegrilles_instance.apps.ComposeCache import ComposeFileCache
+
+REPO_COMPOSE_PATH = pathlib.Path(__file__).parent.parent / 'etc' / 'compose'
+
+
+def write_tree(tmp_path: pathlib.Path):
+    (tmp_path / 'apps').mkdir()
+    (tmp_path / 'applications.yml').write_text('include:\n  - apps/a.yml\n  - path: apps/b.yml\n')
+    (tmp_path / 'apps' / 'a.yml').write_text('services:\n  a:\n    image: a\n')
+    (tmp_path / 'apps' / 'b.yml').write_text('services:\n  b:\n    image: b\n')
+
+
+def touch(path: pathlib.Path, content: str):
+    stat = os.stat(path)
+    path.write_text(content)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_load_includes(tmp_path):
+    write_tree(tmp_path)
+    cache = ComposeFileCache()
+    content = cache.load(tmp_path / 'applications.yml')
+
+    includes = content['x-include-content']
+    assert list(includes.keys()) == [(tmp_path / 'apps' / 'a.yml').resolve(), (tmp_path / 'apps' / 'b.yml').resolve()]
+    assert includes[(tmp_path / 'apps' / 'b.yml').resolve()]['services']['b']['image'] == 'b'
+    assert cache.parses == 3
+
+
+def test_unchanged_tree_is_reused(tmp_path):
+    write_tree(tmp_path)
+    cache = ComposeFileCache()
+    first = cache.load(tmp_path / 'applications.yml')
+    second = cache.load(tmp_path / 'applications.yml')
+    assert first is second
+    assert cache.parses == 3
+
+
+def test_changed_include_only_reparses_that_file(tmp_path):
+    write_tree(tmp_path)
+    cache = ComposeFileCache()
+    path_a = (tmp_path / 'apps' / 'a.yml').resolve()
+    path_b = (tmp_path / 'apps' / 'b.yml').resolve()
+    first = cache.load(tmp_path / 'applications.yml')
+
+    touch(path_b, 'services:\n  b:\n    image: b2\n')
+    second = cache.load(tmp_path / 'applications.yml')
+
+    assert cache.parses == 4
+    assert second is not first
+    assert second['x-include-content'][path_a] is first['x-include-content'][path_a]
+    assert second['x-include-content'][path_b]['services']['b']['image'] == 'b2'
+
+
+def test_repo_compose_files():
+    cache = ComposeFileCache()
+    content = cache.load(REPO_COMPOSE_PATH / 'middleware' / 'node-protege.yml')
+    services = set()
+    for include in content['x-include-content'].values():
+        services.update((include.get('services') or dict()).keys())
+    assert {'mq', 'mongo', 'redis', 'midcompte'}.issubset(services)
+    assert len(cache.stamps(REPO_COMPOSE_PATH / 'middleware' / 'node-protege.yml')) == len(content['include']) + 1
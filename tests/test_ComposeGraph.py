@@ -0,0 +1,53 @@
+import pathlib
+
+import pytest
+
+from millegrilles_instance.apps.ComposeCache import ComposeFileCache
+from millegrilles_instance.apps.ComposeGraph import ComposeDependencyGraph, service_dependencies
+
+REPO_COMPOSE_PATH = pathlib.Path(__file__).parent.parent / 'etc' / 'compose'
+
+
+def test_service_dependencies():
+    assert service_dependencies(None) == set()
+    assert service_dependencies({'depends_on': ['a', 'b']}) == {'a', 'b'}
+    assert service_dependencies({
+        'depends_on': {'a': {'condition': 'service_healthy'}},
+        'links': ['b:alias', 'c'],
+        'network_mode': 'service:d',
+    }) == {'a', 'b', 'c', 'd'}
+    assert service_dependencies({'network_mode': 'host'}) == set()
+
+
+def test_repo_middleware_waves():
+    graph = ComposeDependencyGraph.build([
+        REPO_COMPOSE_PATH / 'middleware' / 'node-protege.yml',
+        REPO_COMPOSE_PATH / 'include' / 'protege_service_deps.yml',
+    ], ComposeFileCache())
+    assert {'mq', 'redis', 'midcompte', 'ceduleur', 'nginx'}.issubset(graph.services)
+    assert graph.dependencies('ceduleur') == {'redis', 'mq', 'midcompte'}
+    assert 'ceduleur' in graph.dependents('midcompte')
+
+    assert graph.restart_waves(['ceduleur', 'midcompte', 'mq', 'nginx']) == [['mq', 'nginx'], ['midcompte'], ['ceduleur']]
+    # Dependents are not added, unaffected dependencies are not restarted
+    assert graph.restart_waves(['redis']) == [['redis']]
+    assert graph.stop_waves(['ceduleur', 'mq']) == [['ceduleur'], ['mq']]
+
+
+def test_order_through_unrequested_service():
+    graph = ComposeDependencyGraph()
+    graph.add_service('app', ['api'])
+    graph.add_service('api', ['db'])
+    graph.add_service('db', [])
+    graph.add_service('other', [])
+    # api is not restarted but app still waits for db
+    assert graph.restart_waves(['app', 'db', 'other', 'unknown']) == [['db', 'other', 'unknown'], ['app']]
+
+
+def test_cycle():
+    graph = ComposeDependencyGraph()
+    graph.add_service('a', ['b'])
+    graph.add_service('b', ['c'])
+    graph.add_service('c', ['a'])
+    with pytest.raises(ValueError, match='a -> b -> c -> a'):
+        graph.restart_waves(['a'])
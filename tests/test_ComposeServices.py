@@ -0,0 +1,92 @@
+import asyncio
+import pathlib
+
+import pytest
+
+from subprocess import CalledProcessError
+
+from millegrilles_instance.apps.ComposeCache import ComposeFileCache
+from millegrilles_instance.apps.ComposeServices import ComposeServiceIndex, compose_restart, group_by_project
+
+REPO_COMPOSE_PATH = pathlib.Path(__file__).parent.parent / 'etc' / 'compose'
+
+# docker stand-in: logs its arguments, fails when FAKE_DOCKER_FAIL is set
+FAKE_DOCKER = '''#!{python}
+import json, os, sys
+with open(os.environ['FAKE_DOCKER_LOG'], 'a') as f:
+    f.write(json.dumps(sys.argv[1:]) + '\\n')
+if os.environ.get('FAKE_DOCKER_FAIL'):
+    print('service not running', file=sys.stderr)
+    sys.exit(1)
+'''
+
+
+def repo_index() -> ComposeServiceIndex:
+    return ComposeServiceIndex.build([
+        REPO_COMPOSE_PATH / 'middleware' / 'node-protege.yml',
+        REPO_COMPOSE_PATH / 'include' / 'protege_service_deps.yml',
+        REPO_COMPOSE_PATH / 'applications.yml',
+        REPO_COMPOSE_PATH / 'missing.yml',
+    ], ComposeFileCache())
+
+
+def test_repo_projects():
+    index = repo_index()
+    middleware = (REPO_COMPOSE_PATH / 'middleware' / 'node-protege.yml').resolve()
+    assert index.get('redis')['project_file'] == middleware
+    assert index.get('redis')['compose_file'] == (REPO_COMPOSE_PATH / 'coremodules' / 'redis.yml').resolve()
+    assert index.get('mq')['project_file'] == middleware
+    # Included by the service deps file, run from their own file by the systemd units
+    assert index.get('nginx')['project_file'] == (REPO_COMPOSE_PATH / 'coremodules' / 'nginx.yml').resolve()
+    assert index.get('certissuer')['project_file'] == (REPO_COMPOSE_PATH / 'coremodules' / 'certissuer.yml').resolve()
+    assert index.get('redis')['certificate'] is True
+
+
+def test_certificate_services():
+    index = repo_index()
+    assert [s['name'] for s in index.certificate_services('redis')] == ['redis']
+    assert [s['name'] for s in index.certificate_services('nginx')] == ['nginx']
+    assert index.certificate_services('unknown') == []
+
+
+def test_certificate_mounted_by_other_service(tmp_path):
+    (tmp_path / 'app.yml').write_text('''
+name: apps
+include:
+  - other.yml
+services:
+  app:
+    x-millegrilles-certificat:
+      roles: [app]
+      split: true
+    secrets: [app_key]
+  app_sidecar:
+    configs:
+      - source: app_cert
+        target: /run/secrets/cert.pem
+secrets:
+  app_key:
+    file: ${MILLEGRILLES_ROOT}/secrets/app.key.pem
+''')
+    # Top-level config declared in another file of the project
+    (tmp_path / 'other.yml').write_text('''
+configs:
+  app_cert:
+    file: ${MILLEGRILLES_ROOT}/secrets/app.cert.pem
+''')
+    index = ComposeServiceIndex.build([tmp_path / 'app.yml'], ComposeFileCache())
+    services = index.certificate_services('app')
+    assert [s['name'] for s in services] == ['app', 'app_sidecar']
+    assert group_by_project(services + services) == {(tmp_path / 'app.yml').resolve(): ['app', 'app_sidecar']}
+
+
+def test_compose_restart(fake_executable, tmp_path, monkeypatch):
+    docker, calls = fake_executable('docker', FAKE_DOCKER)
+    project_file = tmp_path / 'node-protege.yml'
+    asyncio.run(compose_restart(project_file, ['redis', 'mq'], docker, cwd=tmp_path))
+    assert calls() == [['compose', '-f', str(project_file), 'restart', 'redis', 'mq']]
+
+    monkeypatch.setenv('FAKE_DOCKER_FAIL', '1')
+    with pytest.raises(CalledProcessError) as e:
+        asyncio.run(compose_restart(project_file, ['redis'], docker, cwd=tmp_path))
+    assert 'service not running' in e.value.stderr
@@ -0,0 +1,47 @@
+from millegrilles_instance.ConfigurationDiff import FileDigests, diff_env, reload_action, \
+    RELOAD_BUS, RELOAD_NONE, RELOAD_RUNLEVEL
+
+
+def make_diff(full=False, config_env=None, certificate=False, ca=False):
+    return {'full': full, 'config_env': config_env or dict(), 'certificate': certificate, 'ca': ca}
+
+
+def test_diff_env():
+    previous = {'INSTANCE_NAME': 'a', 'HTTP_PORT': '80', 'REMOVED': 'x'}
+    current = {'INSTANCE_NAME': 'a', 'HTTP_PORT': '8080', 'ADDED': 'y'}
+    assert diff_env(previous, current) == {
+        'HTTP_PORT': ('80', '8080'),
+        'REMOVED': ('x', None),
+        'ADDED': (None, 'y'),
+    }
+    assert diff_env(current, dict(current)) == dict()
+
+
+def test_file_digests(tmp_path):
+    config = tmp_path / 'config.env'
+    pem = tmp_path / 'manager.pem'
+    config.write_text('A=1\n')
+
+    digests = FileDigests()
+    assert digests.update([config, pem]) == {config, pem}  # First read
+    assert digests.update([config, pem]) == set()
+
+    config.write_text('A=1\n')  # Same content rewritten
+    assert digests.update([config]) == set()
+
+    config.write_text('A=2\n')
+    pem.write_text('pem')  # Created
+    assert digests.update([config, pem]) == {config, pem}
+
+    pem.unlink()
+    assert digests.update([pem]) == {pem}
+
+
+def test_reload_action():
+    assert reload_action(make_diff(full=True, certificate=True)) is None  # Handled by the runlevels
+    assert reload_action(make_diff(config_env={'SYSTEM_STATUS_DELTA': ('1', '0')})) == RELOAD_NONE
+    assert reload_action(make_diff(certificate=True)) == RELOAD_BUS
+    assert reload_action(make_diff(ca=True)) == RELOAD_BUS
+    assert reload_action(make_diff(config_env={'MQ_URL': ('mq1', 'mq2')})) == RELOAD_BUS
+    assert reload_action(make_diff(config_env={'INSTANCE_NAME': ('a', 'b'), 'DOCKER': (None, 'podman')},
+                                   certificate=True)) == RELOAD_RUNLEVEL
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from millegrilles_instance import ContainerStats
+from millegrilles_instance.ContainerStats import ContainerStatsCollector
+
+MONGO_ID = 'a' * 64
+MONGO2_ID = 'b' * 64
+OTHER_ID = 'c' * 64
+
+
+def write_container(docker_root, container_id, project, service, running=True):
+    path = docker_root / 'containers' / container_id
+    path.mkdir(parents=True, exist_ok=True)
+    config = {
+        'ID': container_id,
+        'Config': {'Labels': {'com.docker.compose.project': project, 'com.docker.compose.service': service}},
+        'State': {'Running': running},
+    }
+    (path / 'config.v2.json').write_text(json.dumps(config))
+
+
+def write_cgroup(cgroup_root, container_id, usage_usec, memory, rbytes, wbytes):
+    path = cgroup_root / 'system.slice' / f'docker-{container_id}.scope'
+    path.mkdir(parents=True, exist_ok=True)
+    (path / 'cpu.stat').write_text(f'usage_usec {usage_usec}\nuser_usec 0\nsystem_usec 0\n')
+    (path / 'memory.current').write_text(f'{memory}\n')
+    (path / 'io.stat').write_text(f'8:0 rbytes={rbytes} wbytes={wbytes} rios=10 wios=20 dbytes=0 dios=0\n'
+                                  f'8:16 rbytes={rbytes} wbytes=0 rios=0 wios=0 dbytes=0 dios=0\n')
+
+
+@pytest.fixture
+def roots(tmp_path):
+    docker_root = tmp_path / 'docker'
+    cgroup_root = tmp_path / 'cgroup'
+    cgroup_root.mkdir()
+    (cgroup_root / 'cgroup.controllers').write_text('cpu io memory pids\n')
+    write_container(docker_root, MONGO_ID, 'prod-middleware', 'mongo')
+    write_container(docker_root, MONGO2_ID, 'prod-middleware', 'mongo')
+    write_container(docker_root, OTHER_ID, 'other-middleware', 'mongo')
+    for container_id in (MONGO_ID, MONGO2_ID, OTHER_ID):
+        write_cgroup(cgroup_root, container_id, 1_000_000, 1000, 0, 0)
+    return docker_root, cgroup_root
+
+
+def test_collect_per_service(roots, monkeypatch):
+    docker_root, cgroup_root = roots
+    clock = [100.0]
+    monkeypatch.setattr(ContainerStats.time, 'monotonic', lambda: clock[0])
+
+    collector = ContainerStatsCollector('prod-', docker_root, cgroup_root)
+    assert collector.enabled
+
+    stats = collector.read()
+    assert len(stats) == 1
+    assert stats[0]['service'] == 'mongo' and stats[0]['containers'] == 2
+    assert stats[0]['memory_bytes'] == 2000
+    assert stats[0]['cpu_percent'] == 0.0
+
+    clock[0] += 10
+    write_cgroup(cgroup_root, MONGO_ID, 6_000_000, 3000, 1_000_000, 2_000_000)  # 5 cpu seconds in 10 seconds
+    stats = collector.read()
+    assert stats[0]['cpu_percent'] == 50.0
+    assert stats[0]['memory_bytes'] == 4000
+    assert stats[0]['read_bytes_per_sec'] == 200_000.0  # Summed over devices
+    assert stats[0]['write_bytes_per_sec'] == 200_000.0
+
+    # Stopped container
+    write_container(docker_root, MONGO2_ID, 'prod-middleware', 'mongo', running=False)
+    clock[0] += 10
+    assert collector.read()[0]['containers'] == 1
+
+
+def test_disabled_without_cgroup_v2(tmp_path):
+    (tmp_path / 'docker' / 'containers').mkdir(parents=True)
+    collector = ContainerStatsCollector('prod-', tmp_path / 'docker', tmp_path / 'cgroup')
+    assert collector.enabled is False
+    assert collector.read() == list()
@@ -0,0 +1,150 @@
+import asyncio
+
+from types import SimpleNamespace
+
+from millegrilles_instance.apps import CsrPool as CsrPoolModule
+from millegrilles_instance.apps.CsrPool import CsrPool
+
+
+class FakeContext:
+
+    def __init__(self, instance_id='instance1', idmg='idmg1'):
+        self.configuration = SimpleNamespace(instance_id=instance_id, idmg=idmg)
+        self.stopping = False
+        self.reload_listeners = list()
+        self.__stop_event = asyncio.Event()
+
+    def add_reload_listener(self, listener):
+        self.reload_listeners.append(listener)
+
+    def reloaded(self, full=False, certificate=False):
+        """
+        Calls the reload listeners from a thread, like the context reload.
+        """
+        diff = {'full': full, 'config_env': dict(), 'certificate': certificate, 'ca': False}
+        return asyncio.to_thread(lambda: [listener(diff) for listener in self.reload_listeners])
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.__stop_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stop(self):
+        self.stopping = True
+        self.__stop_event.set()
+
+
+def fake_build(built: list):
+    def build(instance_id, idmg):
+        built.append((instance_id, idmg))
+        return (instance_id, idmg, len(built))
+    return build
+
+
+async def wait_available(pool: CsrPool, count: int):
+    for _ in range(0, 200):
+        if pool.stats['available'] == count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('pool not refilled: %s' % pool.stats)
+
+
+def test_filled_before_first_renewal(monkeypatch):
+    built = list()
+    monkeypatch.setattr(CsrPoolModule.CleCsrGenere, 'build', fake_build(built))
+
+    async def run():
+        context = FakeContext()
+        # Wired like the manager: sized from the managed certificates when started
+        pool = CsrPool(context, idle_delay=0, get_size=lambda: 3)
+        task = asyncio.create_task(pool.run())
+        try:
+            # Filled from the configuration identity, before the first renewal
+            await wait_available(pool, 3)
+            assert built == [('instance1', 'idmg1')] * 3
+
+            clecsr = await pool.get('instance1', 'idmg1')
+            assert clecsr[:2] == ('instance1', 'idmg1')
+            assert pool.stats['hits'] == 1 and pool.stats['misses'] == 0
+
+            await wait_available(pool, 3)  # Refilled after use
+            assert pool.stats['generated'] == 4
+        finally:
+            context.stop()
+            await task
+
+    asyncio.run(run())
+
+
+def test_sized_after_configuration_loaded(monkeypatch):
+    built = list()
+    monkeypatch.setattr(CsrPoolModule.CleCsrGenere, 'build', fake_build(built))
+    certificates = list()
+
+    def get_size():
+        if not certificates:
+            raise ValueError('Unsupported security type')  # Configuration not loaded yet
+        return len(certificates)
+
+    async def run():
+        context = FakeContext(instance_id=None, idmg=None)
+        pool = CsrPool(context, idle_delay=0, get_size=get_size)
+        task = asyncio.create_task(pool.run())
+        try:
+            await asyncio.sleep(0.05)
+            assert pool.stats['target'] == 0 and built == []
+
+            # Initial load of the configuration by the manager, before the runlevel renewal
+            context.configuration.instance_id, context.configuration.idmg = 'instance1', 'idmg1'
+            certificates.extend(['redis', 'mq'])
+            await context.reloaded(full=True)
+            await wait_available(pool, 2)
+
+            await pool.get('instance1', 'idmg1')
+            await pool.get('instance1', 'idmg1')
+            assert pool.stats['hits'] == 2 and pool.stats['misses'] == 0
+        finally:
+            context.stop()
+            await task
+
+    asyncio.run(run())
+
+
+def test_miss_when_empty(monkeypatch):
+    built = list()
+    monkeypatch.setattr(CsrPoolModule.CleCsrGenere, 'build', fake_build(built))
+
+    async def run():
+        pool = CsrPool(FakeContext(), idle_delay=0)
+        clecsr = await pool.get('instance1', 'idmg1')
+        assert clecsr[:2] == ('instance1', 'idmg1')
+        assert pool.stats == {'hits': 0, 'misses': 1, 'generated': 1, 'available': 0, 'target': 0}
+
+    asyncio.run(run())
+
+
+def test_identity_change_discards_keys(monkeypatch):
+    built = list()
+    monkeypatch.setattr(CsrPoolModule.CleCsrGenere, 'build', fake_build(built))
+
+    async def run():
+        context = FakeContext()
+        pool = CsrPool(context, idle_delay=0, get_size=lambda: 2)
+        task = asyncio.create_task(pool.run())
+        try:
+            await wait_available(pool, 2)
+
+            # New idmg (e.g. instance installed again), keys for the previous one are never handed out
+            context.configuration.idmg = 'idmg2'
+            await context.reloaded(certificate=True)
+            await asyncio.sleep(0.05)
+            await wait_available(pool, 2)
+            clecsr = await pool.get('instance1', 'idmg2')
+            assert clecsr[:2] == ('instance1', 'idmg2')
+            assert pool.stats['hits'] == 1
+        finally:
+            context.stop()
+            await task
+
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import pathlib
+
+from millegrilles_instance import FileWatcher as FileWatcherModule
+from millegrilles_instance.FileWatcher import FileWatcher
+
+
+def watch_changes(tmp_path: pathlib.Path, paths: list[pathlib.Path], writer, poll_interval=0.05) -> list[set]:
+    """
+    Runs the watcher while writer(path) changes the files, returns the batches received by the callback.
+    """
+    batches = list()
+
+    async def run():
+        stop = asyncio.Event()
+        watcher = FileWatcher(debounce=0.05, poll_interval=poll_interval)
+        watcher.watch(paths, lambda changed: batches.append(changed))
+        task = asyncio.create_task(watcher.run(stop.is_set))
+        await asyncio.sleep(0.1)
+        await writer()
+        await asyncio.sleep(0.4)
+        stop.set()
+        watcher.notify([])  # Wake up the watcher
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(run())
+    return batches
+
+
+def test_inotify_burst_debounced(tmp_path):
+    config = tmp_path / 'config.env'
+    other = tmp_path / 'other.txt'
+    config.write_text('A=1\n')
+
+    async def writer():
+        for i in range(5):
+            config.write_text(f'A={i}\n')
+        other.write_text('not watched')
+
+    batches = watch_changes(tmp_path, [config], writer)
+    assert batches == [{config}]
+
+
+def test_rename_and_missing_directory(tmp_path):
+    target = tmp_path / 'etc' / 'millegrille.pem'
+    config = tmp_path / 'config.env'
+
+    async def writer():
+        tmp = tmp_path / 'config.env.tmp'
+        tmp.write_text('B=2\n')
+        os.rename(tmp, config)  # Atomic replace
+        target.parent.mkdir()  # Directory created after the watch, polled
+        target.write_text('pem')
+
+    batches = watch_changes(tmp_path, [config, target], writer)
+    assert set().union(*batches) == {config, target}
+
+
+def test_polling_fallback(tmp_path, monkeypatch):
+    def no_inotify():
+        raise OSError(38, 'Function not implemented')
+    monkeypatch.setattr(FileWatcherModule, 'Inotify', no_inotify)
+
+    path = tmp_path / 'installed_applications.json'
+    path.write_text('{}')
+
+    async def writer():
+        path.write_text('{"app": {}}')
+
+    batches = watch_changes(tmp_path, [path], writer)
+    assert batches == [{path}]
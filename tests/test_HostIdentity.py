@@ -0,0 +1,94 @@
+import asyncio
+import socket
+
+from collections import namedtuple
+
+from millegrilles_instance import HostIdentity
+from millegrilles_instance.HostIdentity import HostIdentityCache
+
+snicaddr = namedtuple('snicaddr', ['family', 'address', 'netmask', 'broadcast', 'ptp'])
+
+
+def fake_interfaces(addresses: dict):
+    return lambda: {name: [snicaddr(family, address, None, None, None) for family, address in addrs]
+                    for name, addrs in addresses.items()}
+
+
+def test_interface_addresses(monkeypatch):
+    monkeypatch.setattr(HostIdentity.psutil, 'net_if_addrs', fake_interfaces({
+        'lo': [(socket.AF_INET, '127.0.0.1'), (socket.AF_INET6, '::1')],
+        'eth0': [(socket.AF_INET, '192.168.1.10'), (socket.AF_INET6, 'fe80::1'), (socket.AF_PACKET, '00:11:22:33:44:55')],
+        'docker0': [(socket.AF_INET, '172.17.0.1')],
+        'veth1234': [(socket.AF_INET6, 'fe80::2')],
+    }))
+    assert HostIdentity.interface_addresses() == ['192.168.1.10', 'fe80::1']
+
+
+def test_resolves_once_and_counts_changes(monkeypatch):
+    monkeypatch.setattr(HostIdentity.psutil, 'net_if_addrs', fake_interfaces({'eth0': [(socket.AF_INET, '192.168.1.10')]}))
+    resolved = list()
+
+    def resolver():
+        resolved.append(True)
+        return '192.168.1.10', 'host.example.com', ['host.example.com', 'host']
+
+    cache = HostIdentityCache(30, 3600, resolver)
+    assert cache.current is None
+    identity = cache.get()
+    assert identity == {'hostname': 'host.example.com', 'hostnames': ['host.example.com', 'host'],
+                        'ip_address': '192.168.1.10', 'ip_addresses': ['192.168.1.10']}
+    assert cache.get() is identity
+    assert len(resolved) == 1
+    assert cache.changes == 0
+
+    # Same identity, not a change
+    cache.refresh()
+    assert cache.refreshes == 2
+    assert cache.changes == 0 and cache.last_change is None
+
+    monkeypatch.setattr(HostIdentity.psutil, 'net_if_addrs', fake_interfaces({'eth0': [(socket.AF_INET, '192.168.1.20')]}))
+    assert cache.refresh()['ip_addresses'] == ['192.168.1.20']
+    assert cache.changes == 1 and cache.last_change is not None
+
+
+def test_resolver_error_uses_kernel_hostname(monkeypatch):
+    monkeypatch.setattr(HostIdentity.psutil, 'net_if_addrs', fake_interfaces({'eth0': [(socket.AF_INET, '10.0.0.5')]}))
+
+    def resolver():
+        raise OSError('no network')
+
+    identity = HostIdentityCache(30, 3600, resolver).get()
+    assert identity['hostname'] == socket.gethostname()
+    assert identity['ip_address'] is None
+    assert identity['ip_addresses'] == ['10.0.0.5']
+
+
+def test_poll_refreshes_on_address_change(monkeypatch):
+    monkeypatch.setattr(HostIdentity, 'open_netlink_socket', lambda: None)
+    addresses = {'eth0': [(socket.AF_INET, '192.168.1.10')]}
+    monkeypatch.setattr(HostIdentity.psutil, 'net_if_addrs', fake_interfaces(addresses))
+    resolved = list()
+
+    def resolver():
+        resolved.append(True)
+        return None, 'host', ['host']
+
+    cache = HostIdentityCache(0.01, 3600, resolver)
+    cache.get()
+
+    async def run():
+        polls = list()
+
+        def stopping():
+            polls.append(True)
+            if len(polls) == 3:
+                addresses['eth0'] = [(socket.AF_INET, '192.168.1.20')]
+            return len(polls) > 5
+
+        await cache.run(stopping)
+
+    asyncio.run(run())
+    # Resolved on the first get and once after the address change only
+    assert len(resolved) == 2
+    assert cache.changes == 1
+    assert cache.current['ip_addresses'] == ['192.168.1.20']
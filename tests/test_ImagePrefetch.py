@@ -0,0 +1,103 @@
+import asyncio
+
+from millegrilles_instance.apps.ImagePrefetch import ImagePrefetch, ProgressAggregator, compose_images, \
+    compose_pull_always, format_progress, interpolate, local_images_present
+
+
+def test_interpolate():
+    env = {'REGISTRY': 'registry.local', 'EMPTY': ''}
+    assert interpolate('${REGISTRY}/app:1', env) == 'registry.local/app:1'
+    assert interpolate('$REGISTRY/app', env) == 'registry.local/app'
+    assert interpolate('${TAG:-latest}', env) == 'latest'
+    assert interpolate('${EMPTY:-x}-${EMPTY-y}', env) == 'x-'
+
+
+def test_compose_images():
+    content = {
+        'services': {
+            'app': {'image': '${REGISTRY}/app'},
+            'worker': {'image': 'registry.local/app:latest'},
+            'built': {'build': '.'},
+            'local': {'image': 'local/tool:1', 'pull_policy': 'never'},
+            'edge': {'image': 'nginx:1.27', 'pull_policy': 'always'},
+        },
+        'x-include-content': {
+            '/etc/compose/redis.yml': {'services': {'redis': {'image': 'redis@sha256:abcd'}, 'cache': {'image': 'nginx:1.27'}}},
+        },
+    }
+    env = {'REGISTRY': 'registry.local'}
+    assert compose_images(content, env) == {
+        'redis@sha256:abcd': ['redis'],
+        'nginx:1.27': ['cache', 'edge'],
+        'registry.local/app:latest': ['app', 'worker'],
+    }
+    assert compose_pull_always(content, env) == {'nginx:1.27'}
+
+
+def test_local_images_present():
+    output = '[{"RepoTags": ["redis:7"], "RepoDigests": ["nginx@sha256:1234"]}]'
+    assert local_images_present(output, ['redis:7', 'nginx@sha256:1234', 'nginx@sha256:5678', 'app:1']) == \
+        {'redis:7', 'nginx@sha256:1234'}
+    assert local_images_present('', ['redis:7']) == set()
+
+
+def test_progress_aggregator():
+    aggregator = ProgressAggregator(['a:1', 'b:1'], set())
+    aggregator.start('a:1')
+    assert aggregator.update('0123456789ab: Downloading [==>   ]  1.5MB/3MB\n')
+    assert aggregator.update('abcdef012345: Already exists')
+    assert not aggregator.update('Digest: sha256:1234')
+    progress = aggregator.progress
+    assert progress['layers_total'] == 2 and progress['layers_done'] == 1
+    assert (progress['bytes_current'], progress['bytes_total']) == (1_500_000, 3_000_000)
+    assert progress['pulling'] == ['a:1'] and progress['done'] is False
+
+    aggregator.update('0123456789ab: Download complete')
+    aggregator.update('0123456789ab: Pull complete')
+    aggregator.finish('a:1', True)
+    aggregator.start('b:1')
+    aggregator.finish('b:1', False)
+    progress = aggregator.progress
+    assert progress['bytes_current'] == 3_000_000 and progress['layers_done'] == 2
+    assert (progress['images_done'], progress['images_failed'], progress['done']) == (1, 1, True)
+    assert format_progress(progress) == 'Images 1/2, 1 failed, layers 2/2, 3.0/3.0 MB'
+
+
+def test_prefetch(fake_docker_pull, monkeypatch):
+    docker, calls = fake_docker_pull
+    monkeypatch.setenv('FAKE_DOCKER_IMAGES', 'redis:7,nginx@sha256:1234,edge:1')
+    monkeypatch.setenv('FAKE_DOCKER_DELAY', '0.3')
+    monkeypatch.setenv('FAKE_DOCKER_PULL_FAIL', 'bad:1')
+
+    updates = list()
+    prefetch = ImagePrefetch(docker=docker, concurrency=2, progress=updates.append, progress_interval=0)
+    images = ['app1:1', 'redis:7', 'app2:1', 'app1:1', 'nginx@sha256:1234', 'bad:1', 'app3', 'edge:1']
+    result = asyncio.run(prefetch.prefetch(images, always=['edge:1']))
+
+    assert sorted(result['pulled']) == ['app1:1', 'app2:1', 'app3:latest', 'edge:1']
+    assert result['skipped'] == ['redis:7', 'nginx@sha256:1234']
+    assert list(result['failed'].keys()) == ['bad:1'] and 'manifest unknown' in result['failed']['bad:1']
+
+    # Each missing image pulled once, never more than 2 at the same time
+    pulls = [c for c in calls() if c[0] == 'start']
+    assert sorted([c[2][1] for c in pulls]) == ['app1:1', 'app2:1', 'app3:latest', 'bad:1', 'edge:1']
+    events = sorted([(time, 1 if kind == 'start' else -1) for kind, time, _ in calls()])
+    running = [sum([e[1] for e in events[:i + 1]]) for i in range(len(events))]
+    assert max(running) == 2
+
+    # Progress of all pulls combined, the layer shared by all images counted once
+    final = updates[-1]
+    assert final['done'] is True and final['pulling'] == []
+    assert (final['images_total'], final['images_done'], final['images_skipped'], final['images_failed']) == (7, 6, 2, 1)
+    assert final['layers_total'] == 6
+    assert any([len(u['pulling']) == 2 for u in updates])
+
+
+def test_prefetch_nothing_missing(fake_docker_pull, monkeypatch):
+    docker, calls = fake_docker_pull
+    monkeypatch.setenv('FAKE_DOCKER_IMAGES', 'redis:7')
+    updates = list()
+    result = asyncio.run(ImagePrefetch(docker=docker, progress=updates.append).prefetch(['redis:7', 'redis:7']))
+    assert result == {'pulled': [], 'skipped': ['redis:7'], 'failed': {}}
+    assert calls() == []
+    assert updates[-1]['done'] is True
@@ -0,0 +1,196 @@
+import hashlib
+import importlib.util
+import io
+import json
+import pathlib
+import tarfile
+import time
+
+import pytest
+
+SCRIPT_PATH = pathlib.Path(__file__).parent.parent / 'bin' / 'manage_apps.py'
+
+
+def load_manage_apps():
+    spec = importlib.util.spec_from_file_location('manage_apps', SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+manage_apps = load_manage_apps()
+
+
+def write_package(path: pathlib.Path, members: list[tarfile.TarInfo], contents: dict[str, bytes]):
+    with tarfile.open(path, 'w:gz') as tar:
+        for member in members:
+            content = contents.get(member.name)
+            if content is not None:
+                member.size = len(content)
+                tar.addfile(member, io.BytesIO(content))
+            else:
+                tar.addfile(member)
+
+
+def file_member(name: str) -> tarfile.TarInfo:
+    member = tarfile.TarInfo(name)
+    member.mode = 0o644
+    return member
+
+
+def test_download_and_extract(tmp_path):
+    package = tmp_path / 'app.tar.gz'
+    metadata = json.dumps({'name': 'app', 'version': '1.0'}).encode('utf-8')
+    top = tarfile.TarInfo('app-1.0')
+    top.type = tarfile.DIRTYPE
+    link = tarfile.TarInfo('app-1.0/files/index.htm')
+    link.type = tarfile.LNKTYPE
+    link.linkname = 'app-1.0/files/index.html'
+    write_package(package, [top, file_member('app-1.0/metadata.json'), file_member('app-1.0/files/index.html'), link],
+                  {'app-1.0/metadata.json': metadata, 'app-1.0/files/index.html': b'<html/>' * 100_000})
+
+    extract_dir = tmp_path / 'extracted'
+    extract_dir.mkdir()
+    digest = manage_apps.download_and_extract(package.as_uri(), extract_dir)
+
+    # Hash of the whole file, including what tarfile does not read (gzip trailer, tar padding)
+    assert digest == hashlib.sha256(package.read_bytes()).hexdigest()
+    assert (extract_dir / 'metadata.json').read_bytes() == metadata
+    assert (extract_dir / 'files' / 'index.htm').read_bytes() == (extract_dir / 'files' / 'index.html').read_bytes()
+
+
+@pytest.mark.parametrize('name, linkname', [
+    ('app/../../evil.txt', None),
+    ('/app/../../evil.txt', None),
+    ('app/link', '../../etc/passwd'),
+    ('app/link', '/etc/passwd'),
+])
+def test_path_traversal_rejected(tmp_path, name, linkname):
+    package = tmp_path / 'app.tar.gz'
+    member = file_member(name)
+    contents = {name: b'evil'}
+    if linkname is not None:
+        member.type = tarfile.SYMTYPE
+        member.linkname = linkname
+        contents = dict()
+    write_package(package, [member], contents)
+
+    extract_dir = tmp_path / 'staging' / 'extracted'
+    extract_dir.mkdir(parents=True)
+    with pytest.raises(tarfile.TarError):
+        manage_apps.download_and_extract(package.as_uri(), extract_dir)
+    assert not (tmp_path / 'evil.txt').exists()
+    assert not (tmp_path / 'staging' / 'evil.txt').exists()
+
+
+def test_strip_first_component():
+    assert manage_apps.strip_first_component('app/files/a.js') == 'files/a.js'
+    assert manage_apps.strip_first_component('./app/metadata.json') == 'metadata.json'
+    assert manage_apps.strip_first_component('app') == ''
+
+
+def test_file_transaction_rollback(tmp_path):
+    changed = tmp_path / 'changed.txt'
+    changed.write_text('original')
+    created = tmp_path / 'created.txt'
+    html = tmp_path / 'html' / 'app'
+    html.mkdir(parents=True)
+    (html / 'index.html').write_text('v1')
+
+    transaction = manage_apps.FileTransaction(tmp_path / 'backup')
+    transaction.backup(changed)
+    changed.write_text('new')
+    transaction.backup(changed)  # Keeps the first version
+    changed.write_text('newer')
+    transaction.backup(created)
+    created.write_text('new')
+    transaction.backup(html, move=True)
+    manage_apps.copy_dir(tmp_path / 'backup', html)
+
+    transaction.rollback()
+    assert changed.read_text() == 'original'
+    assert not created.exists()
+    assert [p.name for p in html.iterdir()] == ['index.html']
+    assert (html / 'index.html').read_text() == 'v1'
+
+
+@pytest.fixture
+def app_manager(tmp_path, monkeypatch):
+    root = tmp_path / 'root'
+    (root / 'etc' / 'compose').mkdir(parents=True)
+    (root / 'etc' / 'compose' / 'applications.yml').write_text('include:\n- include/app_net.yml\n')
+    html = tmp_path / 'html'
+    html.mkdir()
+
+    commands = list()
+    monkeypatch.setattr(manage_apps, 'run_command', lambda command, **kwargs: commands.append(command))
+    monkeypatch.delenv('SECURITE', raising=False)
+    return manage_apps.AppManager(str(root), str(html), 'mg'), commands
+
+
+def app_package(tmp_path: pathlib.Path, name: str, version: str) -> dict:
+    package = tmp_path / f'{name}.tar.gz'
+    members = [file_member(f'{name}/metadata.json'), file_member(f'{name}/files/index.html'),
+               file_member(f'{name}/nginx/{name}.location'), file_member(f'{name}/docker-compose.yml')]
+    write_package(package, members, {
+        f'{name}/metadata.json': json.dumps({'name': name, 'version': version, 'path': name}).encode('utf-8'),
+        f'{name}/files/index.html': version.encode('utf-8'),
+        f'{name}/nginx/{name}.location': b'location /app {}',
+        f'{name}/docker-compose.yml': f'services:\n  {name}:\n    image: {name}:{version}\n'.encode('utf-8'),
+    })
+    return {'name': name, 'url': package.as_uri(), 'sha256': hashlib.sha256(package.read_bytes()).hexdigest()}
+
+
+def test_update_packages(tmp_path, app_manager, fake_docker_pull, monkeypatch):
+    manager, commands = app_manager
+    docker, docker_calls = fake_docker_pull
+    monkeypatch.setenv('DOCKER', docker)
+    monkeypatch.setenv('FAKE_DOCKER_IMAGES', 'app2:2.0')
+    updates = [app_package(tmp_path, 'app1', '2.0'), app_package(tmp_path, 'app2', '2.0')]
+
+    manager.update_packages(updates, parallel=2)
+
+    assert sorted(manager.get_installed_apps().keys()) == ['app1', 'app2']
+    assert (manager.nginx_apps_html_dir / 'app2' / 'index.html').read_text() == '2.0'
+    assert (manager.nginx_apps_conf_dir / 'app1__app1.location').exists()
+    # Only the missing image is pulled
+    assert [c[2] for c in docker_calls() if c[0] == 'start'] == [['pull', 'app1:2.0']]
+    # A single reload once everything is installed
+    assert [c for c in commands if 'systemctl' in c] == [
+        'systemctl --user start mg-certs_updater', 'systemctl --user reload mg-applications',
+        'systemctl --user reload mg-nginx']
+
+
+def test_update_packages_bad_hash_installs_nothing(tmp_path, app_manager):
+    manager, commands = app_manager
+    updates = [app_package(tmp_path, 'app1', '2.0'), app_package(tmp_path, 'app2', '2.0')]
+    updates[1]['sha256'] = '00' * 32
+
+    with pytest.raises(SystemExit):
+        manager.update_packages(updates)
+
+    assert manager.get_installed_apps() == dict()
+    assert commands == []
+    assert list(manager.nginx_apps_conf_dir.iterdir()) == []
+
+
+def test_update_packages_failed_pull_installs_nothing(tmp_path, app_manager, fake_docker_pull, monkeypatch):
+    manager, commands = app_manager
+    docker, _ = fake_docker_pull
+    monkeypatch.setenv('DOCKER', docker)
+    monkeypatch.setenv('FAKE_DOCKER_PULL_FAIL', 'app2:2.0')
+    updates = [app_package(tmp_path, 'app1', '2.0'), app_package(tmp_path, 'app2', '2.0')]
+
+    with pytest.raises(SystemExit):
+        manager.update_packages(updates)
+
+    assert manager.get_installed_apps() == dict()
+    assert commands == []
+
+
+def test_rate_limiter():
+    limiter = manage_apps.RateLimiter(1_000_000)
+    start = time.monotonic()
+    for _ in range(0, 4):
+        limiter.consume(100_000)
+    assert time.monotonic() - start >= 0.29
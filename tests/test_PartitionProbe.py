@@ -0,0 +1,61 @@
+import threading
+import time
+
+from collections import namedtuple
+
+from millegrilles_instance import PartitionProbe
+from millegrilles_instance.PartitionProbe import PartitionProber
+
+sdiskusage = namedtuple('sdiskusage', ['total', 'used', 'free', 'percent'])
+sdiskpart = namedtuple('sdiskpart', ['device', 'mountpoint', 'fstype', 'opts'])
+
+
+def test_hung_mount_quarantined(monkeypatch):
+    release = threading.Event()
+    calls = list()
+
+    def disk_usage(mountpoint):
+        calls.append(mountpoint)
+        if mountpoint == '/mnt/nfs':
+            release.wait(5)  # Hung server
+        return sdiskusage(100, 40, 60, 40.0)
+
+    monkeypatch.setattr(PartitionProbe.psutil, 'disk_usage', disk_usage)
+    prober = PartitionProber(timeout=0.2, quarantine_delay=0.5)
+
+    start = time.monotonic()
+    result = prober.probe(['/', '/mnt/nfs'])
+    assert time.monotonic() - start < 1
+    assert result == [('/', sdiskusage(100, 40, 60, 40.0), False), ('/mnt/nfs', None, True)]
+
+    # Not probed again while hung
+    result = prober.probe(['/', '/mnt/nfs'])
+    assert calls.count('/mnt/nfs') == 1
+    assert result[1] == ('/mnt/nfs', None, True)
+
+    # Recovered, probed again after the quarantine delay
+    release.set()
+    time.sleep(0.6)
+    result = prober.probe(['/', '/mnt/nfs'])
+    assert calls.count('/mnt/nfs') == 2
+    assert result[1] == ('/mnt/nfs', sdiskusage(100, 40, 60, 40.0), False)
+
+
+def test_partitions_cached_on_mountinfo(tmp_path, monkeypatch):
+    mountinfo = tmp_path / 'mountinfo'
+    mountinfo.write_text('22 1 8:1 / / rw - ext4 /dev/sda1 rw\n')
+    loads = list()
+
+    def disk_partitions():
+        loads.append(1)
+        return [sdiskpart('/dev/sda1', '/', 'ext4', 'rw')]
+
+    monkeypatch.setattr(PartitionProbe.psutil, 'disk_partitions', disk_partitions)
+    prober = PartitionProber(timeout=1, quarantine_delay=1, mountinfo_path=str(mountinfo))
+    prober.partitions()
+    prober.partitions()
+    assert len(loads) == 1
+
+    mountinfo.write_text('22 1 8:1 / / rw - ext4 /dev/sda1 rw\n23 1 8:2 / /data rw - ext4 /dev/sda2 rw\n')
+    prober.partitions()
+    assert len(loads) == 2
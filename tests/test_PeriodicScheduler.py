@@ -0,0 +1,149 @@
+import asyncio
+
+from millegrilles_instance import PeriodicScheduler as PeriodicSchedulerModule
+from millegrilles_instance.PeriodicScheduler import PeriodicScheduler
+
+TICK = 0.02
+
+
+def test_jobs_batched_with_one_producer_wait():
+    producer_waits = list()
+    calls = list()
+
+    async def get_producer():
+        producer_waits.append(True)
+        return 'producer'
+
+    def job(name):
+        async def callback(producer):
+            assert producer == 'producer'
+            calls.append(name)
+        return callback
+
+    async def run():
+        scheduler = PeriodicScheduler(get_producer, tick=TICK)
+        scheduler.add_job('fast', 2 * TICK, job('fast'), jitter=0)
+        scheduler.add_job('slow', 4 * TICK, job('slow'), jitter=0)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + 17 * TICK
+        await scheduler.run(lambda: loop.time() >= end)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert calls.count('fast') >= 6
+    assert calls.count('slow') >= 3
+    # Both jobs start on the same tick, the slow job never needs its own producer wait
+    assert len(producer_waits) == calls.count('fast')
+
+    stats = {s['name']: s for s in scheduler.stats()}
+    assert stats['fast']['runs'] == calls.count('fast')
+    assert stats['slow']['interval'] == 4 * TICK
+
+
+def test_missed_ticks_coalesced():
+    calls = list()
+
+    async def get_producer():
+        return 'producer'
+
+    async def slow_job(producer):
+        calls.append(True)
+        await asyncio.sleep(5.5 * TICK)  # Longer than 2 intervals
+
+    async def run():
+        scheduler = PeriodicScheduler(get_producer, tick=TICK)
+        scheduler.add_job('slow', 2 * TICK, slow_job, jitter=0)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + 20 * TICK
+        await scheduler.run(lambda: loop.time() >= end)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    stats = scheduler.stats()[0]
+    assert stats['missed'] >= 2
+    assert len(calls) <= 4  # Not one run per missed tick
+    assert stats['errors'] == 0
+
+
+def test_backoff_without_producer(monkeypatch):
+    monkeypatch.setattr(PeriodicSchedulerModule, 'PRODUCER_TIMEOUT', TICK / 4)
+    calls = list()
+
+    async def get_producer():
+        await asyncio.sleep(10)
+
+    async def requires(producer):
+        calls.append(('requires', producer))
+
+    async def optional(producer):
+        calls.append(('optional', producer))
+
+    async def run():
+        scheduler = PeriodicScheduler(get_producer, tick=TICK)
+        scheduler.add_job('requires', 20 * TICK, requires, jitter=0)
+        scheduler.add_job('optional', 4 * TICK, optional, jitter=0, requires_producer=False)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + 16 * TICK
+        await scheduler.run(lambda: loop.time() >= end)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert ('optional', None) in calls
+    assert all(name == 'optional' for name, _ in calls)
+
+    stats = {s['name']: s for s in scheduler.stats()}
+    # Retried after 2, 4 and 8 ticks: 4 attempts within 16 ticks (instead of one per tick)
+    assert 3 <= stats['requires']['producer_unavailable'] <= 4
+    assert stats['requires']['runs'] == 0
+
+
+def test_job_error_does_not_stop_scheduler():
+    calls = list()
+
+    async def get_producer():
+        return 'producer'
+
+    async def failing(producer):
+        calls.append(True)
+        raise Exception('failed')
+
+    async def run():
+        scheduler = PeriodicScheduler(get_producer, tick=TICK)
+        scheduler.add_job('failing', TICK, failing, jitter=0)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + 6 * TICK
+        await scheduler.run(lambda: loop.time() >= end)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert len(calls) >= 3
+    assert scheduler.stats()[0]['errors'] == len(calls)
+
+
+def test_removed_while_running_not_rescheduled():
+    calls = list()
+    release = asyncio.Event()
+
+    async def get_producer():
+        return 'producer'
+
+    async def slow(producer):
+        calls.append(True)
+        await release.wait()
+
+    async def run():
+        scheduler = PeriodicScheduler(get_producer, tick=TICK)
+        scheduler.add_job('slow', TICK, slow, jitter=0)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + 8 * TICK
+        task = asyncio.create_task(scheduler.run(lambda: loop.time() >= end))
+        while not calls:
+            await asyncio.sleep(TICK / 4)
+        scheduler.remove_job('slow')
+        release.set()
+        await task
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert len(calls) == 1
+    assert scheduler.stats() == []
@@ -0,0 +1,38 @@
+from millegrilles_instance import ProcessStats
+from millegrilles_instance.ProcessStats import CLOCK_TICKS, PAGE_SIZE, ProcessScanner, parse_stat
+
+STAT = '{pid} ({name}) S 1 1 1 0 -1 4194304 77 0 0 0 {utime} {stime} 0 0 20 0 1 0 {start} 2703360 {rss} 0 0 0\n'
+
+
+def write_stat(root, pid, name='worker', utime=0, stime=0, start=1000, rss=10):
+    path = root / str(pid)
+    path.mkdir(exist_ok=True)
+    (path / 'stat').write_text(STAT.format(pid=pid, name=name, utime=utime, stime=stime, start=start, rss=rss))
+
+
+def test_parse_stat():
+    content = STAT.format(pid=12, name='odd) (name', utime=5, stime=7, start=99, rss=3).encode('utf-8')
+    assert parse_stat(content) == ('odd) (name', 99, 12, 3)
+
+
+def test_top_processes(tmp_path, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(ProcessStats.time, 'monotonic', lambda: clock[0])
+    for pid in range(1, 6):
+        write_stat(tmp_path, pid)
+    write_stat(tmp_path, 6, start=2000)
+    (tmp_path / 'self').mkdir()
+
+    scanner = ProcessScanner(str(tmp_path), top=2)
+    assert scanner.read() == list()
+
+    clock[0] += 2
+    write_stat(tmp_path, 3, name='busy', utime=CLOCK_TICKS, stime=CLOCK_TICKS)  # 2 cpu seconds over 2 seconds
+    write_stat(tmp_path, 4, utime=CLOCK_TICKS // 2)
+    write_stat(tmp_path, 6, utime=CLOCK_TICKS * 10, start=3000)  # pid reused, no previous sample
+    (tmp_path / '5' / 'stat').unlink()  # Exited
+
+    top = scanner.read()
+    assert [p['pid'] for p in top] == [3, 4]
+    assert top[0] == {'pid': 3, 'name': 'busy', 'cpu_percent': 100.0, 'rss_bytes': 10 * PAGE_SIZE}
+    assert top[1]['cpu_percent'] == 25.0
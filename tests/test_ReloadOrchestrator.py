@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from subprocess import CalledProcessError
+
+from millegrilles_instance.ReloadOrchestrator import ReloadOrchestrator, ACTION_RESTART, \
+    SERVICE_APPLICATIONS, SERVICE_MIDDLEWARE, SERVICE_NGINX
+from millegrilles_instance.SystemdUtil import SystemdController
+
+
+def run_orchestrator(systemctl: str, requester, window=0.1, max_delay=1.0) -> ReloadOrchestrator:
+    """
+    Runs the orchestrator while requester(orchestrator) sends requests and waits for them.
+    """
+    orchestrator = ReloadOrchestrator(SystemdController(systemctl), lambda: 'mg', window, max_delay)
+
+    async def run():
+        stop = asyncio.Event()
+        task = asyncio.create_task(orchestrator.run(stop.is_set))
+        try:
+            await requester(orchestrator)
+        finally:
+            stop.set()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    return orchestrator
+
+
+def started(calls) -> list[list[str]]:
+    return [entry[2][1:] for entry in calls() if entry[0] == 'start']
+
+
+def test_burst_merged_in_dependency_order(fake_systemctl, monkeypatch):
+    systemctl, calls = fake_systemctl
+    monkeypatch.setenv('FAKE_SYSTEMCTL_DELAY', '0')
+
+    async def requester(orchestrator: ReloadOrchestrator):
+        waiters = [
+            orchestrator.request(SERVICE_NGINX),
+            orchestrator.request(SERVICE_APPLICATIONS, ACTION_RESTART),
+            orchestrator.request(SERVICE_NGINX, ACTION_RESTART),
+        ]
+        await asyncio.sleep(0.05)  # Still in the window
+        waiters.append(orchestrator.request(SERVICE_APPLICATIONS))
+        waiters.append(orchestrator.request(SERVICE_MIDDLEWARE))
+        await asyncio.gather(*waiters)
+
+    orchestrator = run_orchestrator(systemctl, requester)
+    assert started(calls) == [['reload', 'mg-middleware'],
+                              ['restart', 'mg-applications'],
+                              ['restart', 'mg-nginx']]
+    assert orchestrator.batches == 1
+
+
+def test_middleware_restart_runs_last(fake_systemctl, monkeypatch):
+    systemctl, calls = fake_systemctl
+    monkeypatch.setenv('FAKE_SYSTEMCTL_DELAY', '0')
+
+    async def requester(orchestrator: ReloadOrchestrator):
+        # Certificates renewed for services of every unit
+        await asyncio.gather(
+            orchestrator.request(SERVICE_MIDDLEWARE, ACTION_RESTART),
+            orchestrator.request(SERVICE_APPLICATIONS, ACTION_RESTART),
+            orchestrator.request(SERVICE_NGINX, ACTION_RESTART),
+        )
+
+    orchestrator = run_orchestrator(systemctl, requester)
+    # Restarting MQ may take the manager down, the other restarts are already done
+    assert started(calls) == [['restart', 'mg-applications'],
+                              ['restart', 'mg-nginx'],
+                              ['restart', 'mg-middleware']]
+    assert orchestrator.batches == 1
+
+
+def test_requests_during_run_go_to_next_batch(fake_systemctl, monkeypatch):
+    systemctl, calls = fake_systemctl
+    monkeypatch.setenv('FAKE_SYSTEMCTL_DELAY', '0.2')
+
+    async def requester(orchestrator: ReloadOrchestrator):
+        first = orchestrator.request(SERVICE_NGINX, ACTION_RESTART)
+        await asyncio.sleep(0.2)  # Window elapsed, restart running
+        second = orchestrator.request(SERVICE_NGINX)
+        await first
+        assert not second.done()
+        await second
+
+    orchestrator = run_orchestrator(systemctl, requester)
+    assert started(calls) == [['restart', 'mg-nginx'], ['reload', 'mg-nginx']]
+    assert orchestrator.batches == 2
+
+
+def test_reload_failure(fake_systemctl, monkeypatch):
+    systemctl, calls = fake_systemctl
+    monkeypatch.setenv('FAKE_SYSTEMCTL_DELAY', '0')
+    monkeypatch.setenv('FAKE_SYSTEMCTL_FAIL', 'mg-middleware,mg-applications')
+
+    async def requester(orchestrator: ReloadOrchestrator):
+        middleware = orchestrator.request(SERVICE_MIDDLEWARE)
+        applications = orchestrator.request(SERVICE_APPLICATIONS, update_certs=True, restart_on_failure=True)
+        nginx = orchestrator.request(SERVICE_NGINX, restart_on_failure=True)
+        with pytest.raises(CalledProcessError):
+            await middleware
+        with pytest.raises(CalledProcessError) as e:
+            await applications
+        assert e.value.cmd[-2:] == ['restart', 'mg-applications']
+        await nginx
+
+    run_orchestrator(systemctl, requester)
+    assert started(calls) == [['reload', 'mg-middleware'],
+                              ['start', 'mg-certs_updater'],
+                              ['reload', 'mg-applications'],
+                              ['restart', 'mg-applications'],
+                              ['reload', 'mg-nginx']]
+
+
+def test_max_delay(fake_systemctl, monkeypatch):
+    systemctl, calls = fake_systemctl
+    monkeypatch.setenv('FAKE_SYSTEMCTL_DELAY', '0')
+
+    async def requester(orchestrator: ReloadOrchestrator):
+        first = orchestrator.request(SERVICE_NGINX)
+        # Keep requesting within the window, the actions still run after the max delay
+        while not first.done():
+            orchestrator.request(SERVICE_NGINX)
+            await asyncio.sleep(0.05)
+
+    orchestrator = run_orchestrator(systemctl, requester, window=0.1, max_delay=0.3)
+    assert orchestrator.batches == 1
+
+
+def test_unknown_service():
+    orchestrator = ReloadOrchestrator(SystemdController('systemctl'), lambda: 'mg', 0.1, 1.0)
+    with pytest.raises(ValueError):
+        orchestrator.request('mongo')
@@ -0,0 +1,34 @@
+import json
+import subprocess
+import sys
+
+from millegrilles_instance.StartupProfile import StartupProfiler
+
+
+def test_report_per_service(tmp_path):
+    profiler = StartupProfiler()
+    with profiler.measure('app_manager', 'import'):
+        import millegrilles_instance.apps.ComposeCache  # noqa: F401
+    with profiler.measure('app_manager', 'wiring'):
+        pass
+    with profiler.measure('app_manager', 'wiring'):
+        pass
+
+    report = profiler.report()
+    service = report['services']['app_manager']
+    assert set(service.keys()) == {'import_ms', 'wiring_ms'}
+    assert len(report['records']) == 3
+
+    path = tmp_path / 'profile.json'
+    profiler.write(path)
+    with open(path) as f:
+        assert json.load(f)['services']['app_manager'] == service
+
+
+def test_main_module_imports_lazily():
+    """ Importing the entry point must not load the subsystems, they are imported during wiring. """
+    code = "import sys, millegrilles_instance.__main__; " \
+           "print(','.join(m for m in ('millegrilles_instance.SystemStatus', 'millegrilles_instance.Manager', " \
+           "'millegrilles_instance.apps.AppManager', 'millegrilles_messages') if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
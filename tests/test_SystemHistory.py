@@ -0,0 +1,68 @@
+import math
+
+import pytest
+
+from millegrilles_instance.SystemHistory import HISTORY_METRICS, SystemHistory, extract_metrics
+
+TIERS = [(10, 3600), (60, 6 * 3600), (600, 24 * 3600)]
+START = 1_700_000_000 - 1_700_000_000 % 3600
+
+
+def make_state(cpu: float) -> dict:
+    return {
+        'cpu_usage_percent': cpu,
+        'load_average': [1.5, 1.0, 0.5],
+        'memory': {'percent': 40.0},
+        'disk': [{'mountpoint': '/', 'free': 25, 'used': 75, 'total': 100},
+                 {'mountpoint': '/var', 'free': 90, 'used': 10, 'total': 100}],
+        'system_temperature': {'coretemp': [('Core 0', 45.0, 80.0, 100.0), ('Core 1', 52.0, 80.0, 100.0)]},
+    }
+
+
+def test_extract_metrics():
+    values = dict(zip(HISTORY_METRICS, extract_metrics(make_state(12.5))))
+    assert values['cpu_usage_percent'] == 12.5
+    assert values['load_average_1m'] == 1.5
+    assert values['disk_used_percent'] == 75.0
+    assert values['temperature_max'] == 52.0
+    assert math.isnan(values['network_bytes_sent_per_sec'])
+
+
+def test_query_resolutions():
+    history = SystemHistory(TIERS, max_points=2000)
+    for i in range(6 * 360):  # 6 hours at 10 seconds
+        history.add(START + i * 10, make_state(float(i % 6)))
+    end = START + 6 * 3600
+
+    # Full resolution only holds the last hour
+    response = history.query(end - 1800, end, 10, ['cpu_usage_percent'])
+    assert response['resolution'] == 10
+    assert len(response['timestamps']) == 180
+
+    # Older range comes from the 1 minute tier, each point averages 0..5
+    response = history.query(START, START + 3600, 10, ['cpu_usage_percent'])
+    assert response['resolution'] == 60
+    assert response['timestamps'][0] == START
+    assert response['values']['cpu_usage_percent'][0] == 2.5
+
+    # Downsampled on request
+    response = history.query(START, end, 1800, ['memory_percent', 'network_bytes_recv_per_sec'])
+    assert response['resolution'] == 1800
+    assert len(response['timestamps']) == 12
+    assert response['values']['memory_percent'][0] == 40.0
+    assert response['values']['network_bytes_recv_per_sec'][0] is None
+
+
+def test_query_limits():
+    history = SystemHistory(TIERS, max_points=100)
+    for i in range(720):
+        history.add(START + i * 10, make_state(1.0))
+    response = history.query(START, START + 7200, 10)
+    assert len(response['timestamps']) <= 100
+
+    with pytest.raises(ValueError):
+        history.query(START, START + 60, 10, ['unknown'])
+
+    # Sample older than the current point is dropped
+    history.add(START, make_state(99.0))
+    assert max(history.query(START, START + 7200, 600)['values']['cpu_usage_percent']) == 1.0
@@ -0,0 +1,79 @@
+import math
+
+from millegrilles_instance.SystemHistory import SystemHistory
+from millegrilles_instance.SystemHistoryFile import HEADER_SIZE, RECORD_STRUCT, SystemHistoryFile
+
+START = 1_700_000_000 - 1_700_000_000 % 3600
+
+
+def make_state(i: int) -> dict:
+    return {
+        'cpu_usage_percent': float(i),
+        'load_average': [0.5, 0.25, 0.125],
+        'memory': {'total': 16 * 1024 ** 3, 'available': 8 * 1024 ** 3, 'percent': 50.0, 'used': 8 * 1024 ** 3, 'free': 1024},
+        'network_rates': {'bytes_sent_per_sec': 1024.0, 'bytes_recv_per_sec': 2048.0},
+        'disk': [{'mountpoint': '/', 'free': 25, 'used': 75, 'total': 100}],
+    }
+
+
+def test_append_and_reopen(tmp_path):
+    path = tmp_path / 'var' / 'system_history.bin'
+    history_file = SystemHistoryFile(path, capacity=100)
+    history_file.open()
+    for i in range(250):  # Wraps around the file
+        history_file.append(START + i * 10, make_state(i))
+    history_file.close()
+
+    history_file = SystemHistoryFile(path, capacity=100)
+    history_file.open()
+    records = history_file.records()
+    assert [r[0] for r in records] == list(range(151, 251))
+    seq, timestamp, cpu, load_1m = records[-1][:4]
+    assert timestamp == START + 249 * 10 and cpu == 249.0 and load_1m == 0.5
+    assert records[-1][7] == 8 * 1024 ** 3  # memory.available as a double
+
+    history = SystemHistory([(10, 3600)], max_points=1000)
+    assert history_file.replay(history) == 100
+    response = history.query(START, START + 2500, 10, ['cpu_usage_percent', 'memory_percent', 'disk_used_percent'])
+    assert response['timestamps'][0] == START + 1500
+    assert response['values']['cpu_usage_percent'][-1] == 249.0
+    assert response['values']['disk_used_percent'][0] == 75.0
+
+    # Sequence continues after the reopen
+    history_file.append(START + 2500, make_state(250))
+    assert history_file.records()[-1][0] == 251
+    history_file.close()
+
+
+def test_torn_record_skipped(tmp_path):
+    path = tmp_path / 'system_history.bin'
+    history_file = SystemHistoryFile(path, capacity=10)
+    history_file.open()
+    for i in range(5):
+        history_file.append(START + i * 10, make_state(i))
+    history_file.close()
+
+    # Corrupt the record of seq 3 (slot 3)
+    with open(path, 'r+b') as f:
+        f.seek(HEADER_SIZE + 3 * RECORD_STRUCT.size + 20)
+        f.write(b'\xff\xff\xff\xff')
+
+    history_file = SystemHistoryFile(path, capacity=10)
+    history_file.open()
+    assert [r[0] for r in history_file.records()] == [1, 2, 4, 5]
+    assert math.isnan(history_file.records()[0][-1])  # temperature_max not available
+    history_file.close()
+
+
+def test_layout_change_resets_file(tmp_path):
+    path = tmp_path / 'system_history.bin'
+    history_file = SystemHistoryFile(path, capacity=10)
+    history_file.open()
+    history_file.append(START, make_state(1))
+    history_file.close()
+
+    history_file = SystemHistoryFile(path, capacity=20)
+    history_file.open()
+    assert history_file.records() == list()
+    assert path.stat().st_size == history_file.size
+    history_file.close()
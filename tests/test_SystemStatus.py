@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, PropertyMock, patch
 from millegrilles_instance.SystemStatus import SystemStatus
 import psutil
 import time
@@ -90,17 +90,36 @@ def test_read_system_status_missing_sensors(system_status):
         assert 'system_fans' not in state
         assert 'system_battery' not in state
 
-def test_apc_info_success(system_status):
-    with patch('apcaccess.status.get', return_value="UPTIME 10\nVOLTAGE 230.0\n"), \
-         patch('apcaccess.status.parse', return_value={'UPTIME': 10, 'VOLTAGE': 230.0}):
-        asyncio.run(system_status.apc_info())
-        assert system_status._SystemStatus__apc_info == {'UPTIME': 10, 'VOLTAGE': 230.0}
-
-def test_apc_info_failure(system_status):
-    with patch('apcaccess.status.get', side_effect=Exception("Connection error")):
-        asyncio.run(system_status.apc_info())
-        assert system_status._SystemStatus__apc_info is False
-
-
-
-
+def test_apc_status_published(system_status):
+    with patch.object(system_status.apc_client.__class__, 'status', new_callable=PropertyMock,
+                      return_value={'STATUS': 'ONLINE', 'LINEV': '230.0'}):
+        state = system_status.read_system_status()
+        assert state['apc'] == {'STATUS': 'ONLINE', 'LINEV': '230.0'}
+
+def test_apc_status_not_reachable(system_status):
+    state = system_status.read_system_status()
+    assert 'apc' not in state
+
+
+def test_counter_rates():
+    from collections import namedtuple
+    from millegrilles_instance.SystemStatus import counter_rates, disk_io_rates
+    sdiskio = namedtuple('sdiskio', ['read_count', 'write_count', 'read_bytes', 'write_bytes', 'read_time', 'write_time'])
+    previous = {
+        'sda': sdiskio(100, 200, 4096, 8192, 50, 100),
+        'sdb': sdiskio(100, 200, 4096, 8192, 50, 100),
+    }
+    current = {
+        'sda': sdiskio(120, 200, 4096 + 40960, 8192, 90, 100),
+        'sdb': sdiskio(0, 0, 0, 0, 0, 0),  # Reset, skipped
+        'sdc': sdiskio(1, 1, 1, 1, 1, 1),  # New, skipped
+    }
+    rates = counter_rates(previous, current, 2.0)
+    assert list(rates.keys()) == ['sda']
+
+    sda = disk_io_rates(rates['sda'])
+    assert sda['read_iops'] == 10.0
+    assert sda['read_bytes_per_sec'] == 20480.0
+    assert sda['read_latency_ms'] == 2.0
+    assert sda['write_iops'] == 0.0
+    assert sda['write_latency_ms'] == 0.0
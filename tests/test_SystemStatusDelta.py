@@ -0,0 +1,76 @@
+import copy
+import json
+
+from millegrilles_instance.SystemStatusDelta import SystemStatusDeltaEncoder, apply_delta, diff_state
+
+
+def make_state(cpu=10.0, free=1_000_000_000, temperature=None) -> dict:
+    state = {
+        'system_state': {
+            'host': {'hostname': 'test', 'ip_addresses': ['192.168.1.10'], 'ports': {'https': 443}},
+            'cpu_count': 4,
+            'cpu_usage_percent': cpu,
+            'load_average': [0.5, 0.4, 0.3],
+            'disk': [{'mountpoint': '/', 'free': free, 'used': 10_000_000_000 - free, 'total': 10_000_000_000}],
+        },
+        'securite': '3.protege',
+        'certissuer': None,
+    }
+    if temperature is not None:
+        state['system_state']['system_temperature'] = {'coretemp': [['Core 0', temperature, 80.0, 100.0]]}
+    return state
+
+
+def test_diff_thresholds():
+    thresholds = {'system_state.cpu_usage_percent': 2.0, 'system_state.disk': 1_000_000}
+    previous = make_state()
+
+    # Below thresholds
+    changes, removed = diff_state(previous, make_state(cpu=11.0, free=1_000_500_000), thresholds)
+    assert changes == dict() and removed == list()
+
+    changes, removed = diff_state(previous, make_state(cpu=13.0), thresholds)
+    assert changes == {'system_state': {'cpu_usage_percent': 13.0}}
+
+    # Lists are sent whole
+    changes, removed = diff_state(previous, make_state(free=900_000_000), thresholds)
+    assert changes['system_state']['disk'][0]['free'] == 900_000_000
+
+
+def test_apply_delta_reconstructs_state():
+    previous = make_state(temperature=40.0)
+    current = make_state(cpu=50.0)
+    current['securite'] = '2.prive'
+    changes, removed = diff_state(previous, current, dict())
+    assert removed == [['system_state', 'system_temperature']]
+
+    snapshot = copy.deepcopy(previous)
+    assert apply_delta(previous, changes, removed) == current
+    assert previous == snapshot  # Not modified
+
+
+def test_encoder_sequence():
+    encoder = SystemStatusDeltaEncoder(keyframe_interval=3600, thresholds={'system_state.cpu_usage_percent': 5.0})
+
+    keyframe = encoder.encode(make_state())
+    assert keyframe['seq'] == 1 and keyframe['state'] == make_state()
+
+    # Slow drift is measured against the last sent value
+    assert encoder.encode(make_state(cpu=13.0)) is None
+    delta = encoder.encode(make_state(cpu=16.0))
+    assert delta['seq'] == 2 and delta['keyframe_seq'] == 1
+    assert delta['changes'] == {'system_state': {'cpu_usage_percent': 16.0}}
+    assert encoder.keyframe()['state']['system_state']['cpu_usage_percent'] == 16.0
+
+    encoder.request_keyframe()
+    keyframe = encoder.encode(make_state(cpu=16.0))
+    assert keyframe['seq'] == 3 and 'state' in keyframe
+    assert keyframe['session'] == delta['session']
+
+
+def test_delta_size():
+    """ Deltas carry only the changed fields. """
+    encoder = SystemStatusDeltaEncoder(keyframe_interval=3600)
+    keyframe = encoder.encode(make_state(temperature=40.0))
+    delta = encoder.encode(make_state(cpu=40.0, temperature=40.0))
+    assert len(json.dumps(delta)) < len(json.dumps(keyframe)) / 2
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from subprocess import CalledProcessError
+
+from millegrilles_instance.SystemdUtil import SystemdController
+
+
+def test_jobs_run_in_parallel_across_units(fake_systemctl):
+    systemctl, calls = fake_systemctl
+    controller = SystemdController(systemctl)
+
+    results = asyncio.run(controller.run_parallel([('reload', 'mg-nginx'), ('reload', 'mg-middleware')]))
+    assert [(job.action, job.unit, job.returncode) for job in results] == \
+           [('reload', 'mg-nginx', 0), ('reload', 'mg-middleware', 0)]
+
+    log = calls()
+    assert sorted([entry[2] for entry in log if entry[0] == 'start']) == \
+           [['--user', 'reload', 'mg-middleware'], ['--user', 'reload', 'mg-nginx']]
+    # Both started before either ended
+    starts = [entry[1] for entry in log if entry[0] == 'start']
+    ends = [entry[1] for entry in log if entry[0] == 'end']
+    assert max(starts) < min(ends)
+    assert [job.unit for job in controller.history] and controller.running == []
+
+
+def test_jobs_serialized_on_same_unit(fake_systemctl):
+    systemctl, calls = fake_systemctl
+    controller = SystemdController(systemctl)
+
+    asyncio.run(controller.run_parallel([('reload', 'mg-nginx'), ('restart', 'mg-nginx')]))
+    assert [entry[0] for entry in calls()] == ['start', 'end', 'start', 'end']
+
+
+def test_failure_raises(fake_systemctl, monkeypatch):
+    systemctl, calls = fake_systemctl
+    monkeypatch.setenv('FAKE_SYSTEMCTL_DELAY', '0')
+    monkeypatch.setenv('FAKE_SYSTEMCTL_FAIL', 'mg-applications')
+    controller = SystemdController(systemctl)
+
+    with pytest.raises(CalledProcessError) as e:
+        asyncio.run(controller.reload('mg-applications'))
+    assert e.value.returncode == 1
+    assert 'mg-applications failed' in e.value.stderr
+    assert controller.history[-1].returncode == 1 and controller.running == []
+
+    # Other units not affected
+    results = asyncio.run(controller.run_parallel([('start', 'mg-certs_updater'), ('reload', 'mg-applications')]))
+    assert results[0].returncode == 0
+    assert isinstance(results[1], CalledProcessError)
+    assert sorted([entry[2] for entry in calls() if entry[0] == 'start'][-2:]) == \
+           [['--user', 'reload', 'mg-applications'], ['--user', 'start', 'mg-certs_updater']]
+
+
+def test_missing_systemctl(tmp_path):
+    controller = SystemdController(str(tmp_path / 'missing'))
+    with pytest.raises(CalledProcessError) as e:
+        asyncio.run(controller.reload('mg-nginx'))
+    assert e.value.returncode == 127
+    assert controller.history[0].done